@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+"""Benchmarks computing dates and availability for an index, comparing
+the hourly bitmap used by ArlIndexer with the dict of hour to arl file
+that it replaced.
+
+Usage:
+
+    python benchmarks/bench_coverage.py [num_years]
+"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import datetime
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from met.arl.coverage import HourCoverage
+
+ONE_HOUR = datetime.timedelta(hours=1)
+DEFAULT_NUM_YEARS = 5
+
+def generate_files(num_years):
+    """Returns 12 hour time windows, with a gap every 100 days"""
+    files = []
+    dt = datetime.datetime(2015, 1, 1)
+    for i in range(num_years * 365 * 2):
+        if i % 200 != 199:
+            files.append({'file': 'f{}.arl'.format(i), 'first_hour': dt,
+                'last_hour': dt + 11 * ONE_HOUR})
+        dt += 12 * ONE_HOUR
+    return files
+
+def analyse_per_hour(files):
+    files_per_hour = {}
+    for f in files:
+        dt = f['first_hour']
+        while dt <= f['last_hour']:
+            files_per_hour[dt] = f['file']
+            dt += ONE_HOUR
+    dates = defaultdict(lambda: [])
+    sorted_hours = sorted(files_per_hour.keys())
+    for dt in sorted_hours:
+        dates[dt.date()].append(dt.hour)
+    complete_dates = [d for d in dates if len(dates[d]) == 24]
+    partial_dates = list(set(dates) - set(complete_dates))
+    return (sorted(complete_dates), sorted(partial_dates),
+        sorted_hours[0], sorted_hours[-1])
+
+def analyse_coverage(files):
+    coverage = HourCoverage.from_time_windows(files)
+    complete_dates, partial_dates = coverage.dates()
+    coverage.time_windows()
+    return complete_dates, partial_dates, coverage.start, coverage.end
+
+def measure(func, files):
+    # time separately, since tracing allocations slows things down
+    t = time.time()
+    r = func(files)
+    elapsed = time.time() - t
+    tracemalloc.start()
+    func(files)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return r, elapsed, peak
+
+def main():
+    num_years = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUM_YEARS
+    files = generate_files(num_years)
+    print("{} years, {} files".format(num_years, len(files)))
+    results = []
+    for name, func in (('per hour dict', analyse_per_hour),
+            ('hourly bitmap', analyse_coverage)):
+        r, elapsed, peak = measure(func, files)
+        results.append(r)
+        print("  {:<16} {:8.3f}s  {:10.1f} KB peak".format(
+            name, elapsed, peak / 1024))
+    assert results[0] == results[1]
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+"""Benchmarks reading arl index files, comparing the fixed format reader
+used by ArlFinder with the general purpose CSV2JSON + parse_datetimes
+parsing that it replaced.
+
+Usage:
+
+    python benchmarks/bench_index_reader.py [num_rows]
+"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from afdatetime.parsing import parse_datetimes
+from pyairfire.io import CSV2JSON
+
+from met.arl.arlfinder import read_index_file
+
+DEFAULT_NUM_ROWS = 100000
+
+def write_index_file(pathname, num_rows):
+    start = datetime.datetime(2015, 11, 2)
+    with open(pathname, 'w') as f:
+        f.write('filename,start,end,interval\n')
+        for i in range(num_rows):
+            first_hour = start + datetime.timedelta(hours=12*i)
+            last_hour = first_hour + datetime.timedelta(hours=11)
+            f.write('/storage/NWRMC/4km/{}/wrfout_d3.f{:05d}_12hr.arl,{},{},12\n'.format(
+                first_hour.strftime('%Y%m%d00'), i,
+                first_hour.strftime('%Y-%m-%d %H:%M:%S'),
+                last_hour.strftime('%Y-%m-%d %H:%M:%S')))
+
+def read_fixed_format(pathname):
+    with open(pathname, newline='') as f:
+        return sum(1 for r in read_index_file(f))
+
+def read_general(pathname):
+    n = 0
+    for row in CSV2JSON(input_file=pathname)._load():
+        parse_datetimes(row, 'start', 'end')
+        n += 1
+    return n
+
+def time_it(func, pathname, num_rows):
+    t = time.time()
+    assert func(pathname) == num_rows
+    return time.time() - t
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUM_ROWS
+    pathname = os.path.join(tempfile.mkdtemp(), 'arl12hrindex.csv')
+    write_index_file(pathname, num_rows)
+
+    print("{} rows".format(num_rows))
+    for name, func in (('fixed format', read_fixed_format),
+            ('CSV2JSON + parse_datetimes', read_general)):
+        elapsed = time_it(func, pathname, num_rows)
+        print("  {:<28} {:8.3f}s  {:8.2f} us/row".format(
+            name, elapsed, 1000000 * elapsed / num_rows))
+
+if __name__ == "__main__":
+    main()
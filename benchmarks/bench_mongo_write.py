@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+"""Benchmarks the per run latency of writing index data to mongodb, as
+ArlIndexer._write_to_mongodb_url does, comparing a fresh client (with
+index creation) and per domain dates updates on each run with the shared
+client and bulk dates update.
+
+Runs against mongomock, if it's installed, or else against the mongodb
+url given on the command line, e.g. a local mongod (the database is
+cleared first):
+
+Usage:
+
+    python benchmarks/bench_mongo_write.py [num_domains] [num_runs] [mongodb_url]
+"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from met.arl import arlindexer
+
+ONE_DAY = datetime.timedelta(days=1)
+DEFAULT_NUM_DOMAINS = 12
+DEFAULT_NUM_RUNS = 20
+DEFAULT_MONGODB_URL = 'mongodb://localhost/arlindex_benchmark'
+
+def generate_index_data(domain, num_days=365):
+    start = datetime.datetime(2015, 1, 1)
+    dates = [(start + i * ONE_DAY).strftime('%Y-%m-%d') for i in range(num_days)]
+    return {
+        'server': 'benchmark',
+        'domain': domain,
+        'latest_forecast': dates[-1] + 'T00:00:00',
+        'start': dates[0] + 'T00:00:00',
+        'end': dates[-1] + 'T23:00:00',
+        'complete_dates': dates,
+        'partial_dates': [],
+        'root_dir': '/' + domain,
+        'files': [{'file': '/{}/{}.arl'.format(domain, d),
+            'first_hour': d + 'T00:00:00', 'last_hour': d + 'T23:00:00'}
+            for d in dates],
+        'availability': [{'first_hour': dates[0] + 'T00:00:00',
+            'last_hour': dates[-1] + 'T23:00:00'}]
+    }
+
+def write_unshared(config, index_data):
+    """Emulates writing with a new client, index creation, and one
+    update per domain
+    """
+    arlindexer.ArlIndexDB._clients.clear()
+    arlindexer.ArlIndexDB._indices_created.clear()
+    arlindexer.MetFilesCollection(**config).update(index_data)
+    dates = arlindexer.MetDatesCollection(**config)
+    for d in dates.compute():
+        dates.dates.update_one({'domain': d['domain']}, {'$set': d},
+            upsert=True)
+
+def write_shared(config, index_data):
+    arlindexer.MetFilesCollection(**config).update(index_data)
+    arlindexer.MetDatesCollection(**config).compute_and_save()
+
+def main():
+    num_domains = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUM_DOMAINS
+    num_runs = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_NUM_RUNS
+    config = {'mongodb_url': sys.argv[3] if len(sys.argv) > 3
+        else DEFAULT_MONGODB_URL}
+
+    try:
+        import mongomock
+        # one in-memory server, since mongomock clients don't share data
+        client = mongomock.MongoClient()
+        arlindexer.ArlIndexDB.create_client = classmethod(
+            lambda cls, mongodb_url=None, **config: client)
+        print("Using mongomock")
+    except ImportError:
+        print("Using {}".format(config['mongodb_url']))
+
+    index_data = [generate_index_data('domain{}'.format(i))
+        for i in range(num_domains)]
+    print("{} domains, {} runs".format(num_domains, num_runs))
+    for name, func in (('unshared', write_unshared),
+            ('shared + bulk', write_shared)):
+        arlindexer.MetFilesCollection(**config).clear()
+        arlindexer.MetDatesCollection(**config).clear()
+        elapsed = []
+        for i in range(num_runs):
+            data = index_data[i % num_domains]
+            t = time.time()
+            func(config, data)
+            elapsed.append(time.time() - t)
+        print("  {:<16} {:8.2f}ms per run (mean)  {:8.2f}ms (max)".format(
+            name, 1000 * sum(elapsed) / num_runs, 1000 * max(elapsed)))
+
+if __name__ == "__main__":
+    main()
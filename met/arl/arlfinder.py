@@ -78,36 +78,208 @@ filename,start,end,interval
 __author__ = "Joel Dubowy"
 __copyright__ = "Copyright 2016, AirFire, PNW, USFS"
 
+import csv
 import datetime
+import functools
 #import glob
+import heapq
+import json
 import logging
 import os
 import re
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
-from afdatetime.parsing import (
-    parse_datetimes, parse_utc_offset, parse as parse_dt
-)
+from afdatetime.parsing import parse_utc_offset, parse as parse_dt
 from pyairfire.data import utils as datautils
-from pyairfire.io import CSV2JSON
+
+from .discoverycache import IndexFileDiscoveryCache, list_dir
+from .findstats import FindStats
+from .manifest import ArlManifest
+from .resultcache import SearchDependencies, shared_cache
+from .listingcache import DirectoryListingCache
 
 __all__ = [
-    'ArlFinder'
+    'ArlFinder',
+    'DateMatcher',
+    'read_index_file'
 ]
 
 ONE_HOUR = datetime.timedelta(hours=1)
 ONE_DAY = datetime.timedelta(days=1)
 
+##
+## Reading Index Files
+##
+
+INDEX_FILE_HEADER = ['filename', 'start', 'end', 'interval']
+
+def parse_index_timestamp(val):
+    """Parses an index file timestamp.
+
+    Index files always use '%Y-%m-%d %H:%M:%S', so the fields are sliced
+    straight out of the string rather than run through the general purpose
+    parser, which tries a list of formats.  Anything that doesn't look like
+    that format is handed off to the general purpose parser.
+    """
+    if (len(val) == 19 and val[4] == '-' and val[7] == '-' and val[10] == ' '
+            and val[13] == ':' and val[16] == ':'):
+        try:
+            return datetime.datetime(int(val[0:4]), int(val[5:7]),
+                int(val[8:10]), int(val[11:13]), int(val[14:16]),
+                int(val[17:19]))
+        except ValueError:
+            pass
+    return parse_dt(val)
+
+def read_index_file(f):
+    """Generates (filename, start, end) tuples from the rows of an open
+    index file, with start and end parsed into datetime objects
+
+    Rows are split on commas directly unless they contain quotes or the
+    wrong number of commas, in which case they're parsed with the csv module.
+    """
+    header = f.readline()
+    if not header:
+        return
+    header = [h.strip() for h in next(csv.reader([header]))]
+    if header == INDEX_FILE_HEADER:
+        fi, si, ei = 0, 1, 2
+    else:
+        try:
+            fi, si, ei = (header.index(k) for k in ('filename', 'start', 'end'))
+        except ValueError:
+            raise ValueError("Invalid index file header: {}".format(
+                ','.join(header)))
+    num_commas = len(header) - 1
+
+    for line in f:
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+        if '"' in line or line.count(',') != num_commas:
+            row = next(csv.reader([line]))
+        else:
+            row = line.split(',')
+        yield (row[fi], parse_index_timestamp(row[si]),
+            parse_index_timestamp(row[ei]))
+
+
+class DateMatcher(object):
+    """Matches pathnames containing any of a set of %Y%m%d or %Y%m%d%H
+    date strings, or containing any 10 digit string if no date strings
+    are specified.
+
+    This is equivalent to matching with the regex
+    '.*(<date_str_1>|<date_str_2>|...)', but instead of trying every
+    alternative at every position in the pathname, it pulls the runs of
+    8 or more digits out of the pathname once and looks up the candidate
+    date strings in a set.  So, the cost of matching doesn't grow with
+    the number of dates.
+    """
+
+    DIGITS_MATCHER = re.compile(r'\d{8,}')
+
+    def __init__(self, date_strs=None, date_str_len=10):
+        """Constructor
+
+        args:
+         - date_strs -- list of date strings, all either in %Y%m%d or
+            in %Y%m%d%H format
+
+        kwargs:
+         - date_str_len -- length of the digit strings to match if
+            date_strs isn't specified; default 10 (%Y%m%d%H)
+        """
+        self._date_strs = list(date_strs or [])
+        self._date_str_set = frozenset(self._date_strs)
+        # %Y%m%d dates of the date strings, for matching daily dirs
+        self._day_set = frozenset(d[:8] for d in self._date_strs)
+        self._date_str_len = (len(self._date_strs[0])
+            if self._date_strs else date_str_len)
+        if len(set(len(d) for d in self._date_strs)) > 1:
+            raise ValueError("Date strings must all be the same length")
+
+    @classmethod
+    def union(cls, matchers):
+        """Returns a DateMatcher that matches anything matched by any of
+        the given matchers
+        """
+        if any(m.matches_all for m in matchers):
+            return cls(date_str_len=min(m._date_str_len for m in matchers))
+        return cls(sorted(set().union(*[m._date_str_set for m in matchers])))
+
+    @property
+    def pattern(self):
+        """The equivalent regex pattern"""
+        if not self._date_strs:
+            return r'.*(\d{{{}}})'.format(self._date_str_len)
+        return '.*({})'.format('|'.join(self._date_strs))
+
+    @property
+    def matches_all(self):
+        return not self._date_strs
+
+    @property
+    def date_strs(self):
+        return list(self._date_strs)
+
+    @property
+    def date_str_len(self):
+        return self._date_str_len
+
+    def covers(self, other):
+        """Returns True if every pathname matched by DateMatcher 'other'
+        is also matched by this one
+        """
+        if self.matches_all:
+            return other._date_str_len >= self._date_str_len
+        return (not other.matches_all
+            and other._date_str_len == self._date_str_len
+            and other._date_str_set <= self._date_str_set)
+
+    def matches_date_dir(self, name):
+        """Returns True if the %Y%m%d[%H] named dir may contain data for
+        any of the dates, i.e. if its date or hour is one of them, or, for
+        a %Y%m%d dir, if any of the %Y%m%d%H date strings fall on its date
+        """
+        if not self._date_str_set:
+            return True
+        if len(name) == 8:
+            return name in self._day_set
+        return (name in self._date_str_set
+            or (self._date_str_len == 8 and name[:8] in self._date_str_set))
+
+    def match(self, pathname):
+        """Returns the first matching date string in pathname, or None if
+        there isn't one
+        """
+        n = self._date_str_len
+        for m in self.DIGITS_MATCHER.finditer(pathname):
+            digits = m.group()
+            if not self._date_str_set:
+                if len(digits) >= n:
+                    return digits[:n]
+                continue
+            for i in range(len(digits) - n + 1):
+                if digits[i:i+n] in self._date_str_set:
+                    return digits[i:i+n]
+        # else, returns None
+
 class ArlFinder(object):
 
     DEFAULT_INDEX_FILENAME_PATTERN = "arl12hrindex.csv"
     DEFAULT_MAX_DAYS_OUT = 4
+    DEFAULT_MANIFEST_MAX_AGE = 3600 # seconds
 
     def __init__(self, met_root_dir, **config):
         """Constructor
 
         args:
-         - met_root_dir -- restrict search to files under this dir
+         - met_root_dir -- restrict search to files under this dir, or
+            list of dirs to search, in order of preference (see below)
 
         config options:
          - index_filename_pattern -- index file name pattern to search for;
@@ -118,6 +290,28 @@ class ArlFinder(object):
          - fewer_arl_files -- sacrifice recency of data for fewer numer of files
          - accepted_forecasts -- whitelist of specific forecasts to consider;
             e.g. consider only 2019-09-01 00Z forecast for
+         - discovery_cache_file -- pathname of file in which to cache the
+            directories and index files found under met_root_dir; repeat
+            searches only re-list directories whose mtimes have changed.
+            (see met.arl.discoverycache)
+         - max_search_depth -- max depth, relative to met_root_dir, of
+            directories to search for index files; default: no limit
+         - parse_workers -- number of threads with which to parse index
+            files and look for the arl files they list; default: 1
+         - root_timeout -- when searching multiple root dirs, number of
+            seconds to wait for each root dir's search before giving up
+            on it; default: no limit
+         - manifest_file -- pathname of manifest written by ArlIndexer
+            (see met.arl.manifest) to use in place of searching
+            met_root_dir, if it's fresh and covers the search; otherwise,
+            met_root_dir is searched as usual
+         - manifest_max_age -- number of seconds after which the manifest
+            is considered stale; default: 3600
+         - result_cache_size -- max number of results to keep in the
+            process wide result cache, which is shared by all finders;
+            cached results are revalidated against the mtimes and sizes of
+            the dirs and index files they were computed from before being
+            reused (see met.arl.resultcache); default: 0 (no caching)
 
         e.g. fewer_arl_files:
           Suppose there's one arl file with 84 hours starting at
@@ -132,20 +326,26 @@ class ArlFinder(object):
           (The reason for supporting this option is because HYSPLIT sometimes
           fails when you specify two arl files with overlapping times)
 
+        e.g. multiple root dirs:
+          With met_root_dir set to ['/ssd/NWRMC/4km', '/storage/NWRMC/4km'],
+          both root dirs are searched concurrently, and their arl files are
+          merged.  Any arl file with the same name and time window as one
+          found under a preceding root dir is dropped, so that, here, copies
+          on the local SSD are used in place of those on NFS.  If
+          root_timeout is set, root dirs whose searches take longer are
+          skipped (with a warning) rather than holding up the others.
+
         TODO: rename 'fewer_arl_files' option as 'minimize_num_files',
           'no_overlaps', 'minimize_overlaps', or something else.
         """
-        # make sure met_root_dir is an existing directory
-        try:
-            # TODO: make sure os.path.isdir prptects against injects attacks
-            #  Ex:  os.path.isdir('/ && rm -rf /')
-            #  I tested on OSX and it worked safely, but not sure about other
-            #  platforms
-            if not met_root_dir or not os.path.isdir(met_root_dir):
-                raise ValueError("{} is not a valid directory".format(met_root_dir))
-        except TypeError:
+        met_root_dirs = (list(met_root_dir)
+            if isinstance(met_root_dir, (list, tuple)) else [met_root_dir])
+        if not met_root_dirs:
             raise ValueError("{} is not a valid directory".format(met_root_dir))
-        self._met_root_dir = met_root_dir
+        for d in met_root_dirs:
+            self._validate_met_root_dir(d)
+        self._met_root_dirs = met_root_dirs
+        self._met_root_dir = met_root_dirs[0]
         self._index_filename_matcher = re.compile(
             config.get("index_filename_pattern") or
             self.DEFAULT_INDEX_FILENAME_PATTERN)
@@ -156,20 +356,78 @@ class ArlFinder(object):
         self._ignore_matcher = (config.get('ignore_pattern')
             and re.compile('.*{}.*'.format(config['ignore_pattern'])))
         self._fewer_arl_files = not not config.get('fewer_arl_files')
+        self._max_search_depth = (None if config.get("max_search_depth") is None
+            else int(config["max_search_depth"]))
+        self._parse_workers = max(1, int(config.get("parse_workers") or 1))
+        # if set, used in place of a new listing cache for each search
+        # (see met.arl.multiindexer)
+        self._shared_listing_cache = None
 
         self._accepted_forecasts = self._get_accepted_forecasts(config)
 
+        self._discovery_cache = (config.get('discovery_cache_file')
+            and IndexFileDiscoveryCache(config['discovery_cache_file'],
+                self._index_filename_matcher))
+
+        self._manifest_file = config.get('manifest_file')
+        self._manifest_max_age = (self.DEFAULT_MANIFEST_MAX_AGE
+            if config.get('manifest_max_age') is None
+            else float(config['manifest_max_age']))
+        # loaded manifest, along with the (mtime, size) of its file
+        self._manifest = None
+        self._manifest_key = None
+
+        # Results are cached per time window and config, so that finders
+        # with different configs can share the cache
+        result_cache_size = int(config.get('result_cache_size') or 0)
+        self._result_cache = (shared_cache(result_cache_size)
+            if result_cache_size > 0 else None)
+        self._result_cache_key = json.dumps([met_root_dirs, config],
+            sort_keys=True, default=str)
+
+        # With multiple root dirs, each is searched by its own single
+        # root ArlFinder, all sharing one discovery cache
+        self._root_timeout = (config.get('root_timeout')
+            and float(config['root_timeout']))
+        self._root_finders = None
+        if len(met_root_dirs) > 1:
+            root_config = dict(config, discovery_cache_file=None,
+                result_cache_size=None)
+            self._root_finders = [ArlFinder(d, **root_config)
+                for d in met_root_dirs]
+            for f in self._root_finders:
+                f._discovery_cache = self._discovery_cache
+        # each root finder's search thread, which may outlive the search
+        # that started it if it times out
+        self._root_searches = {}
+        self._root_searches_lock = threading.Lock()
+
+    def _validate_met_root_dir(self, met_root_dir):
+        # make sure met_root_dir is an existing directory
+        try:
+            # TODO: make sure os.path.isdir prptects against injects attacks
+            #  Ex:  os.path.isdir('/ && rm -rf /')
+            #  I tested on OSX and it worked safely, but not sure about other
+            #  platforms
+            if not met_root_dir or not os.path.isdir(met_root_dir):
+                raise ValueError("{} is not a valid directory".format(met_root_dir))
+        except TypeError:
+            raise ValueError("{} is not a valid directory".format(met_root_dir))
 
     START_AND_END_REQUIRED = (
         'Start and end times must be defined to find arl data')
 
-    def find(self, start, end):
+    def find(self, start, end, include_stats=False):
         """finds met data spanning start/end time window
 
         args:
          - start -- UTC start of time window
          - end -- UTC end of time window
 
+        kwargs:
+         - include_stats -- include wall time per stage and counters
+            of work done (see met.arl.findstats) under 'stats'
+
         This method searches for all arl met files under self._met_root_dir
         with data spanning the given time window and determines which file
         to use for each hour in the window.  The goal is to use the most
@@ -218,14 +476,307 @@ class ArlFinder(object):
         if not start or not end:
             raise ValueError(self.START_AND_END_REQUIRED)
 
-        date_matcher = self._create_date_matcher(start, end)
-        index_files = self._find_index_files(date_matcher)
-        arl_files = self._parse_index_files(index_files)
-        files_per_hour = self._determine_files_per_hour(arl_files, start, end)
-        files = self._determine_file_time_windows(files_per_hour)
-        files = datautils.format_datetimes(files)
+        stats = FindStats() if include_stats else None
+        r = self.find_many([(start, end)], stats=stats)[0]
+        if stats:
+            r['stats'] = stats.to_dict()
+        return r
+
+    def find_many(self, windows, stats=None):
+        """finds met data for each of multiple time windows
+
+        args:
+         - windows -- list of (start, end) tuples of UTC datetimes
 
-        return {'files': files}
+        kwargs:
+         - stats -- FindStats object in which to record the wall time
+            of each stage and counters of work done
+
+        Index files are searched for and parsed only once, for the union
+        of the time windows, and then the arl files to use for each window
+        are determined from the shared list of parsed arl files.  Returns
+        a list with one result per window, in order, each identical to
+        what find would return for that window.
+        """
+        windows = list(windows)
+        if any(not start or not end for start, end in windows):
+            raise ValueError(self.START_AND_END_REQUIRED)
+        if not windows:
+            return []
+
+        stats = stats or FindStats()
+        with stats.time('total'):
+            if self._result_cache is not None:
+                results = self._find_many_cached(windows, stats)
+            else:
+                results = self._find_many(windows, stats)
+            stats.incr('windows', len(windows))
+
+        logging.debug('arlfinder stats: %s', json.dumps(stats.to_dict()))
+        return results
+
+    def _find_many_cached(self, windows, stats):
+        keys = [(self._result_cache_key, start.isoformat(), end.isoformat())
+            for start, end in windows]
+        results = [self._result_cache.get(k) for k in keys]
+        missing = [i for i, r in enumerate(results) if r is None]
+        stats.update({
+            'result_cache_hits': len(windows) - len(missing),
+            'result_cache_misses': len(missing)
+        })
+        if missing:
+            dependencies = SearchDependencies()
+            computed = self._find_many([windows[i] for i in missing], stats,
+                dependencies)
+            for i, r in zip(missing, computed):
+                self._result_cache.put(keys[i], r, dependencies)
+                results[i] = r
+        return results
+
+    def _find_many(self, windows, stats, dependencies=None):
+        date_matchers = [self._create_date_matcher(start, end)
+            for start, end in windows]
+        if self._discovery_cache:
+            cache_counts = (self._discovery_cache.hits,
+                self._discovery_cache.misses)
+        parsed = self._load_index_files(DateMatcher.union(date_matchers),
+            stats, dependencies)
+        if self._discovery_cache:
+            stats.update({
+                'discovery_cache_hits':
+                    self._discovery_cache.hits - cache_counts[0],
+                'discovery_cache_misses':
+                    self._discovery_cache.misses - cache_counts[1]
+            })
+
+        results = []
+        for (start, end), date_matcher in zip(windows, date_matchers):
+            arl_files = self._select_arl_files(parsed, date_matcher, stats)
+            with stats.time('determine_time_windows'):
+                files = self._determine_time_windows(arl_files, start, end)
+            with stats.time('format'):
+                files = datautils.format_datetimes(files)
+            results.append({'files': files})
+
+        return results
+
+
+    def _load_index_files(self, date_matcher, stats, dependencies=None):
+        """Returns list of (index file, list of arl files) tuples, for
+        all index files matching date_matcher
+
+        args:
+         - date_matcher -- DateMatcher of the search
+         - stats -- FindStats of the search
+
+        kwargs:
+         - dependencies -- SearchDependencies to which to add the paths
+            read, if caching results
+
+        Subclasses can override this to provide parsed index files from
+        somewhere other than a search of the filesystem.
+        """
+        if self._root_finders:
+            return self._load_index_files_from_roots(date_matcher, stats,
+                dependencies)
+
+        if self._manifest_file:
+            parsed = self._load_index_files_from_manifest(date_matcher, stats,
+                dependencies)
+            if parsed is not None:
+                return parsed
+
+        with stats.time('find_index_files'):
+            index_files = self._find_index_files(date_matcher, stats,
+                dependencies)
+        with stats.time('parse_index_files'):
+            parsed = self._parse_each_index_file(index_files, stats,
+                dependencies)
+        return list(zip(index_files, parsed))
+
+    def _load_index_files_from_roots(self, date_matcher, stats,
+            dependencies=None):
+        """Searches each root dir in its own thread, returning the
+        combined results in root dir order
+
+        Daemon threads are used, rather than a thread pool, so that a
+        search hung on an unresponsive mount doesn't keep the process
+        from exiting once it has given up on it.  Each root's search
+        records its stats separately, and they're added to 'stats' only
+        if it finishes in time.  A root whose previous search timed out
+        and is still running is skipped, rather than searched again
+        concurrently.
+        """
+        results = [None] * len(self._root_finders)
+        root_stats = [FindStats() for f in self._root_finders]
+        def search(i, finder):
+            try:
+                results[i] = finder._load_index_files(date_matcher,
+                    root_stats[i], dependencies)
+            except Exception as e:
+                logging.warning('Failed to search %s: %s',
+                    finder._met_root_dir, e)
+                results[i] = e
+
+        threads = []
+        skipped = set()
+        with self._root_searches_lock:
+            for i, f in enumerate(self._root_finders):
+                previous = self._root_searches.get(i)
+                if previous and previous.is_alive():
+                    logging.warning('Skipping %s, since its previous search'
+                        ' is still running', f._met_root_dir)
+                    skipped.add(i)
+                    continue
+                t = threading.Thread(target=search, args=(i, f), daemon=True)
+                self._root_searches[i] = t
+                threads.append(t)
+        for t in threads:
+            t.start()
+        deadline = self._root_timeout and time.time() + self._root_timeout
+        for t in threads:
+            t.join(deadline and max(0, deadline - time.time()))
+
+        parsed = []
+        for i, (finder, r) in enumerate(zip(self._root_finders, results)):
+            if i in skipped:
+                stats.incr('roots_skipped')
+            elif r is None:
+                logging.warning('Gave up on searching %s after %s seconds',
+                    finder._met_root_dir, self._root_timeout)
+                stats.incr('roots_timed_out')
+            else:
+                stats.merge(root_stats[i])
+                if isinstance(r, Exception):
+                    stats.incr('roots_failed')
+                else:
+                    parsed.extend(r)
+                    continue
+            # don't reuse results missing a root dir's arl files
+            if dependencies is not None:
+                dependencies.expire_at(time.time())
+        if self._discovery_cache:
+            self._discovery_cache.save()
+        return parsed
+
+    def _load_index_files_from_manifest(self, date_matcher, stats,
+            dependencies=None):
+        """Returns the parsed index files in the manifest that a search
+        for date_matcher would find, or None if the manifest is missing,
+        stale, or doesn't contain the results of such a search
+        """
+        if dependencies is not None:
+            dependencies.add(self._manifest_file)
+        with stats.time('load_manifest'):
+            manifest = self._load_manifest()
+
+        reason = None
+        if not manifest:
+            reason = 'missing or invalid'
+        elif manifest.age > self._manifest_max_age:
+            reason = 'generated {} seconds ago'.format(int(manifest.age))
+        elif (manifest.search != self._manifest_search()
+                or not DateMatcher(manifest.date_strs,
+                    manifest.date_str_len).covers(date_matcher)):
+            reason = "doesn't cover search"
+        if reason:
+            logging.info('Not using manifest %s (%s); searching %s',
+                self._manifest_file, reason, self._met_root_dir)
+            stats.incr('manifest_fallbacks')
+            return None
+
+        stats.incr('manifest_used')
+        if dependencies is not None:
+            dependencies.expire_at(
+                time.time() + self._manifest_max_age - manifest.age)
+        return [(f, arl_files) for f, arl_files in manifest.parsed
+            if self._index_file_in_window(f, date_matcher)]
+
+    def _load_manifest(self):
+        """Returns the manifest, re-loading it only if its file changed"""
+        try:
+            st = os.stat(self._manifest_file)
+            key = (st.st_mtime, st.st_size)
+        except OSError:
+            return None
+        if key != self._manifest_key:
+            self._manifest = ArlManifest.load(self._manifest_file)
+            self._manifest_key = key
+        return self._manifest
+
+    def _manifest_search(self):
+        """Returns the search parameters, other than date matcher, that
+        determine which index files are found
+        """
+        return {
+            'root_dir': os.path.normpath(os.path.abspath(self._met_root_dir)),
+            'index_filename_pattern': self._index_filename_matcher.pattern,
+            'ignore_pattern': (self._ignore_matcher
+                and self._ignore_matcher.pattern),
+            'max_search_depth': self._max_search_depth
+        }
+
+    def _select_arl_files(self, parsed, date_matcher, stats):
+        """Returns the arl files listed in the parsed index files that a
+        search for date_matcher alone would have found
+
+        With multiple root dirs, arl files with the same name and time
+        window as one listed under a preceding root dir are dropped.
+        """
+        if not self._root_finders:
+            return [f for index_file, f_arl_files in parsed
+                if self._index_file_in_window(index_file, date_matcher)
+                for f in f_arl_files]
+
+        arl_files = []
+        # keys of arl files under preceding root dirs, and under the
+        # current one; duplicates within a root dir are left alone
+        seen = set()
+        root_keys = set()
+        root_dir = None
+        num_dropped = 0
+        for index_file, f_arl_files in parsed:
+            if not self._index_file_in_window(index_file, date_matcher):
+                continue
+            index_file_root_dir = self._root_dir_of(index_file)
+            if index_file_root_dir != root_dir:
+                seen.update(root_keys)
+                root_keys = set()
+                root_dir = index_file_root_dir
+            for f in f_arl_files:
+                key = (os.path.basename(f['file']), f['first_hour'],
+                    f['last_hour'])
+                if key in seen:
+                    num_dropped += 1
+                else:
+                    root_keys.add(key)
+                    arl_files.append(f)
+        stats.incr('duplicate_arl_files_dropped', num_dropped)
+        return arl_files
+
+    def _recency_key(self, f):
+        """Returns the key by which arl files are sorted to find the most
+        recent: the pathname, relative to its root dir if there are
+        multiple, so that the root dirs' names don't outrank forecast init
+        times
+        """
+        pathname = f['file']
+        if self._root_finders:
+            root_dir = os.path.join(self._root_dir_of(pathname), '')
+            if pathname.startswith(root_dir):
+                return pathname[len(root_dir):]
+        return pathname
+
+    def _root_dir_of(self, pathname):
+        """Returns the root dir that pathname is under, picking the most
+        specific one if root dirs are nested
+        """
+        if len(self._met_root_dirs) > 1:
+            candidates = [d for d in self._met_root_dirs
+                if pathname.startswith(os.path.join(d, ''))]
+            if candidates:
+                return max(candidates, key=len)
+        return self._met_root_dir
 
 
     ##
@@ -259,7 +810,7 @@ class ArlFinder(object):
       "Accepted forecasts are all outside time window")
 
     def _create_date_matcher(self, start, end):
-        """Returns a compiled regex object that matches %Y%m%d[%H] date strings
+        """Returns a DateMatcher that matches %Y%m%d[%H] date strings
         for all dates between start and end, plus N days prior.  If neither
         start nor end is specified, all dates will be matched
 
@@ -292,15 +843,14 @@ class ArlFinder(object):
                 # ignoring hour portion of datetime string
                 date_strs = [d.strftime('%Y%m%d') for d in dates_to_match]
             else:
-                date_strs = ["\d{10}"]
+                date_strs = None
 
-        date_matcher = re.compile(".*({})".format(
-            '|'.join(date_strs)))
+        date_matcher = DateMatcher(date_strs)
 
         logging.debug('date matcher pattern: {}'.format(date_matcher.pattern))
         return date_matcher
 
-    def _find_index_files(self, date_matcher):
+    def _find_index_files(self, date_matcher, stats=None, dependencies=None):
         """Searches for index files under dir
 
         Example index file locations:
@@ -316,18 +866,112 @@ class ArlFinder(object):
             /storage/NWRMC/4km/2015110300/arl12hrindex.csv
         """
         index_files = []
-        for root, dirs, files in os.walk(self._met_root_dir):
+        for root, index_filenames in self._walk(self._met_root_dir,
+                date_matcher, stats, dependencies):
             #logging.debug('Root: {}'.format(root))
             if date_matcher.match(root) and (not self._ignore_matcher or
                     not self._ignore_matcher.match(root)):
-                for f in files:
-                    if self._index_filename_matcher.match(f): #(os.path.basename(f)):
-                        pathname = os.path.join(root, f)
-                        logging.debug('found index file: {}'.format(pathname))
-                        index_files.append(pathname)
+                for f in index_filenames:
+                    pathname = os.path.join(root, f)
+                    logging.debug('found index file: {}'.format(pathname))
+                    index_files.append(pathname)
+        if self._discovery_cache:
+            self._discovery_cache.save()
+        if stats:
+            stats.incr('index_files_found', len(index_files))
         logging.debug('Found {} index files'.format(len(index_files)))
         return index_files
 
+    def _walk(self, top, date_matcher=None, stats=None, dependencies=None):
+        """Walks the directory tree under top, top-down, yielding each
+        directory's pathname along with the names of the index files in it
+
+        Subdirectories are pruned before being descended into if they
+        match the ignore pattern, if they're named with a %Y%m%d[%H]
+        date that's outside of the time window, or if they're deeper than
+        the max search depth.
+        """
+        stack = [(top, 0)]
+        while stack:
+            root, depth = stack.pop()
+            dirs, index_filenames = self._list_dir(root, dependencies)
+            yield root, index_filenames
+            if stats:
+                stats.incr('dirs_visited')
+            if (self._max_search_depth is not None
+                    and depth >= self._max_search_depth):
+                continue
+            # push in reverse so that subdirectories are visited in order
+            subdirs = [os.path.join(root, d) for d in reversed(dirs)
+                if not self._prune(root, d, date_matcher)]
+            stack.extend((d, depth + 1) for d in subdirs)
+            if stats:
+                stats.incr('dirs_pruned', len(dirs) - len(subdirs))
+
+    DATE_DIR_NAME_MATCHER = re.compile(r'^\d{8}(\d{2})?$')
+
+    def _prune(self, root, name, date_matcher):
+        """Returns True if the directory 'name' under 'root' can't contain
+        any index files of interest.
+
+        Since the ignore pattern is matched anywhere in a pathname, every
+        pathname under an ignored directory would be ignored as well.
+        Dated directories are pruned only if their own date is outside the
+        time window and nothing else in their pathname matches the date
+        matcher (e.g. '/DRI_2km/20151020' is pruned for a 2015-11-01 -
+        2015-11-03 time window, but '/foo/2015110200/20151020' is not, nor,
+        with the accepted forecast 2015110200, is the daily dir
+        '/DRI_2km/20151102').
+        """
+        pathname = os.path.join(root, name)
+        if self._ignore_matcher and self._ignore_matcher.match(pathname):
+            logging.debug('Pruning ignored dir %s', pathname)
+            return True
+
+        if self._is_dated_outside_window(pathname, name, date_matcher):
+            logging.debug('Pruning dir %s outside of time window', pathname)
+            return True
+
+        return False
+
+    def _is_dated_outside_window(self, pathname, name, date_matcher):
+        if (not date_matcher or date_matcher.matches_all
+                or not self.DATE_DIR_NAME_MATCHER.match(name)):
+            return False
+        try:
+            datetime.datetime.strptime(name, '%Y%m%d%H' if len(name) == 10
+                else '%Y%m%d')
+        except ValueError:
+            # not actually a date
+            return False
+
+        return (not date_matcher.matches_date_dir(name)
+            and not date_matcher.match(pathname))
+
+    def _index_file_in_window(self, index_file, date_matcher):
+        """Returns True if a search with date_matcher would find index_file
+        (assuming index_file was found by a search of the same root)
+        """
+        index_file_dir = os.path.dirname(index_file)
+        if not date_matcher.match(index_file_dir):
+            return False
+
+        root_dir = self._root_dir_of(index_file)
+        rel_dir = os.path.relpath(index_file_dir, root_dir)
+        pathname = root_dir
+        for name in (rel_dir.split(os.sep) if rel_dir != os.curdir else []):
+            pathname = os.path.join(pathname, name)
+            if self._is_dated_outside_window(pathname, name, date_matcher):
+                return False
+        return True
+
+    def _list_dir(self, dirname, dependencies=None):
+        if dependencies is not None:
+            dependencies.add(dirname)
+        if self._discovery_cache:
+            return self._discovery_cache.list_dir(dirname)
+        return list_dir(dirname, self._index_filename_matcher)
+
     ##
     ## Parsing Index Files
     ##
@@ -337,37 +981,100 @@ class ArlFinder(object):
 
         args:
          - index_files -- list of index file names
+
+        If self._parse_workers > 1, index files are parsed concurrently.
+        Either way, arl files are returned in the order of index_files.
         """
         arl_files = []
-        for f in index_files:
+        for f_arl_files in self._parse_each_index_file(index_files):
             #logging.debug(files_per_hour)
-            arl_files.extend(self._parse_index_file(f))
+            arl_files.extend(f_arl_files)
         return arl_files
 
-    def _parse_index_file(self, index_file):
+    def _parse_each_index_file(self, index_files, stats=None,
+            dependencies=None):
+        """Returns list of the arl files listed in each index file, in the
+        order of index_files
+
+        Existence of arl files is checked against a fresh directory
+        listing cache, so that each directory is listed only once per
+        search.
+        """
+        if dependencies is not None:
+            for f in index_files:
+                dependencies.add(f)
+        if self._shared_listing_cache is not None:
+            listing_cache = self._shared_listing_cache
+        else:
+            listing_cache = DirectoryListingCache(on_list=(
+                dependencies.add if dependencies is not None else None))
+        parsed = self._map(functools.partial(self._parse_index_file,
+            listing_cache=listing_cache, stats=stats), index_files)
+        logging.debug('Directory listing cache stats: %s',
+            listing_cache.stats())
+        if stats:
+            stats.update({
+                'index_files_parsed': len(index_files),
+                'arl_files_found': sum(len(p) for p in parsed),
+                'arl_dir_listings': listing_cache.listings,
+                'arl_listing_cache_hits': listing_cache.hits,
+                'arl_negative_lookups': listing_cache.negative_lookups
+            })
+        return parsed
+
+    def _map(self, func, items):
+        """Returns list of func applied to each item, in order, using a
+        pool of self._parse_workers threads if more than one.
+
+        Parsing index files and checking the existence of arl files is
+        dominated by filesystem round trips (especially on NFS), which
+        release the GIL, so threads are sufficient.
+        """
+        num_workers = min(self._parse_workers, len(items))
+        if num_workers > 1:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                return list(executor.map(func, items))
+        return [func(i) for i in items]
+
+    def _parse_index_file(self, index_file, listing_cache=None, stats=None):
         """Parses arl index files, extracting each arl file with its start
         hour and last our
 
         args:
-         - files_per_hour -- lists which met file to use for each hour
          - index_file -- pathname of index file to parse
+
+        kwargs:
+         - listing_cache -- DirectoryListingCache of the search
+         - stats -- FindStats of the search
         """
         arl_files = []
-        for row in CSV2JSON(input_file=index_file)._load():
-            tw = parse_datetimes(row, 'start', 'end')
-            f = self._get_file_pathname(index_file, row['filename'])
-            if f:
-                arl_files.append(
-                    dict(file=f, first_hour=tw['start'], last_hour=tw['end']))
+        num_rows = 0
+        with self._open_index_file(index_file) as f:
+            for name, first_hour, last_hour in read_index_file(f):
+                num_rows += 1
+                pathname = self._get_file_pathname(index_file, name,
+                    listing_cache=listing_cache)
+                if pathname:
+                    arl_files.append(dict(file=pathname,
+                        first_hour=first_hour, last_hour=last_hour))
+        if stats:
+            stats.incr('rows_read', num_rows)
         return arl_files
 
-    def _get_file_pathname(self, index_file, name):
+    def _open_index_file(self, index_file):
+        return open(index_file, newline='')
+
+    def _get_file_pathname(self, index_file, name, listing_cache=None):
         """Returns absolute pathname of arl file listed in the index file
 
         args:
          - index_file -- index file listing arl file
          - name -- name of arl file, as listed in index file
 
+        kwargs:
+         - listing_cache -- DirectoryListingCache with which to check
+            existence; if not specified, the filesystem is checked directly
+
         There are various possibilties for 'name':
          - it's simply the name (no path) of a file
              -> see if exists in the dir containing the index file
@@ -383,11 +1090,12 @@ class ArlFinder(object):
                 in that dir.)
         """
         logging.debug('Checking existence of arl file %s', name)
+        isfile = listing_cache.isfile if listing_cache else os.path.isfile
         index_file_dir = os.path.dirname(index_file)
         arl_dir, arl_name = os.path.split(name)
         if arl_dir:
             # See if 'name' is an an absolute pathname that exists
-            if os.path.isfile(name):
+            if isfile(name):
                 logging.debug('Found arl file (abs path) %s', name)
                 return name
 
@@ -396,10 +1104,10 @@ class ArlFinder(object):
             # absolute path, the following call to os.path.join will
             # return 'name' itself (not the concatenation of
             # index_file_dir and name).  If that's the case (i.e. if
-            # new_name == name), then we'll skip the subsequent call
-            # call to os.path.isfile, which would be redundant.
+            # new_name == name), then we'll skip the subsequent
+            # existence check, which would be redundant.
             new_name = os.path.join(index_file_dir, name)
-            if new_name != name and os.path.isfile(new_name):
+            if new_name != name and isfile(new_name):
                 logging.debug('Found arl file (rel path) %s', new_name)
                 return new_name
 
@@ -412,7 +1120,7 @@ class ArlFinder(object):
         # doesn't exist in the path. Check if the file is in the dir
         # containing the index file
         name = os.path.join(index_file_dir, name)
-        if os.path.isfile(name):
+        if isfile(name):
             logging.debug('Found arl file (name) %s', name)
             return name
 
@@ -443,11 +1151,12 @@ class ArlFinder(object):
 
         # get most file recent of each group; this assumes that file names,
         # when sorted alphabetically, are also sorted by forecast init time
+        # (relative to their root dirs; see _recency_key)
         # TODO: record the forecast init time (which should be the start
         #   time of the first file in each index csv) to which each arl file
         #   belongs, and sort each group of arl files by that instead of by
         #   file name
-        arl_files = [sorted(files, key=lambda f: f['file'])[-1] for first_hour, files in
+        arl_files = [sorted(files, key=self._recency_key)[-1] for first_hour, files in
             sorted(list(by_first_hour.items()), key=lambda e: e[0])]
 
         # remove unecessary at beginning and end
@@ -474,6 +1183,22 @@ class ArlFinder(object):
     def _determine_files_per_hour(self, arl_files, start, end):
         """Determines which arl file to use for each hour in the time window.
 
+        Returns dict mapping each hour to the arl file pathname.  This
+        expands the time windows determined by _determine_time_windows,
+        which should be used directly when per hour assignments aren't
+        needed.
+        """
+        files_per_hour = {}
+        for f in self._determine_time_windows(arl_files, start, end):
+            dt = f['first_hour']
+            while dt <= f['last_hour']:
+                files_per_hour[dt] = f['file']
+                dt += ONE_HOUR
+        return files_per_hour
+
+    def _determine_time_windows(self, arl_files, start, end):
+        """Determines which arl file to use for each hour in the time window.
+
         If self._fewer_arl_files isn't specified, this method picks the most
         recent data for each hour.  If self._fewer_arl_files is True, on the
         other hand, the goal is to use as few arl files as possible, in which
@@ -492,33 +1217,112 @@ class ArlFinder(object):
         hour.  In this case, the file whose name is alphabetically last is the
         the most recent.  (Note: This assumes that the prediction time is in
         the pathname.)
+
+        Rather than assigning files hour by hour, this method computes
+        the range of hours for which each file is used and emits the
+        resulting time windows directly.  The output is identical to
+        passing the output of _determine_files_per_hour to
+        _determine_file_time_windows, for hourly aligned data.
         """
         sorted_arl_files = self._prune_and_sort(arl_files, start, end)
+        if self._fewer_arl_files:
+            segments = self._assign_hours_to_fewer_files(
+                sorted_arl_files, start, end)
+        else:
+            segments = self._assign_hours_to_most_recent_files(
+                sorted_arl_files, start, end)
 
-        files_per_hour = {}
+        # merge contiguous segments using the same file
+        files = []
+        for f, first_hour, last_hour in segments:
+            if (files and files[-1]['file'] == f['file'] and
+                    first_hour - files[-1]['last_hour'] <= ONE_HOUR):
+                files[-1]['last_hour'] = last_hour
+            else:
+                files.append({'file': f['file'], 'first_hour': first_hour,
+                    'last_hour': last_hour})
+        return files
+
+    def _clip_to_time_window(self, f, start, end):
+        """Returns the first and last hours of f that are within start/end
+        """
+        first_hour = max(f['first_hour'], start) if start else f['first_hour']
+        last_hour = min(f['last_hour'], end) if end else f['last_hour']
+        if first_hour <= last_hour:
+            # keep last hour on the same hourly grid as the first
+            last_hour = first_hour + ((last_hour - first_hour) // ONE_HOUR) * ONE_HOUR
+        return first_hour, last_hour
+
+    def _assign_hours_to_most_recent_files(self, sorted_arl_files, start, end):
+        """Returns list of (file, first hour, last hour) segments, in
+        chronological order, assigning each hour to the most recent
+        file covering it.
+
+        Since sorted_arl_files is sorted by recency, each hour goes to
+        the covering file with the highest index.  This sweeps over the
+        boundaries of the files' time windows, tracking the covering files
+        in a heap keyed on index.  The assignment can't change between
+        consecutive boundaries, so each interval between boundaries
+        becomes one segment.
+        """
+        intervals = []
+        for i, f in enumerate(sorted_arl_files):
+            first_hour, last_hour = self._clip_to_time_window(f, start, end)
+            if first_hour <= last_hour:
+                intervals.append((first_hour, last_hour, i))
+
+        boundaries = sorted(set([e[0] for e in intervals]
+            + [e[1] + ONE_HOUR for e in intervals]))
+
+        segments = []
+        covering = [] # heap of (-index, last hour)
+        j = 0
+        for b, next_b in zip(boundaries, boundaries[1:]):
+            while j < len(intervals) and intervals[j][0] <= b:
+                heapq.heappush(covering, (-intervals[j][2], intervals[j][1]))
+                j += 1
+            # lazily drop files that ended before this boundary
+            while covering and covering[0][1] < b:
+                heapq.heappop(covering)
+            if covering:
+                segments.append((sorted_arl_files[-covering[0][0]],
+                    b, next_b - ONE_HOUR))
+        return segments
+
+    def _assign_hours_to_fewer_files(self, sorted_arl_files, start, end):
+        """Returns list of (file, first hour, last hour) segments, in
+        chronological order, using each file for as long as it can.
+
+        Each file is used from the hour after the last hour already
+        assigned through the end of its time window, and is skipped
+        entirely if all of its hours before the next file's first hour
+        are already assigned.
+        """
+        segments = []
+        latest = None # last hour assigned so far
         num_arl_files = len(sorted_arl_files)
-        for i in range(num_arl_files):
-            f_dict = sorted_arl_files[i]
-            dt = max(f_dict['first_hour'], start) if start else f_dict['first_hour']
+        for i, f in enumerate(sorted_arl_files):
+            first_hour, last_hour = self._clip_to_time_window(f, start, end)
+            already_assigned = latest is not None and latest >= first_hour
 
             # skip to next file if there aren't any hours in this file that aren't
-            # already in files_per_hour and that aren't covered by the next file
-            if self._fewer_arl_files:
-                if i < (num_arl_files - 1): # not at last file
-                    latest_dt = max(list(files_per_hour.keys()) + [dt]) if files_per_hour else dt
-                    if (latest_dt + ONE_HOUR > sorted_arl_files[i+1]['first_hour']
-                            # The following handles the case where start is one hour
-                            # behind the next forecast's first hour
-                            or (latest_dt + ONE_HOUR == sorted_arl_files[i+1]['first_hour']
-                                and files_per_hour.get(latest_dt))):
-                        continue
-
-            end_dt = min(f_dict['last_hour'], end) if end else f_dict['last_hour']
-            while dt <= end_dt:
-                if not files_per_hour.get(dt) or not self._fewer_arl_files:
-                    files_per_hour[dt] = f_dict
-                dt += ONE_HOUR
-        return {dt: f['file'] for dt, f in files_per_hour.items()}
+            # already assigned and that aren't covered by the next file
+            if i < (num_arl_files - 1): # not at last file
+                latest_dt = latest if already_assigned else first_hour
+                next_first_hour = sorted_arl_files[i+1]['first_hour']
+                if (latest_dt + ONE_HOUR > next_first_hour
+                        # The following handles the case where start is one hour
+                        # behind the next forecast's first hour
+                        or (latest_dt + ONE_HOUR == next_first_hour
+                            and already_assigned)):
+                    continue
+
+            if already_assigned:
+                first_hour = latest + ONE_HOUR
+            if first_hour <= last_hour:
+                segments.append((f, first_hour, last_hour))
+                latest = last_hour
+        return segments
 
     def _determine_file_time_windows(self, files_per_hour):
         """Determines time windows for which each arl file should be used.
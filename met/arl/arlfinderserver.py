@@ -0,0 +1,384 @@
+"""met.arl.arlfinderserver
+
+This module provides a long running arl finder server, which keeps the
+parsed index files of one or more met root dirs in memory, and a client
+for querying it.
+
+Each arlfinder invocation otherwise pays for interpreter startup, imports,
+and a full search of the met root dir before it can answer.  The server
+answers 'find' requests from memory, refreshing its parsed index files on
+a polling interval.  Only index files that changed (or whose directories
+changed, which is the case when arl files are added next to them) are
+re-parsed on refresh.
+
+The server speaks json over HTTP, on either a localhost port or a unix
+domain socket:
+
+    POST /find          {"root_dir": ..., "start": ..., "end": ...}
+        -> {"files": [...]}
+    POST /find_many     {"root_dir": ..., "windows": [{"start": ..., "end": ...}, ...]}
+        -> {"results": [{"files": [...]}, ...]}
+    GET /status
+        -> {"roots": {<root_dir>: {"index_files": ..., "refreshed_at": ...}}}
+
+'root_dir' defaults to the first root dir the server was started with.
+Requests for other root dirs are rejected, unless the server is started
+with allow_other_roots set, in which case they're loaded on first request
+and then kept in memory and refreshed like the others.  A root dir is
+loaded without holding up requests for other root dirs.
+"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import datetime
+import http.client
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+import traceback
+import urllib.parse
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from afdatetime.parsing import parse as parse_dt
+
+from .arlfinder import ArlFinder, DateMatcher
+
+__all__ = [
+    'InMemoryArlFinder',
+    'ArlFinderServer',
+    'ArlFinderClient'
+]
+
+class InMemoryArlFinder(ArlFinder):
+    """ArlFinder that keeps all parsed index files under its met root dir
+    in memory, only searching the filesystem when refreshed.
+    """
+
+    def __init__(self, met_root_dir, **config):
+        super(InMemoryArlFinder, self).__init__(met_root_dir, **config)
+        # Results are computed from memory, which the result cache's
+        # revalidation wouldn't know to check
+        self._result_cache = None
+        # index file -> (stat key, arl files), in search order
+        self._index_files = {}
+        self._refresh_lock = threading.Lock()
+        self.refreshed_at = None
+        self.refresh()
+
+    def refresh(self):
+        """Searches for index files, re-parsing any that are new or changed
+        """
+        with self._refresh_lock:
+            # Match anything that a search for any time window would
+            index_files = self._find_index_files(DateMatcher(
+                date_str_len=10 if self._accepted_forecasts else 8))
+
+            previous = self._index_files
+            current = {}
+            to_parse = []
+            for f in index_files:
+                key = self._stat_key(f)
+                if key and f in previous and previous[f][0] == key:
+                    current[f] = previous[f]
+                else:
+                    current[f] = None
+                    to_parse.append((f, key))
+
+            parsed = self._parse_each_index_file([f for f, key in to_parse])
+            for (f, key), arl_files in zip(to_parse, parsed):
+                current[f] = (key, arl_files)
+
+            # readers grab a reference to the whole dict, so swapping it
+            # in is safe without locking reads
+            self._index_files = current
+            self.refreshed_at = datetime.datetime.utcnow()
+            logging.debug('Refreshed %s: %s index files, %s re-parsed',
+                self._met_root_dir, len(current), len(to_parse))
+
+    def _stat_key(self, index_file):
+        # The index file's dir's mtime is included because it changes when
+        # arl files are added to the dir, which can happen after the
+        # index file is written.
+        try:
+            st = os.stat(index_file)
+            dir_st = os.stat(os.path.dirname(index_file))
+            return (st.st_mtime, st.st_size, dir_st.st_mtime)
+        except OSError:
+            return None
+
+    def _load_index_files(self, date_matcher, stats, dependencies=None):
+        stats.incr('index_files_in_memory', len(self._index_files))
+        return [(f, arl_files) for f, (key, arl_files) in self._index_files.items()
+            if self._index_file_in_window(f, date_matcher)]
+
+    @property
+    def num_index_files(self):
+        return len(self._index_files)
+
+
+class ArlFinderServer(object):
+
+    DEFAULT_REFRESH_INTERVAL = 300 # seconds
+
+    def __init__(self, met_root_dirs, refresh_interval=None,
+            allow_other_roots=False, **config):
+        """Constructor
+
+        args:
+         - met_root_dirs -- list of met root dirs to load on startup
+
+        kwargs:
+         - refresh_interval -- number of seconds between refreshes;
+            default: 300
+         - allow_other_roots -- serve requests for root dirs other than
+            met_root_dirs, loading each on first request; default: False
+
+        (see ArlFinder for config options, which are used for all root dirs)
+        """
+        self._refresh_interval = refresh_interval or self.DEFAULT_REFRESH_INTERVAL
+        self._allow_other_roots = allow_other_roots
+        self._config = config
+        self._met_root_dirs = set(os.path.normpath(d) for d in met_root_dirs)
+        # root dir -> Future of its InMemoryArlFinder, which is set once
+        # loaded, so that only requests for the root dir being loaded wait
+        self._finders = {}
+        self._finders_lock = threading.Lock()
+        self._default_root_dir = None
+        for d in met_root_dirs:
+            self._get_finder(d)
+        self._default_root_dir = met_root_dirs and os.path.normpath(met_root_dirs[0])
+
+    ROOT_DIR_REQUIRED = "Root dir must be specified"
+    ROOT_DIR_NOT_SERVED = "Root dir {} isn't served"
+
+    def _get_finder(self, met_root_dir):
+        met_root_dir = met_root_dir or self._default_root_dir
+        if not met_root_dir:
+            raise ValueError(self.ROOT_DIR_REQUIRED)
+        met_root_dir = os.path.normpath(met_root_dir)
+        if (met_root_dir not in self._met_root_dirs
+                and not self._allow_other_roots):
+            raise ValueError(self.ROOT_DIR_NOT_SERVED.format(met_root_dir))
+
+        with self._finders_lock:
+            future = self._finders.get(met_root_dir)
+            load = future is None
+            if load:
+                future = self._finders[met_root_dir] = Future()
+
+        if load:
+            logging.info('Loading %s', met_root_dir)
+            try:
+                future.set_result(InMemoryArlFinder(met_root_dir,
+                    **self._config))
+            except Exception as e:
+                # let a later request try again
+                with self._finders_lock:
+                    del self._finders[met_root_dir]
+                future.set_exception(e)
+        return future.result()
+
+    def _loaded_finders(self):
+        """Returns dict of root dir to InMemoryArlFinder of the root dirs
+        that have been loaded
+        """
+        with self._finders_lock:
+            futures = dict(self._finders)
+        return dict((d, f.result()) for d, f in futures.items()
+            if f.done() and not f.exception())
+
+    ##
+    ## Requests
+    ##
+
+    def find(self, root_dir, start, end):
+        return self._get_finder(root_dir).find(start, end)
+
+    def find_many(self, root_dir, windows):
+        return self._get_finder(root_dir).find_many(windows)
+
+    def status(self):
+        finders = self._loaded_finders()
+        return {
+            'roots': {
+                d: {
+                    'index_files': f.num_index_files,
+                    'refreshed_at': f.refreshed_at.isoformat()
+                } for d, f in finders.items()
+            }
+        }
+
+    ##
+    ## Refreshing
+    ##
+
+    def refresh(self):
+        for f in self._loaded_finders().values():
+            try:
+                f.refresh()
+            except Exception as e:
+                logging.error('Failed to refresh %s: %s', f._met_root_dir, e)
+                logging.debug(traceback.format_exc())
+
+    def _refresh_periodically(self):
+        while True:
+            time.sleep(self._refresh_interval)
+            self.refresh()
+
+    ##
+    ## Serving
+    ##
+
+    def serve(self, port=None, socket_pathname=None):
+        """Serves requests until interrupted, on localhost port, or on
+        unix domain socket socket_pathname
+        """
+        if bool(port) == bool(socket_pathname):
+            raise ValueError("Specify either port or socket, but not both")
+
+        if socket_pathname:
+            if os.path.exists(socket_pathname):
+                os.remove(socket_pathname)
+            server = _ThreadingUnixHTTPServer(socket_pathname, _RequestHandler)
+        else:
+            server = ThreadingHTTPServer(('127.0.0.1', port), _RequestHandler)
+        server.arl_finder_server = self
+
+        threading.Thread(target=self._refresh_periodically, daemon=True).start()
+        logging.info('Serving on %s', socket_pathname or
+            'localhost:{}'.format(port))
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            if socket_pathname and os.path.exists(socket_pathname):
+                os.remove(socket_pathname)
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn,
+        socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/status':
+            self._respond(200, self.server.arl_finder_server.status())
+        else:
+            self._respond(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        server = self.server.arl_finder_server
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+            path = self.path.rstrip('/')
+            if path == '/find':
+                r = server.find(body.get('root_dir'),
+                    self._parse_dt(body, 'start'), self._parse_dt(body, 'end'))
+            elif path == '/find_many':
+                r = {'results': server.find_many(body.get('root_dir'),
+                    [(self._parse_dt(w, 'start'), self._parse_dt(w, 'end'))
+                        for w in body.get('windows') or []])}
+            else:
+                return self._respond(404, {'error': 'Not found'})
+            self._respond(200, r)
+
+        except (KeyError, ValueError, TypeError) as e:
+            self._respond(400, {'error': str(e)})
+
+        except Exception as e:
+            logging.error(e)
+            logging.debug(traceback.format_exc())
+            self._respond(500, {'error': str(e)})
+
+    def _parse_dt(self, d, key):
+        return d.get(key) and parse_dt(d[key])
+
+    def _respond(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # client_address is empty for unix domain sockets, which breaks
+        # the default implementation
+        logging.debug(format, *args)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_pathname, timeout):
+        super(_UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self._socket_pathname = socket_pathname
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._socket_pathname)
+
+
+class ArlFinderClient(object):
+
+    DEFAULT_TIMEOUT = 60 # seconds
+
+    def __init__(self, url, timeout=None):
+        """Constructor
+
+        args:
+         - url -- 'http://localhost:<port>' or 'unix://<socket pathname>'
+        """
+        self._url = urllib.parse.urlparse(url)
+        self._timeout = timeout or self.DEFAULT_TIMEOUT
+        if self._url.scheme not in ('http', 'unix'):
+            raise ValueError("Invalid arl finder server url {}".format(url))
+
+    def find(self, start, end, root_dir=None):
+        return self._request('POST', '/find', {
+            'root_dir': root_dir,
+            'start': start.isoformat(),
+            'end': end.isoformat()
+        })
+
+    def find_many(self, windows, root_dir=None):
+        return self._request('POST', '/find_many', {
+            'root_dir': root_dir,
+            'windows': [{'start': s.isoformat(), 'end': e.isoformat()}
+                for s, e in windows]
+        })['results']
+
+    def status(self):
+        return self._request('GET', '/status')
+
+    def _request(self, method, path, data=None):
+        if self._url.scheme == 'unix':
+            conn = _UnixHTTPConnection(self._url.netloc + self._url.path,
+                self._timeout)
+        else:
+            conn = http.client.HTTPConnection(self._url.netloc,
+                timeout=self._timeout)
+        try:
+            body = json.dumps(data) if data is not None else None
+            conn.request(method, path, body=body,
+                headers={'Content-Type': 'application/json'})
+            resp = conn.getresponse()
+            r = json.loads(resp.read() or b'{}')
+        finally:
+            conn.close()
+
+        if resp.status == 400:
+            raise ValueError(r.get('error'))
+        elif resp.status != 200:
+            raise RuntimeError("arl finder server error ({}): {}".format(
+                resp.status, r.get('error')))
+        return r
@@ -6,7 +6,9 @@ This module indexes met data
 __author__ = "Joel Dubowy"
 __copyright__ = "Copyright 2016, AirFire, PNW, USFS"
 
+import calendar
 import datetime
+import hashlib
 import json
 import logging
 import os
@@ -14,19 +16,33 @@ import re
 import socket
 import ssl
 import sys
+import threading
 import traceback
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 import pymongo
 
 from pyairfire.data import utils as datautils
 
-from .arlfinder import ArlFinder
+from afdatetime.parsing import parse as parse_dt
+
+from .arlfinder import (
+    ArlFinder, DateMatcher, ONE_DAY, ONE_HOUR, read_index_file
+)
+from .coverage import HourCoverage, covered_hour_range
+from . import indexio
+from .listingcache import DirectoryListingCache
+from .manifest import ArlManifest
+from .sqliteindexdb import (
+    is_sqlite_url, SqliteMetFilesCollection, SqliteMetDatesCollection
+)
 
 __all__ = [
     'ArlIndexer',
     'MetFilesCollection',
-    'MetDatesCollection'
+    'MetDatesCollection',
+    'met_files_collection',
+    'met_dates_collection'
 ]
 
 class ArlIndexer(ArlFinder):
@@ -41,8 +57,31 @@ class ArlIndexer(ArlFinder):
         config options:
          - mongodb_url -- format:
             'mongodb://[username:password@]host[:port][/[database][?options]]'"
+            or, to use an SQLite database instead, 'sqlite:///path/to/file.db'
+            (see met.arl.sqliteindexdb)
          - output_file -- pathname (relative of absolute) of output file to
             save index data
+         - output_format -- format of index data written to output file
+            or stdout: 'json' (default), 'ndjson', or 'binary' (see
+            met.arl.indexio)
+         - manifest_file -- pathname of manifest file to write, listing
+            the index files found and their arl files, for ArlFinder to
+            use in place of searching met_root_dir (see met.arl.manifest)
+         - incremental -- if True, update the previous run's index data
+            with only new and modified forecasts (see _index_incrementally)
+            (the manifest file, if configured, isn't written by
+            incremental runs)
+         - state_file -- pathname of file in which to save index data for
+            the next incremental run; if not specified, the previous index
+            data is read from output_file or from mongodb
+         - force -- if True, write index data to mongodb even if it's
+            unchanged since the previous run (see _write_to_mongodb_url)
+         - defer_dates_update -- if True, don't update the dates collection
+            after writing index data to mongodb, leaving it to the caller
+            (see met.arl.multiindexer)
+         - jobs -- number of processes with which to search for and parse
+            index files, each taking a partition of the dates to index
+            (see _find_and_parse_partitioned); default: 1
         (see ArlIndexDB for its config options)
         (see ArlFinder for its config options)
         """
@@ -50,6 +89,20 @@ class ArlIndexer(ArlFinder):
         super(ArlIndexer, self).__init__(met_root_dir, **config)
         self._domain = domain
         self._config = config
+        self._incremental = not not config.get('incremental')
+        self._jobs = max(1, int(config.get('jobs') or 1))
+        self._output_format = indexio.validate_output_format(
+            config.get('output_format'))
+        # whether the last call to index wrote index data to mongodb
+        self._mongodb_updated = False
+        # formatted index data last written, used by subsequent
+        # incremental runs in place of reading it back
+        self._last_index_data = None
+        # most recent index file found by the last call to index
+        self.latest_index_file = None
+        # (latest forecast, last run time) of the previous run, set
+        # while searching for new and modified forecasts
+        self._unchanged_before = None
         # TODO: In case 'start' and/or 'end' are specified in index,
         #   set self._max_days_out to 0 to ignore directories timestamped
         #   before 'start'?  (prob not, since ultimately we're concerned
@@ -65,38 +118,386 @@ class ArlIndexer(ArlFinder):
          - end -- only consider met data before this date
         """
         start, end = self._fill_in_start_end(start, end)
-        date_matcher = self._create_date_matcher(start, end)
-        index_files = self._find_index_files(date_matcher)
-        arl_files = self._parse_index_files(index_files)
-        files_per_hour = self._determine_files_per_hour(arl_files, start, end)
-        files = self._determine_file_time_windows(files_per_hour)
-        files_per_hour, files = self._filter(files_per_hour, files, start, end)
-        index_data = self._analyse(index_files, files_per_hour, files)
+        # (truncated, for the benefit of datetime parsers that don't
+        # handle microseconds)
+        indexed_at = datetime.datetime.utcnow().replace(microsecond=0)
+        previous = self._incremental and self._load_previous_index_data(
+            start, end)
+        if previous:
+            if self._config.get('manifest_file'):
+                logging.info("Not writing manifest in incremental run")
+            index_data = self._index_incrementally(previous)
+        else:
+            index_data = self._index_fully(start, end, indexed_at)
         # TODO: if there's a way to get domain boundaries, do it here.
         #   (it can change, so would need to get boundaries for each set
         #   of met files....probably too much pain to be worth it)
+        index_data['indexed_at'] = indexed_at
         self._write(index_data)
 
+    def _index_fully(self, start, end, searched_at):
+        date_matcher = self._create_date_matcher(start, end)
+        search_date_matcher = date_matcher
+        if self._config.get('manifest_file') and date_matcher.matches_all:
+            # ArlFinder searches can also find index files in 8 digit
+            # (%Y%m%d) dated dirs, which date_matcher doesn't match, so
+            # search for those as well to make the manifest cover them
+            search_date_matcher = DateMatcher(date_str_len=8)
+        all_parsed = self._find_and_parse(search_date_matcher)
+        parsed = [(f, f_arl_files) for f, f_arl_files in all_parsed
+            if search_date_matcher is date_matcher
+            or self._index_file_in_window(f, date_matcher)]
+        index_files = [f for f, f_arl_files in parsed]
+        arl_files = [f for i, f_arl_files in parsed for f in f_arl_files]
+        files = self._determine_time_windows(arl_files, start, end)
+        coverage = HourCoverage.from_time_windows(files)
+        coverage, files = self._filter(coverage, files, start, end)
+        self._set_latest_index_file(index_files)
+        if self._config.get('manifest_file'):
+            self._write_manifest(search_date_matcher, all_parsed,
+                start, end, searched_at)
+        return self._analyse(index_files, coverage, files)
+
+    ##
+    ## Partitioned indexing
+    ##
+
+    # Partitions are smaller than 1/jobs of the dates, so that busy and
+    # quiet stretches of an archive are spread across processes
+    PARTITIONS_PER_JOB = 4
+
+    def _find_and_parse(self, date_matcher):
+        """Returns list of (index file, arl files) tuples for the index
+        files found with date_matcher
+        """
+        partitions = self._jobs > 1 and self._partition(date_matcher)
+        if partitions:
+            return self._find_and_parse_partitioned(date_matcher, partitions)
+        index_files = self._find_index_files(date_matcher)
+        return list(zip(index_files, self._parse_each_index_file(index_files)))
+
+    def _partition(self, date_matcher):
+        """Splits the date strings matched by date_matcher into contiguous
+        partitions, returning a list of lists of date strings, or None if
+        they can't be determined
+
+        If date_matcher matches all dates, the dates are taken from the
+        names of the dated directories directly under the root dir, in
+        which case the root dir must contain no other (non-ignored)
+        directories, since they may contain forecasts of any date.
+        """
+        date_strs = date_matcher.date_strs
+        if date_matcher.matches_all:
+            days = set()
+            dirs, index_filenames = self._list_dir(self._met_root_dir)
+            for name in dirs:
+                if (self._ignore_matcher and self._ignore_matcher.match(
+                        os.path.join(self._met_root_dir, name))):
+                    continue
+                day = self._parse_date_dir_name(name)
+                if not day:
+                    logging.info("Not partitioning search, since root dir "
+                        "contains undated dir %s", name)
+                    return None
+                days.add(day)
+            if not days:
+                return None
+            date_strs = [(min(days) + i * ONE_DAY).strftime('%Y%m%d')
+                for i in range((max(days) - min(days)).days + 1)]
+
+        num_partitions = min(len(date_strs),
+            self._jobs * self.PARTITIONS_PER_JOB)
+        if num_partitions < 2:
+            return None
+        size, remainder = divmod(len(date_strs), num_partitions)
+        partitions = []
+        for i in range(num_partitions):
+            s = i * size + min(i, remainder)
+            partitions.append(date_strs[s:s + size + (i < remainder)])
+        return partitions
+
+    def _parse_date_dir_name(self, name):
+        if self.DATE_DIR_NAME_MATCHER.match(name):
+            try:
+                return datetime.datetime.strptime(name[:8], '%Y%m%d')
+            except ValueError:
+                pass
+        # else, returns None
+
+    def _find_and_parse_partitioned(self, date_matcher, partitions):
+        """Searches for and parses the index files of each partition of
+        dates in a pool of self._jobs processes, and merges the results
+
+        An index file whose pathname contains dates in more than one
+        partition is found by each of them, and so results are deduped.
+        Results are then restricted to what a search with date_matcher
+        would find, in case a partition matches pathnames date_matcher
+        doesn't (e.g. 8 digit dated dirs, when date_matcher matches all
+        10 digit date strings).
+
+        The discovery cache isn't used by the worker processes, since it
+        isn't safe to share between processes.
+        """
+        logging.info("Searching %s partitions with %s processes",
+            len(partitions), self._jobs)
+        config = dict(self._config, discovery_cache_file=None,
+            manifest_file=None, result_cache_size=None, mongo_client=None,
+            jobs=None)
+        with ProcessPoolExecutor(max_workers=self._jobs) as executor:
+            results = executor.map(_find_and_parse_partition,
+                [self._met_root_dir] * len(partitions),
+                [config] * len(partitions), partitions)
+            merged = {}
+            for parsed in results:
+                for index_file, arl_files in parsed:
+                    merged.setdefault(index_file, arl_files)
+
+        return [(f, merged[f]) for f in sorted(merged)
+            if self._index_file_in_window(f, date_matcher)]
+
+    ##
+    ## Incremental indexing
+    ##
+
+    def _load_previous_index_data(self, start, end):
+        """Returns the previous run's index data, with datetimes parsed, if
+        it can be updated incrementally; returns None otherwise
+        """
+        if start or end:
+            logging.info("Ignoring 'incremental' since start/end are specified")
+            return None
+        if self._fewer_arl_files or self._accepted_forecasts:
+            # arl files aren't assigned to hours independently of
+            # earlier hours' assignments with fewer_arl_files, and
+            # accepted forecasts may have changed since the last run
+            logging.info("Ignoring 'incremental' with 'fewer_arl_files'"
+                " or 'accepted_forecasts'")
+            return None
+
+        try:
+            data = self._read_previous_index_data()
+        except Exception as e:
+            logging.debug(traceback.format_exc())
+            logging.warning("Failed to read previous index data: %s", e)
+            data = None
+        if not data or not data.get('indexed_at') or not data.get(
+                'latest_forecast'):
+            logging.info("No previous index data to update; indexing fully")
+            return None
+        if (data.get('root_dir') != self._met_root_dir
+                or data.get('domain') != self._domain):
+            logging.info("Previous index data is for a different domain"
+                " or root dir; indexing fully")
+            return None
+        if self._has_removed_files(data):
+            # the hours of removed files may need to be reassigned to
+            # files of any forecast, so everything is reindexed
+            logging.info("Previously indexed arl files have been removed;"
+                " indexing fully")
+            return None
+
+        try:
+            return dict(data,
+                indexed_at=parse_dt(data['indexed_at']),
+                latest_forecast=parse_dt(data['latest_forecast']),
+                files=[dict(f, first_hour=parse_dt(f['first_hour']),
+                    last_hour=parse_dt(f['last_hour']))
+                    for f in data.get('files') or []])
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning("Invalid previous index data (%s); indexing"
+                " fully", e)
+            return None
+
+    def _has_removed_files(self, data):
+        """Returns True if any of the arl files in the previous index data
+        no longer exist (e.g. if old forecasts were cleaned up)
+
+        Each directory is listed once, so this is cheap relative to
+        searching for and parsing index files.
+        """
+        listing_cache = DirectoryListingCache()
+        return any(not listing_cache.isfile(f['file'])
+            for f in data.get('files') or [])
+
+    def _read_previous_index_data(self):
+        if self._last_index_data:
+            return self._last_index_data
+
+        for k, output_format in (('state_file', 'json'),
+                ('output_file', self._output_format)):
+            pathname = self._config.get(k)
+            if pathname and os.path.exists(pathname):
+                logging.debug("Reading previous index data from %s", pathname)
+                with open(pathname, 'rb' if indexio.is_binary(output_format)
+                        else 'r') as f:
+                    return indexio.read_index_data(f, output_format)
+
+        if self._config.get('mongodb_url'):
+            r = met_files_collection(**self._config).find(
+                server=self._server_name(), domain=self._domain)
+            return r[0] if r else None
+
+    def _index_incrementally(self, previous):
+        """Updates previous index data with new and modified forecasts
+
+        Only forecast directories dated at or after the previous run's
+        latest forecast, or modified since the previous run, are searched
+        for changes, without parsing any index files in the others.  The
+        hours from the earliest first hour of the changed forecasts' arl
+        files onward are then reassigned, which requires parsing the index
+        files of the forecasts up to 'max_days_out' days earlier as well.
+        Files used for earlier hours are taken from the previous data.
+
+        Since arl files are assigned to the most recent data available for
+        each hour, the result is the same as that of a full index run, as
+        long as no forecasts predating the affected hours were removed.
+        Availability and dates are recomputed from the merged files, which
+        only requires a pass over their time windows.
+        """
+        self._unchanged_before = (previous['latest_forecast'],
+            calendar.timegm(previous['indexed_at'].timetuple()))
+        full_date_matcher = self._create_date_matcher(None, None)
+        try:
+            changed_index_files = self._find_index_files(full_date_matcher)
+        finally:
+            self._unchanged_before = None
+
+        changed_arl_files = [f for f_arl_files in
+            self._parse_each_index_file(changed_index_files)
+            for f in f_arl_files]
+        if not changed_arl_files:
+            logging.info("No new or modified forecasts")
+            files = previous['files']
+            index_files = []
+
+        else:
+            affected_start = min(f['first_hour'] for f in changed_arl_files)
+            logging.info("Reindexing hours from %s", affected_start.isoformat())
+            date_matcher = self._create_date_matcher(affected_start,
+                datetime.datetime.utcnow() + ONE_DAY)
+            # keep only the index files that a full run would find
+            index_files = [f for f in self._find_index_files(date_matcher)
+                if full_date_matcher.match(os.path.dirname(f))]
+            arl_files = [f for f_arl_files in
+                self._parse_each_index_file(index_files)
+                for f in f_arl_files]
+            # Not passing in affected_start, since files are pruned
+            # relative to start, which a full index run doesn't do
+            new_files = self._determine_time_windows(arl_files, None, None)
+            files = self._splice_time_windows(previous['files'], new_files,
+                affected_start)
+
+        self._set_latest_index_file(index_files)
+        index_data = self._analyse(index_files, HourCoverage.from_time_windows(
+            files), files)
+        index_data['latest_forecast'] = max(f for f in (
+            previous['latest_forecast'], index_data['latest_forecast']) if f)
+        return index_data
+
+    def _set_latest_index_file(self, index_files):
+        if index_files:
+            latest = sorted(index_files)[-1]
+            if not self.latest_index_file or latest > self.latest_index_file:
+                self.latest_index_file = latest
+
+    def index_file_ready(self, index_file):
+        """Returns True if index_file lists at least one arl file and all
+        of the arl files it lists exist
+        """
+        # use fresh listings, since arl files may have been added since
+        # the last search
+        listing_cache = DirectoryListingCache()
+        try:
+            with self._open_index_file(index_file) as f:
+                names = [name for name, first_hour, last_hour
+                    in read_index_file(f)]
+        except (OSError, ValueError) as e:
+            logging.debug("Failed to read index file %s: %s", index_file, e)
+            return False
+        return bool(names) and all(self._get_file_pathname(index_file, name,
+            listing_cache=listing_cache) for name in names)
+
+    def _splice_time_windows(self, old_files, new_files, affected_start):
+        """Returns old files' time windows before affected_start followed
+        by new files' time windows from affected_start on
+        """
+        files = []
+        for f in old_files:
+            first_hour, last_hour = self._clip_to_time_window(f, None,
+                affected_start - ONE_HOUR)
+            if first_hour <= last_hour:
+                files.append({'file': f['file'], 'first_hour': first_hour,
+                    'last_hour': last_hour})
+
+        for f in new_files:
+            first_hour, last_hour = self._clip_to_time_window(f,
+                affected_start, None)
+            if first_hour > last_hour:
+                continue
+            # merge contiguous windows using the same file
+            if (files and files[-1]['file'] == f['file'] and
+                    first_hour - files[-1]['last_hour'] <= ONE_HOUR):
+                files[-1]['last_hour'] = last_hour
+            else:
+                files.append({'file': f['file'], 'first_hour': first_hour,
+                    'last_hour': last_hour})
+        return files
+
+    # Allowance for coarse mtime granularity (e.g. on NFS)
+    MTIME_SLACK = 2
+
+    def _prune(self, root, name, date_matcher):
+        if super(ArlIndexer, self)._prune(root, name, date_matcher):
+            return True
+
+        if self._unchanged_before and self._is_unchanged_forecast_dir(
+                os.path.join(root, name), name):
+            logging.debug('Pruning unchanged forecast dir %s',
+                os.path.join(root, name))
+            return True
+
+        return False
+
+    def _is_unchanged_forecast_dir(self, pathname, name):
+        """Returns True if pathname is a dated dir that predates the
+        previous run's latest forecast and that hasn't been modified since
+        the previous run
+        """
+        if not self.DATE_DIR_NAME_MATCHER.match(name):
+            return False
+        latest_forecast, last_run = self._unchanged_before
+        try:
+            if len(name) == 10:
+                if datetime.datetime.strptime(name, '%Y%m%d%H') >= latest_forecast:
+                    return False
+            elif datetime.datetime.strptime(name, '%Y%m%d').date() >= latest_forecast.date():
+                return False
+        except ValueError:
+            # not actually a date
+            return False
+
+        try:
+            return os.stat(pathname).st_mtime < last_run - self.MTIME_SLACK
+        except OSError:
+            return False
+
     ##
     ## Filter
     ##
 
-    def _filter(self, files_per_hour, files, start, end):
+    def _filter(self, coverage, files, start, end):
         if start and end:
-            # need to filter files and files_per_hour separately
+            # need to filter files and coverage separately
             # because some files may cross the start and/or end times
             #logging.debug("files (BEFORE): %s", files)
-            #logging.debug("files_per_hour (BEFORE): %s", files_per_hour)
 
             # TODO: self._filter_files shouldn't be necessary; remove call,
             #   method, and unit test
 
             files = self._filter_files(files, start, end)
-            files_per_hour = {k:v for k, v in files_per_hour.items()
-                if k >= start and k <= end}
+            coverage = coverage.clip(start, end)
             #logging.debug("files (AFTER): %s", files)
-            #logging.debug("files_per_hour (AFTER): %s", files_per_hour)
-        return files_per_hour, files
+        return coverage, files
 
     def _filter_files(self, files, start, end):
         # By this point start and end will either both be defined or not
@@ -149,28 +550,25 @@ class ArlIndexer(ArlFinder):
                 return datetime.datetime.strptime(m.group(1), '%Y%m%d%H')
         # else return None
 
-    def _analyse(self, index_files, files_per_hour, files):
-        # Note: reduce will be removed from py 3.0 standard library; though it
-        # will be available in functools, use explicit loop instead
-        dates = defaultdict(lambda: [])
-        sorted_hours = sorted(files_per_hour.keys())
-        for dt in sorted_hours:
-            dates[dt.date()].append(dt.hour)
-        complete_dates = [d for d in dates if len(dates[d]) == 24]
-        partial_dates = list(set(dates) - set(complete_dates))
-        server_name = self._config.get('server_name') or socket.gethostname()
-        availability = self._determine_availability_time_windows(files)
+    def _server_name(self):
+        return self._config.get('server_name') or socket.gethostname()
+
+    def _analyse(self, index_files, coverage, files):
+        """Returns index data, with dates, start/end, and availability
+        derived from coverage, an HourCoverage of the hours with arl data
+        """
+        complete_dates, partial_dates = coverage.dates()
         data = {
-            'server': server_name,
+            'server': self._server_name(),
             'domain': self._domain,
             'latest_forecast': self._parse_latest_forecast(index_files),
-            'start': sorted_hours[0] if sorted_hours else None,
-            'end': sorted_hours[-1] if sorted_hours else None,
-            'complete_dates': sorted(complete_dates),
-            'partial_dates': sorted(partial_dates),
+            'start': coverage.start,
+            'end': coverage.end,
+            'complete_dates': complete_dates,
+            'partial_dates': partial_dates,
             'root_dir': self._met_root_dir,
             'files': files,
-            'availability': availability
+            'availability': coverage.time_windows()
         }
 
         # TODO: slice and dice data in another way?
@@ -185,9 +583,13 @@ class ArlIndexer(ArlFinder):
         #  a datetime encoder for json.dumps because datautils.format_datetimes
         #  handles formating both keys and values
         index_data = datautils.format_datetimes(index_data)
+        self._last_index_data = index_data
         if (not self._config.get('mongodb_url')
                 and not self._config.get('output_file')):
-            sys.stdout.write(json.dumps(index_data, indent=self._config.get('indent')))
+            indexio.write_index_data(index_data,
+                sys.stdout.buffer if indexio.is_binary(self._output_format)
+                else sys.stdout, self._output_format,
+                indent=self._config.get('indent'))
         else:
             succeeded = False
 
@@ -204,12 +606,61 @@ class ArlIndexer(ArlFinder):
             if not succeeded:
                 raise RuntimeError("Failed to record")
 
+        if self._config.get('state_file'):
+            # Failing to save state isn't fatal, since the next
+            # incremental run can fall back to indexing fully
+            try:
+                self._write_to_state_file(index_data)
+            except Exception as e:
+                logging.debug(traceback.format_exc())
+                logging.error("Failed to write state file {}: {}".format(
+                    self._config['state_file'], e))
+
+    # Fields that change with every run, and so aren't fingerprinted
+    UNFINGERPRINTED_FIELDS = ('indexed_at', 'fingerprint')
+
+    def _fingerprint(self, index_data):
+        """Returns sha256 hex digest of the formatted index data
+
+        The data is hashed as it's encoded, rather than encoded into one
+        string first, since the list of files can be long.
+        """
+        data = dict((k, v) for k, v in index_data.items()
+            if k not in self.UNFINGERPRINTED_FIELDS)
+        h = hashlib.sha256()
+        for chunk in json.JSONEncoder(sort_keys=True,
+                separators=(',', ':')).iterencode(data):
+            h.update(chunk.encode())
+        return h.hexdigest()
+
     def _write_to_mongodb_url(self, index_data):
-        MetFilesCollection(**self._config).update(index_data)
+        """Writes index data, and updates the domain's dates, unless the
+        index data on record has the same fingerprint (and 'force' isn't
+        set)
+        """
+        self._mongodb_updated = False
+        met_files = met_files_collection(**self._config)
+        index_data = dict(index_data,
+            fingerprint=self._fingerprint(index_data))
+        if (not self._config.get('force') and index_data['fingerprint']
+                == met_files.get_fingerprint(index_data['server'],
+                    index_data['domain'])):
+            logging.info("Index data unchanged; not writing to mongodb")
+            # record that the server is still being indexed, so that its
+            # index data doesn't expire (see MetFilesCollection)
+            met_files.touch(index_data['server'], index_data['domain'])
+            return
+
+        # sqlite backends delete expired index data of any domain when
+        # writing, and return the domains affected
+        expired_domains = met_files.update(index_data) or []
+        self._mongodb_updated = True
         # TODO: instead of manually invoking update of dates collection
         #   here, use a trigger or have MetFilesCollection.update invoke it
-        MetDatesCollection(**self._config).compute_and_save(
-            domain=self._domain)
+        if not self._config.get('defer_dates_update'):
+            dates_collection = met_dates_collection(**self._config)
+            for domain in sorted(set([self._domain] + expired_domains)):
+                dates_collection.compute_and_save(domain=domain)
         # TODO: other hierarchies to be stored in mongodb (possibly
         #   maintained via triggers?):
         #   - met > server > date
@@ -220,8 +671,35 @@ class ArlIndexer(ArlFinder):
         #   - date > server > met
 
     def _write_to_output_file(self, index_data):
-        with open(self._config['output_file'], 'w') as f:
-            f.write(json.dumps(index_data, indent=self._config.get('indent')))
+        with open(self._config['output_file'],
+                'wb' if indexio.is_binary(self._output_format) else 'w') as f:
+            indexio.write_index_data(index_data, f, self._output_format,
+                indent=self._config.get('indent'))
+
+    def _write_to_state_file(self, index_data):
+        with open(self._config['state_file'], 'w') as f:
+            f.write(json.dumps(index_data))
+
+    def _write_manifest(self, date_matcher, parsed, start, end, searched_at):
+        # Failing to write the manifest isn't fatal, since ArlFinder
+        # falls back to searching when it's missing or stale
+        try:
+            ArlManifest(self._manifest_search(), date_matcher.date_strs,
+                date_matcher.date_str_len, parsed, start=start, end=end,
+                generated_at=searched_at).save(self._config['manifest_file'])
+        except Exception as e:
+            logging.debug(traceback.format_exc())
+            logging.error("Failed to write manifest {}: {}".format(
+                self._config['manifest_file'], e))
+
+
+def _find_and_parse_partition(met_root_dir, config, date_strs):
+    """Run in a worker process; returns list of (index file, arl files)
+    tuples for the index files found with a DateMatcher of date_strs
+    """
+    finder = ArlFinder(met_root_dir, **config)
+    index_files = finder._find_index_files(DateMatcher(date_strs))
+    return list(zip(index_files, finder._parse_each_index_file(index_files)))
 
 
 class ArlIndexDB(object):
@@ -238,13 +716,19 @@ class ArlIndexDB(object):
          - mongo_ssl_keyfile -- if specified, mongo_ssl_certfile must be specified too
          - mongo_ssl_ca_certs -- can be specified instead of mongo_ssl_certfile and
             mongo_ssl_keyfile
+         - mongo_client -- existing pymongo.MongoClient, connected to
+            mongodb_url, to use instead of creating a new one
+         - ttl -- number of seconds after which index data of servers no
+            longer being indexed expires (see MetFilesCollection)
         """
         # TODO: raise exception if self.__class__.__name__ == 'ArlIndexDB' ???
 
         mongodb_url, db_name = self._parse_mongodb_url(mongodb_url)
-        ssl_config = self._get_ssl_config(config)
-        self.client = pymongo.MongoClient(mongodb_url, **ssl_config)
+        self.client = config.get('mongo_client')
+        if self.client is None:
+            self.client = self.shared_client(mongodb_url, **config)
         self.db = self.client[db_name]
+        self._mongodb_url = mongodb_url
 
         # 'met_files' collection list available met files
         # per server per domain
@@ -257,11 +741,41 @@ class ArlIndexDB(object):
         self._ensure_indices(self.met_files)
         self._ensure_indices(self.dates)
 
+    @classmethod
+    def create_client(cls, mongodb_url=None, **config):
+        """Returns a new pymongo.MongoClient, which can be shared by
+        multiple ArlIndexDB objects via the 'mongo_client' config option
+        """
+        mongodb_url, db_name = cls._parse_mongodb_url(mongodb_url)
+        return pymongo.MongoClient(mongodb_url, **cls._get_ssl_config(config))
+
+    # Clients are thread safe and maintain their own connection pools, so
+    # one client per url and ssl config is shared by all ArlIndexDB
+    # objects in the process
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+    @classmethod
+    def shared_client(cls, mongodb_url=None, **config):
+        """Returns the process wide pymongo.MongoClient for mongodb_url
+        and the ssl config options, creating it if necessary
+        """
+        mongodb_url, db_name = cls._parse_mongodb_url(mongodb_url)
+        key = (mongodb_url, json.dumps(cls._get_ssl_config(config),
+            sort_keys=True, default=str))
+        with cls._clients_lock:
+            client = ArlIndexDB._clients.get(key)
+            if client is None:
+                client = cls.create_client(mongodb_url, **config)
+                ArlIndexDB._clients[key] = client
+            return client
+
     SSL_KEY_AND_CERT_MUST_BOTH_BE_SPECIFIED = (
         "SSL key and cert files must both be specified or neither specified")
-    def _get_ssl_config(self, config):
+    @classmethod
+    def _get_ssl_config(cls, config):
         if bool(config.get('mongo_ssl_certfile')) ^ bool(config.get('mongo_ssl_keyfile')):
-            raise ValueError(self.SSL_KEY_AND_CERT_MUST_BOTH_BE_SPECIFIED)
+            raise ValueError(cls.SSL_KEY_AND_CERT_MUST_BOTH_BE_SPECIFIED)
 
         if config.get('mongo_tls_cafile'):
             return {
@@ -328,15 +842,66 @@ class ArlIndexDB(object):
 
         return mongodb_url, db_name
 
+    # (mongodb url, collection name, field) of indices already created
+    # in this process
+    _indices_created = set()
+
     def _ensure_indices(self, collection):
         # handle 'INDEXED_FIELDS' not being defined for a collection
         fields = getattr(self, 'INDEXED_FIELDS', [])
         for f in fields:
+            # create_index is a no-op round trip if the index exists, so
+            # only make it once per process
+            key = (self._mongodb_url, collection.full_name,
+                f if isinstance(f, str) else tuple(f))
+            with ArlIndexDB._clients_lock:
+                if key in ArlIndexDB._indices_created:
+                    continue
             collection.create_index(f)
+            with ArlIndexDB._clients_lock:
+                ArlIndexDB._indices_created.add(key)
 
 class MetFilesCollection(ArlIndexDB):
+    """Index data per server per domain
+
+    Each record's 'last_indexed' field is set to the time it was last
+    written or found to be unchanged (see touch).  If the 'ttl' config
+    option is set, a TTL index on 'last_indexed' has mongodb delete records
+    of servers that stop being indexed.  The dates collection is recomputed
+    for a domain whenever any server indexes it, which drops expired
+    servers' dates.
+    """
+
+    INDEXED_FIELDS = [
+        'server',
+        'domain',
+        # for coverage queries (see covers)
+        [('availability.first_hour', pymongo.ASCENDING),
+         ('availability.last_hour', pymongo.ASCENDING)]
+    ]
+
+    TTL_INDEX_NAME = 'last_indexed_ttl'
 
-    INDEXED_FIELDS = ['server', 'domain']
+    def __init__(self, mongodb_url=None, **config):
+        super(MetFilesCollection, self).__init__(mongodb_url, **config)
+        if config.get('ttl'):
+            self._ensure_ttl_index(int(config['ttl']))
+
+    def _ensure_ttl_index(self, ttl):
+        key = (self._mongodb_url, self.met_files.full_name,
+            self.TTL_INDEX_NAME, ttl)
+        with ArlIndexDB._clients_lock:
+            if key in ArlIndexDB._indices_created:
+                return
+        try:
+            self.met_files.create_index('last_indexed',
+                expireAfterSeconds=ttl, name=self.TTL_INDEX_NAME)
+        except pymongo.errors.OperationFailure:
+            # the index exists with a different ttl
+            self.db.command('collMod', self.met_files.name, index={
+                'name': self.TTL_INDEX_NAME, 'expireAfterSeconds': ttl})
+        with ArlIndexDB._clients_lock:
+            ArlIndexDB._indices_created.add(key)
 
     def update(self, index_data):
         """Updates the set of arl files on record **for a particular
@@ -347,72 +912,193 @@ class MetFilesCollection(ArlIndexDB):
 
         # we want to update or insert
         query = {'server': index_data['server'], 'domain': index_data['domain']}
-        self.met_files.update_one(query, {'$set': index_data}, upsert=True)
+        self.met_files.update_one(query, {'$set': dict(index_data,
+            last_indexed=datetime.datetime.utcnow())}, upsert=True)
+
+    def touch(self, server, domain):
+        """Updates the last indexed time of the domain's index data on
+        the server, without rewriting it
+        """
+        self.met_files.update_one({'server': server, 'domain': domain},
+            {'$set': {'last_indexed': datetime.datetime.utcnow()}})
+
+    def get_fingerprint(self, server, domain):
+        """Returns the fingerprint of the index data on record for the
+        domain on the server, or None if there isn't any
+        """
+        d = self.met_files.find_one({'server': server, 'domain': domain},
+            {'fingerprint': 1})
+        return d and d.get('fingerprint')
 
     def find(self, **query):
         """Find available files, by server and domain
         """
         r = self.met_files.find(filter=query)
-        return [e.pop('_id') and e for e in r]
-
-    def clear(self):
-        self.met_files.delete_many({})
+        return [self._format(e) for e in r]
+
+    def _format(self, e):
+        e.pop('_id', None)
+        if isinstance(e.get('last_indexed'), datetime.datetime):
+            e['last_indexed'] = e['last_indexed'].replace(
+                microsecond=0).isoformat()
+        return e
+
+    def covers(self, start, end, **query):
+        """Returns the server and domain of each set of met files, matching
+        query, with data for every hour from start through end
+        """
+        first_hour, last_hour = covered_hour_range(start, end)
+        query = dict(query, availability={'$elemMatch': {
+            'first_hour': {'$lte': first_hour},
+            'last_hour': {'$gte': last_hour}
+        }})
+        r = self.met_files.find(filter=query,
+            projection={'_id': 0, 'server': 1, 'domain': 1})
+        return sorted([{'server': e['server'], 'domain': e['domain']}
+            for e in r], key=lambda e: (e['server'], e['domain']))
+
+    def clear(self, server=None, domain=None, older_than=None):
+        """Deletes index data, of server, of domain, and/or last indexed
+        before older_than, if specified, or else all index data; returns
+        the domains affected
+        """
+        query = {}
+        if server:
+            query['server'] = server
+        if domain:
+            query['domain'] = domain
+        if older_than:
+            # records written before 'last_indexed' was recorded are
+            # judged by 'indexed_at'
+            query['$or'] = [
+                {'last_indexed': {'$lt': older_than}},
+                {'last_indexed': {'$exists': False}, 'indexed_at': {
+                    '$lt': older_than.replace(microsecond=0).isoformat()}}
+            ]
+        domains = sorted(self.met_files.distinct('domain', query))
+        self.met_files.delete_many(query)
+        return domains
 
 class MetDatesCollection(ArlIndexDB):
 
     INDEXED_FIELDS = ['domain']
 
+    # Only the fields needed to compute dates are read from met_files,
+    # and not, in particular, the 'files' arrays
+    DATE_FIELDS = ['domain', 'complete_dates', 'partial_dates', 'start',
+        'end', 'latest_forecast']
+
     # TODO: build aggregation into the db as a trigger
     def compute(self, domain=None):
+        """Returns dates information per domain, across all servers
+
+        The information is aggregated by mongodb, so that only per domain
+        summaries are returned to the client.  If the database (e.g. a
+        stand-in for mongodb) doesn't support the aggregation, it's done
+        in python instead.
+        """
+        try:
+            date_info = list(self.met_files.aggregate(
+                self._aggregation_pipeline(domain)))
+        except (NotImplementedError, AttributeError,
+                pymongo.errors.OperationFailure) as e:
+            logging.debug("Failed to aggregate dates in db (%s); doing so"
+                " in python", e)
+            date_info = self._aggregate(domain)
+
+        # remove from partial_dates any dates that are in complete_dates,
+        # and create record for each domain
+        to_save = []
+        for d in sorted(date_info, key=lambda d: d['_id']):
+            complete_dates = set(d['complete_dates'] or [])
+            to_save.append({
+                'domain': d['_id'],
+                'complete_dates': sorted(complete_dates),
+                'partial_dates': sorted(set(d['partial_dates'] or [])
+                    - complete_dates),
+                'start': d['start'],
+                'end': d['end'],
+                'latest_forecast': d['latest_forecast']
+            })
+        return to_save
+
+    def _aggregation_pipeline(self, domain):
+        def union(field):
+            # union of the arrays collected for each server
+            return {'$reduce': {
+                'input': '$' + field,
+                'initialValue': [],
+                'in': {'$setUnion': ['$$value', {'$ifNull': ['$$this', []]}]}
+            }}
+
+        return ([{'$match': {'domain': domain}}] if domain else []) + [
+            {'$project': dict((k, 1) for k in self.DATE_FIELDS)},
+            {'$group': {
+                '_id': '$domain',
+                'complete_dates': {'$addToSet': '$complete_dates'},
+                'partial_dates': {'$addToSet': '$partial_dates'},
+                # $min and $max ignore null and missing values
+                'start': {'$min': '$start'},
+                'end': {'$max': '$end'},
+                'latest_forecast': {'$max': '$latest_forecast'}
+            }},
+            {'$project': {
+                'complete_dates': union('complete_dates'),
+                'partial_dates': union('partial_dates'),
+                'start': 1,
+                'end': 1,
+                'latest_forecast': 1
+            }}
+        ]
+
+    def _aggregate(self, domain):
+        """Returns the same results as the aggregation pipeline"""
         date_info_by_domain = {}
         query = {'domain': domain} if domain else {}
-        for d in self.met_files.find(query):
+        for d in self.met_files.find(query,
+                dict((k, 1) for k in self.DATE_FIELDS)):
             if d['domain'] not in date_info_by_domain:
                 date_info_by_domain[d['domain']] = {
-                    'latest_forecast': d['latest_forecast'],
-                    'complete_dates': set(d['complete_dates']),
-                    'partial_dates': set(d['partial_dates']),
-                    'start': d['start'],
-                    'end': d['end']
+                    '_id': d['domain'],
+                    'latest_forecast': d.get('latest_forecast'),
+                    'complete_dates': set(d.get('complete_dates') or []),
+                    'partial_dates': set(d.get('partial_dates') or []),
+                    'start': d.get('start'),
+                    'end': d.get('end')
                 }
 
             else:
                 date_info = date_info_by_domain[d['domain']]
                 for k in ('complete_dates', 'partial_dates'):
-                    date_info[k].update(d[k])
+                    date_info[k].update(d.get(k) or [])
                 for k, f in (('start', min), ('end', max), ('latest_forecast', max)):
-                    if date_info[k] and d[k]:
+                    if date_info[k] and d.get(k):
                         date_info[k] = f(date_info[k], d[k])
-                    elif d[k]:
+                    elif d.get(k):
                         date_info[k] = d[k]
                     # else leave date_info[k] as is
 
-        # iterate through domains, removing from partial_dates any dates
-        # that are in complete_dates, and create record for domain
-        to_save = []
-        for domain, date_info in date_info_by_domain.items():
-            partial_dates = sorted(list(date_info['partial_dates']
-                - date_info['complete_dates']))
-            complete_dates = sorted(list(date_info['complete_dates']))
-            to_save.append({
-                'domain': domain,
-                'complete_dates': complete_dates,
-                'partial_dates': partial_dates,
-                'start': date_info['start'],
-                'end': date_info['end'],
-                'latest_forecast': date_info['latest_forecast']
-            })
-        return to_save
+        return list(date_info_by_domain.values())
 
     def compute_and_save(self, domain=None):
-        """Updates the dates information across all servers
+        """Updates the dates information across all servers, for domain
+        if specified, or else for all domains
         """
-        to_save = self.compute(domain=None)
-
-        # TODO: is there a way to do a bulk write, opting for upsert
-        #  on each item in to_save?
-        for d in to_save:
-            self.dates.update_one({'domain': d['domain']}, {'$set': d}, upsert=True)
+        to_save = self.compute(domain=domain)
+
+        if to_save:
+            self.dates.bulk_write([
+                pymongo.UpdateOne({'domain': d['domain']}, {'$set': d},
+                    upsert=True) for d in to_save
+            ], ordered=False)
+
+        # remove dates of domains no longer indexed on any server
+        if domain:
+            if not to_save:
+                self.dates.delete_many({'domain': domain})
+        else:
+            self.dates.delete_many({'domain': {'$nin': [
+                d['domain'] for d in to_save]}})
         return to_save
 
     def find(self, domain=None):
@@ -422,5 +1108,26 @@ class MetDatesCollection(ArlIndexDB):
         r = self.dates.find(filter=query)
         return [e.pop('_id') and e for e in r]
 
-    def clear(self):
-        self.dates.delete_many({})
+    def clear(self, domain=None):
+        self.dates.delete_many({'domain': domain} if domain else {})
+
+
+##
+## Backend selection
+##
+
+def met_files_collection(mongodb_url=None, **config):
+    """Returns MetFilesCollection, or SqliteMetFilesCollection if
+    mongodb_url is an sqlite url
+    """
+    if is_sqlite_url(mongodb_url):
+        return SqliteMetFilesCollection(mongodb_url, **config)
+    return MetFilesCollection(mongodb_url, **config)
+
+def met_dates_collection(mongodb_url=None, **config):
+    """Returns MetDatesCollection, or SqliteMetDatesCollection if
+    mongodb_url is an sqlite url
+    """
+    if is_sqlite_url(mongodb_url):
+        return SqliteMetDatesCollection(mongodb_url, **config)
+    return MetDatesCollection(mongodb_url, **config)
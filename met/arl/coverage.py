@@ -0,0 +1,175 @@
+"""met.arl.coverage
+
+This module provides a compact representation of the hours covered by
+arl data, used by ArlIndexer to compute dates and availability.
+
+Coverage is stored as a bytearray with one byte per hour, starting at
+midnight of the first covered date, set to 1 for covered hours.  Ranges
+of hours are set, and dates and contiguous time windows are found, with
+slice assignment, comparison and find operations that run in C, rather
+than with a dict entry (and datetime object) per hour.  Five years of
+hourly coverage take about 44KB.
+
+Hours are assumed to be on the hour; a time window's first and last
+hours are truncated to the hour.
+"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import datetime
+
+__all__ = [
+    'HourCoverage',
+    'covered_hour_range'
+]
+
+ONE_HOUR = datetime.timedelta(hours=1)
+COVERED = b'\x01'
+FULL_DAY = COVERED * 24
+EMPTY_DAY = b'\x00' * 24
+
+class HourCoverage(object):
+
+    def __init__(self, first_date=None, hours=None):
+        """Constructor
+
+        kwargs:
+         - first_date -- date of the first day represented
+         - hours -- bytearray with one byte per hour starting at midnight
+            of first_date, padded to whole days
+        """
+        self._first_hour = first_date and datetime.datetime.combine(
+            first_date, datetime.time())
+        self._hours = hours if hours is not None else bytearray()
+
+    @classmethod
+    def from_time_windows(cls, time_windows):
+        """Returns the coverage of time windows, each a dict with
+        'first_hour' and 'last_hour' datetimes
+        """
+        time_windows = [w for w in time_windows
+            if w['first_hour'] <= w['last_hour']]
+        if not time_windows:
+            return cls()
+
+        first_date = min(w['first_hour'] for w in time_windows).date()
+        last_date = max(w['last_hour'] for w in time_windows).date()
+        coverage = cls(first_date,
+            bytearray(24 * ((last_date - first_date).days + 1)))
+        for w in time_windows:
+            coverage._set(w['first_hour'], w['last_hour'])
+        return coverage
+
+    @classmethod
+    def from_hours(cls, hours):
+        """Returns the coverage of a collection of hourly datetimes"""
+        return cls.from_time_windows(
+            [{'first_hour': h, 'last_hour': h} for h in hours])
+
+    def _offset(self, dt):
+        return (dt - self._first_hour) // ONE_HOUR
+
+    def _set(self, first_hour, last_hour):
+        a, b = self._offset(first_hour), self._offset(last_hour)
+        self._hours[a:b+1] = COVERED * (b - a + 1)
+
+    def clip(self, start, end):
+        """Returns a copy with hours before start and after end cleared"""
+        if not self._hours:
+            return HourCoverage()
+        hours = bytearray(self._hours)
+        if start:
+            a = self._offset(start)
+            if self._first_hour + a * ONE_HOUR < start:
+                a += 1
+            a = max(0, min(len(hours), a))
+            hours[:a] = bytes(a)
+        if end:
+            b = max(0, min(len(hours), self._offset(end) + 1))
+            hours[b:] = bytes(len(hours) - b)
+        return HourCoverage(self._first_hour.date(), hours)
+
+    ##
+    ## Derived values
+    ##
+
+    @property
+    def num_hours(self):
+        return self._hours.count(1)
+
+    @property
+    def start(self):
+        """First covered hour, or None if no hours are covered"""
+        i = self._hours.find(1)
+        return None if i < 0 else self._first_hour + i * ONE_HOUR
+
+    @property
+    def end(self):
+        """Last covered hour, or None if no hours are covered"""
+        i = self._hours.rfind(1)
+        return None if i < 0 else self._first_hour + i * ONE_HOUR
+
+    def dates(self):
+        """Returns sorted lists of the dates with all 24 hours covered and
+        of the dates with only some hours covered
+        """
+        complete_dates = []
+        partial_dates = []
+        first_date = self._first_hour and self._first_hour.date()
+        hours = bytes(self._hours)
+        for d in range(len(hours) // 24):
+            day = hours[24*d:24*(d+1)]
+            if day == FULL_DAY:
+                complete_dates.append(first_date + datetime.timedelta(days=d))
+            elif day != EMPTY_DAY:
+                partial_dates.append(first_date + datetime.timedelta(days=d))
+        return complete_dates, partial_dates
+
+    def time_windows(self):
+        """Returns list of contiguous time windows of covered hours, each
+        a dict with 'first_hour' and 'last_hour'
+        """
+        windows = []
+        n = len(self._hours)
+        i = self._hours.find(1)
+        while i >= 0:
+            j = self._hours.find(0, i)
+            if j < 0:
+                j = n
+            windows.append({
+                'first_hour': self._first_hour + i * ONE_HOUR,
+                'last_hour': self._first_hour + (j - 1) * ONE_HOUR
+            })
+            i = self._hours.find(1, j)
+        return windows
+
+
+START_AND_END_REQUIRED = "Start and end times must be defined"
+START_AFTER_END = "Start time must be before end"
+
+# The format of hours in index data, which are naive UTC and are
+# compared as strings
+HOUR_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+def _to_naive_utc(dt):
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt.replace(microsecond=0)
+
+def covered_hour_range(start, end):
+    """Returns the first and last hours, formatted like the hours in index
+    data, that an availability time window must include in order to cover
+    start through end
+
+    Timezone aware start and end are converted to UTC.
+    """
+    if not start or not end:
+        raise ValueError(START_AND_END_REQUIRED)
+    start = _to_naive_utc(start)
+    end = _to_naive_utc(end)
+    if start > end:
+        raise ValueError(START_AFTER_END)
+    # each hour covers the rest of the hour
+    end = end.replace(minute=0, second=0)
+    return start.strftime(HOUR_FORMAT), end.strftime(HOUR_FORMAT)
@@ -0,0 +1,181 @@
+"""met.arl.discoverycache
+
+This module provides an optional on-disk cache of the directories visited
+while searching for arl index files.
+
+For each directory, the cache records the directory's mtime, its
+subdirectories, and the index files it contains.  A directory's mtime
+changes whenever an entry is added to, removed from, or renamed within it,
+so a directory whose mtime hasn't changed since it was last listed doesn't
+need to be listed again.  This turns repeat searches into one stat per
+directory, which matters on NFS mounted met archives.
+
+The cache file is plain json, so that it can be shared by ArlFinder and
+ArlIndexer (and by multiple processes), e.g.
+
+    {
+        "version": 1,
+        "patterns": {
+            "arl12hrindex.csv": {
+                "/DRI_2km/2015110300": {
+                    "mtime": 1446570000.0,
+                    "dirs": [],
+                    "files": ["arl12hrindex.csv"]
+                },
+                ...
+            }
+        }
+    }
+
+Listings are stored per index filename pattern, since the index files
+recorded for a directory depend on the pattern.
+
+A cache object can be shared by threads searching different directory
+trees (see ArlFinder's multi-root search).
+"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+__all__ = [
+    'IndexFileDiscoveryCache',
+    'list_dir'
+]
+
+def list_dir(dirname, index_filename_matcher):
+    """Returns sorted lists of the subdirectories of dirname and of the
+    files in dirname that match index_filename_matcher
+
+    Like os.walk (with followlinks=False), symlinked directories are not
+    returned as subdirectories to descend into, and directories that can't
+    be listed are treated as empty.
+    """
+    dirs = []
+    files = []
+    try:
+        with os.scandir(dirname) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            dirs.append(entry.name)
+                    elif index_filename_matcher.match(entry.name):
+                        files.append(entry.name)
+                except OSError:
+                    pass
+    except OSError as e:
+        logging.debug('Failed to list %s: %s', dirname, e)
+    return sorted(dirs), sorted(files)
+
+
+class IndexFileDiscoveryCache(object):
+
+    VERSION = 1
+
+    # Filesystems with coarse mtime granularity (e.g. 1 second on some NFS
+    # servers) can hide a modification made right after a directory is
+    # listed.  So, listings taken within this many seconds of the directory's
+    # mtime aren't trusted on subsequent lookups
+    MTIME_GRANULARITY = 2
+
+    def __init__(self, pathname, index_filename_matcher):
+        """Constructor
+
+        args:
+         - pathname -- pathname of the cache file; it's created if it
+            doesn't exist; if None, the cache is kept in memory only
+         - index_filename_matcher -- compiled regex used to identify index
+            files
+        """
+        self._pathname = pathname
+        self._index_filename_matcher = index_filename_matcher
+        self._patterns = self._load()
+        self._dirs = self._patterns.setdefault(
+            index_filename_matcher.pattern, {})
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        if not self._pathname:
+            return {}
+        try:
+            with open(self._pathname) as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                return data['patterns']
+            logging.debug('Ignoring discovery cache %s with version %s',
+                self._pathname, data.get('version'))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            logging.warning('Ignoring invalid discovery cache %s: %s',
+                self._pathname, e)
+        return {}
+
+    def list_dir(self, dirname):
+        """Returns the subdirectories and index files of dirname, re-listing
+        the directory only if its mtime changed since it was last listed
+        """
+        try:
+            mtime = os.stat(dirname).st_mtime
+        except OSError:
+            with self._lock:
+                if self._dirs.pop(dirname, None) is not None:
+                    self._dirty = True
+            return [], []
+
+        with self._lock:
+            entry = self._dirs.get(dirname)
+            if (entry and entry['mtime'] == mtime
+                    and entry['listed_at'] - mtime > self.MTIME_GRANULARITY):
+                self.hits += 1
+                return entry['dirs'], entry['files']
+            self.misses += 1
+
+        listed_at = time.time()
+        dirs, files = list_dir(dirname, self._index_filename_matcher)
+        with self._lock:
+            self._dirs[dirname] = {
+                'mtime': mtime,
+                'listed_at': listed_at,
+                'dirs': dirs,
+                'files': files
+            }
+            self._dirty = True
+        return dirs, files
+
+    def save(self):
+        """Writes the cache to file, if anything changed
+
+        The file is written to a temporary file and then moved into place,
+        so that concurrent readers never see a partially written cache.
+        """
+        with self._lock:
+            if not self._dirty or not self._pathname:
+                return
+
+            cache_dir = os.path.dirname(os.path.abspath(self._pathname))
+            fd, tmp_pathname = tempfile.mkstemp(dir=cache_dir,
+                prefix='.arldiscovery-')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({
+                        'version': self.VERSION,
+                        'patterns': self._patterns
+                    }, f)
+                os.replace(tmp_pathname, self._pathname)
+                self._dirty = False
+            except OSError as e:
+                logging.warning('Failed to save discovery cache %s: %s',
+                    self._pathname, e)
+                if os.path.exists(tmp_pathname):
+                    os.remove(tmp_pathname)
@@ -0,0 +1,68 @@
+"""met.arl.findstats
+
+This module provides a container for the wall time spent in each stage of
+an arl finder search, along with counters of the work done (directories
+visited, index files parsed, rows read, directory listings, cache hits, etc.).
+
+Counters may be incremented from multiple threads (see ArlFinder's
+parse_workers option), so updates are made under a lock.
+"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import contextlib
+import threading
+import time
+from collections import OrderedDict
+
+__all__ = [
+    'FindStats'
+]
+
+class FindStats(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = OrderedDict()
+        self.counts = OrderedDict()
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        """Context manager adding the wall time spent in the 'with' block
+        to stage's timing
+        """
+        t = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - t
+            with self._lock:
+                self.timings[stage] = self.timings.get(stage, 0.0) + elapsed
+
+    def incr(self, key, n=1):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + n
+
+    def update(self, counts):
+        """Adds each of the counts in dict 'counts'"""
+        with self._lock:
+            for k, n in counts.items():
+                self.counts[k] = self.counts.get(k, 0) + n
+
+    def merge(self, other):
+        """Adds the timings and counts of FindStats object 'other'"""
+        other = other.to_dict()
+        with self._lock:
+            for k, v in other['timings'].items():
+                self.timings[k] = self.timings.get(k, 0.0) + v
+            for k, n in other['counts'].items():
+                self.counts[k] = self.counts.get(k, 0) + n
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'timings': OrderedDict((k, round(v, 6))
+                    for k, v in self.timings.items()),
+                'counts': OrderedDict(self.counts)
+            }
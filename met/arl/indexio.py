@@ -0,0 +1,212 @@
+"""met.arl.indexio
+
+This module writes and reads the index data that ArlIndexer outputs to
+file or stdout, in one of three formats:
+
+ - 'json' -- the index data as one json object (the default)
+ - 'ndjson' -- newline delimited json: a summary record, with every
+   field but 'files' and 'availability', followed by one record per arl
+   file and one per availability time window, e.g.
+
+    {"type": "summary", "server": "foo", "domain": "DRI2km", ...}
+    {"type": "file", "file": "/DRI_2km/2015110300/...", "first_hour": "2015-11-03T00:00:00", "last_hour": "2015-11-03T11:00:00"}
+    ...
+    {"type": "availability", "first_hour": "2015-11-01T00:00:00", "last_hour": "2015-11-06T23:00:00"}
+
+ - 'binary' -- a compact binary form, in network byte order:
+
+    magic         6 bytes   b'ARLIDX'
+    version       uint8
+    summary       uint32 length, followed by the summary record as utf-8 json
+    files         uint32 count, followed by a record per arl file:
+                    first hour  uint32 (hours since the epoch)
+                    last hour   uint32 (hours since the epoch)
+                    file        uint16 length, followed by the utf-8 pathname
+    availability  uint32 count, followed by a record per time window:
+                    first hour  uint32 (hours since the epoch)
+                    last hour   uint32 (hours since the epoch)
+
+Records are written one at a time, so that output is never held in
+memory as one string, and ndjson and binary output can be read a record
+at a time with iter_records.  Index data is expected to have had its
+datetimes formatted (see ArlIndexer._write), and is read back the same way.
+"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import datetime
+import json
+import struct
+
+__all__ = [
+    'OUTPUT_FORMATS',
+    'validate_output_format',
+    'is_binary',
+    'write_index_data',
+    'read_index_data',
+    'iter_records'
+]
+
+OUTPUT_FORMATS = ('json', 'ndjson', 'binary')
+DEFAULT_OUTPUT_FORMAT = 'json'
+
+# Fields written as separate records in ndjson and binary output
+RECORD_FIELDS = ('files', 'availability')
+
+INVALID_OUTPUT_FORMAT = "Invalid output format {}; must be one of {}"
+
+def validate_output_format(output_format):
+    """Returns output_format, or the default if it's not specified"""
+    output_format = output_format or DEFAULT_OUTPUT_FORMAT
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(INVALID_OUTPUT_FORMAT.format(output_format,
+            ', '.join(OUTPUT_FORMATS)))
+    return output_format
+
+def is_binary(output_format):
+    """Returns True if output_format must be written to and read from
+    files opened in binary mode
+    """
+    return validate_output_format(output_format) == 'binary'
+
+def _summary(index_data):
+    return dict((k, v) for k, v in index_data.items()
+        if k not in RECORD_FIELDS)
+
+##
+## Writing
+##
+
+def write_index_data(index_data, f, output_format=None, indent=None):
+    """Writes index data to f, which must be opened in binary mode for
+    'binary' output, and in text mode otherwise
+
+    indent is only used for 'json' output.
+    """
+    output_format = validate_output_format(output_format)
+    if output_format == 'json':
+        # json.dump writes the encoded data in chunks
+        json.dump(index_data, f, indent=indent)
+    elif output_format == 'ndjson':
+        _write_ndjson(index_data, f)
+    else:
+        _write_binary(index_data, f)
+
+def _write_ndjson(index_data, f):
+    f.write(json.dumps(dict(_summary(index_data), type='summary')) + '\n')
+    for f_record in index_data.get('files') or []:
+        f.write(json.dumps(dict(f_record, type='file')) + '\n')
+    for a in index_data.get('availability') or []:
+        f.write(json.dumps(dict(a, type='availability')) + '\n')
+
+MAGIC = b'ARLIDX'
+VERSION = 1
+HEADER = struct.Struct('>6sB')
+COUNT = struct.Struct('>I')
+FILE_RECORD = struct.Struct('>IIH')
+WINDOW_RECORD = struct.Struct('>II')
+
+HOUR_FORMAT = '%Y-%m-%dT%H:%M:%S'
+EPOCH = datetime.datetime(1970, 1, 1)
+
+def _to_epoch_hour(val):
+    dt = datetime.datetime.strptime(val, HOUR_FORMAT)
+    if dt.minute or dt.second:
+        raise ValueError("{} is not on the hour".format(val))
+    return (dt - EPOCH) // datetime.timedelta(hours=1)
+
+def _from_epoch_hour(val):
+    return (EPOCH + datetime.timedelta(hours=val)).strftime(HOUR_FORMAT)
+
+def _write_binary(index_data, f):
+    f.write(HEADER.pack(MAGIC, VERSION))
+    summary = json.dumps(_summary(index_data), separators=(',', ':')).encode()
+    f.write(COUNT.pack(len(summary)))
+    f.write(summary)
+
+    files = index_data.get('files') or []
+    f.write(COUNT.pack(len(files)))
+    for f_record in files:
+        pathname = f_record['file'].encode()
+        f.write(FILE_RECORD.pack(_to_epoch_hour(f_record['first_hour']),
+            _to_epoch_hour(f_record['last_hour']), len(pathname)))
+        f.write(pathname)
+
+    availability = index_data.get('availability') or []
+    f.write(COUNT.pack(len(availability)))
+    for a in availability:
+        f.write(WINDOW_RECORD.pack(_to_epoch_hour(a['first_hour']),
+            _to_epoch_hour(a['last_hour'])))
+
+##
+## Reading
+##
+
+def read_index_data(f, output_format=None):
+    """Reads index data written with write_index_data in output_format"""
+    output_format = validate_output_format(output_format)
+    if output_format == 'json':
+        return json.load(f)
+
+    index_data = {'files': [], 'availability': []}
+    for record_type, record in iter_records(f, output_format):
+        if record_type == 'summary':
+            index_data.update(record)
+        else:
+            index_data['files' if record_type == 'file'
+                else 'availability'].append(record)
+    return index_data
+
+def iter_records(f, output_format):
+    """Generates ('summary'|'file'|'availability', record) tuples from
+    'ndjson' or 'binary' output, reading one record at a time
+    """
+    output_format = validate_output_format(output_format)
+    if output_format == 'ndjson':
+        return _iter_ndjson(f)
+    elif output_format == 'binary':
+        return _iter_binary(f)
+    raise ValueError("Records can only be iterated in ndjson or binary output")
+
+def _iter_ndjson(f):
+    for line in f:
+        if line.strip():
+            record = json.loads(line)
+            yield record.pop('type'), record
+
+def _read(f, num_bytes):
+    data = f.read(num_bytes)
+    if len(data) != num_bytes:
+        raise ValueError("Truncated binary index data")
+    return data
+
+def _iter_binary(f):
+    magic, version = HEADER.unpack(_read(f, HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("Not binary index data")
+    if version != VERSION:
+        raise ValueError("Unsupported binary index data version {}".format(
+            version))
+
+    length, = COUNT.unpack(_read(f, COUNT.size))
+    yield 'summary', json.loads(_read(f, length).decode())
+
+    num_files, = COUNT.unpack(_read(f, COUNT.size))
+    for i in range(num_files):
+        first_hour, last_hour, length = FILE_RECORD.unpack(
+            _read(f, FILE_RECORD.size))
+        yield 'file', {
+            'file': _read(f, length).decode(),
+            'first_hour': _from_epoch_hour(first_hour),
+            'last_hour': _from_epoch_hour(last_hour)
+        }
+
+    num_windows, = COUNT.unpack(_read(f, COUNT.size))
+    for i in range(num_windows):
+        first_hour, last_hour = WINDOW_RECORD.unpack(
+            _read(f, WINDOW_RECORD.size))
+        yield 'availability', {
+            'first_hour': _from_epoch_hour(first_hour),
+            'last_hour': _from_epoch_hour(last_hour)
+        }
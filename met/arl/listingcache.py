@@ -0,0 +1,94 @@
+"""met.arl.listingcache
+
+This module provides a cache of directory listings, used to check the
+existence of the arl files listed in index files.
+
+Each index file row can require up to three existence checks (see
+ArlFinder._get_file_pathname), and the arl files listed in an index file
+are almost always in just one or two directories.  So, rather than
+stat'ing every candidate pathname, each distinct directory is listed once,
+and all lookups in that directory are answered from the listing.  This
+includes negative lookups, which would otherwise each cost a round trip
+on NFS.
+
+The cache is meant to live only as long as one search, since it doesn't
+notice files added or removed after a directory is listed.
+"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import logging
+import os
+import threading
+
+__all__ = [
+    'DirectoryListingCache'
+]
+
+class DirectoryListingCache(object):
+
+    def __init__(self, on_list=None):
+        """Constructor
+
+        kwargs:
+         - on_list -- function called with each directory's pathname just
+            before the directory is listed
+        """
+        self._on_list = on_list
+        self._listings = {}
+        self._lock = threading.Lock()
+        # number of directories listed
+        self.listings = 0
+        # number of lookups answered from an existing listing
+        self.hits = 0
+        # number of lookups of files that don't exist
+        self.negative_lookups = 0
+
+    def isfile(self, pathname):
+        """Returns True if pathname is an existing regular file (or a
+        symlink to one), like os.path.isfile
+        """
+        dirname, name = os.path.split(pathname)
+        found = name in self._get_listing(dirname or os.curdir)
+        if not found:
+            with self._lock:
+                self.negative_lookups += 1
+        return found
+
+    def _get_listing(self, dirname):
+        with self._lock:
+            listing = self._listings.get(dirname)
+            if listing is not None:
+                self.hits += 1
+                return listing
+
+        # List outside of the lock so that other directories can be
+        # listed concurrently.  Two threads may end up listing the same
+        # directory, which is harmless.
+        if self._on_list:
+            self._on_list(dirname)
+        listing = set()
+        try:
+            with os.scandir(dirname) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file():
+                            listing.add(entry.name)
+                    except OSError:
+                        pass
+        except OSError as e:
+            # cache non-existent (or unreadable) directories as empty
+            logging.debug('Failed to list %s: %s', dirname, e)
+
+        with self._lock:
+            self.listings += 1
+            self._listings[dirname] = listing
+        return listing
+
+    def stats(self):
+        return {
+            'listings': self.listings,
+            'hits': self.hits,
+            'negative_lookups': self.negative_lookups
+        }
@@ -0,0 +1,162 @@
+"""met.arl.manifest
+
+This module provides a precomputed manifest of a met root dir's index
+files and the arl files they list, written by ArlIndexer and loaded by
+ArlFinder in place of searching the met root dir.
+
+Searching a met root dir means walking the directory tree, parsing every
+index file found, and checking the existence of every arl file listed,
+all of which are slow on NFS.  ArlIndexer already does all of this, so
+it can record the results for ArlFinder to use until the next index run.
+
+The manifest records the search parameters it was generated with (root
+dir, index filename pattern, ignore pattern, max search depth, and date
+matcher), so that ArlFinder only uses it for searches whose results it
+contains, e.g.
+
+    {
+        "version": 1,
+        "generated_at": "2015-11-03T12:05:00",
+        "search": {
+            "root_dir": "/DRI_2km",
+            "index_filename_pattern": "arl12hrindex.csv",
+            "ignore_pattern": null,
+            "max_search_depth": null
+        },
+        "date_strs": null,
+        "date_str_len": 10,
+        "start": null,
+        "end": null,
+        "index_files": [
+            {
+                "index_file": "/DRI_2km/2015110300/arl12hrindex.csv",
+                "files": [
+                    ["/DRI_2km/2015110300/wrfout_d2.2015110300.f00-11_12hr01.arl",
+                     "2015-11-03T00:00:00", "2015-11-03T11:00:00"],
+                    ...
+                ]
+            },
+            ...
+        ]
+    }
+
+(The file itself is written without whitespace.)
+"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import datetime
+import json
+import logging
+import os
+import tempfile
+
+__all__ = [
+    'ArlManifest'
+]
+
+class ArlManifest(object):
+
+    VERSION = 1
+
+    def __init__(self, search, date_strs, date_str_len, parsed,
+            start=None, end=None, generated_at=None):
+        """Constructor
+
+        args:
+         - search -- dict of the search parameters that the index files
+            were found with (see ArlFinder._manifest_search)
+         - date_strs -- date strings of the date matcher that the index
+            files were found with, or None if it matched all dates
+         - date_str_len -- length of the date matcher's date strings
+         - parsed -- list of (index file, list of arl files) tuples
+
+        kwargs:
+         - start -- start of the time range that was indexed, if restricted
+         - end -- end of the time range that was indexed, if restricted
+         - generated_at -- UTC time at which the index files were searched
+            for; defaults to now
+        """
+        self.search = search
+        self.date_strs = date_strs or None
+        self.date_str_len = date_str_len
+        self.parsed = parsed
+        self.start = start
+        self.end = end
+        self.generated_at = generated_at or datetime.datetime.utcnow()
+
+    @property
+    def age(self):
+        """Number of seconds since the manifest was generated"""
+        return (datetime.datetime.utcnow() - self.generated_at).total_seconds()
+
+    ##
+    ## Loading and saving
+    ##
+
+    def save(self, pathname):
+        """Writes the manifest to a temporary file and then moves it into
+        place, so that ArlFinder never reads a partially written manifest.
+        """
+        data = {
+            'version': self.VERSION,
+            'generated_at': self.generated_at.isoformat(),
+            'search': self.search,
+            'date_strs': self.date_strs,
+            'date_str_len': self.date_str_len,
+            'start': self.start and self.start.isoformat(),
+            'end': self.end and self.end.isoformat(),
+            'index_files': [
+                {
+                    'index_file': index_file,
+                    'files': [[f['file'], f['first_hour'].isoformat(),
+                        f['last_hour'].isoformat()] for f in arl_files]
+                } for index_file, arl_files in self.parsed
+            ]
+        }
+
+        manifest_dir = os.path.dirname(os.path.abspath(pathname))
+        fd, tmp_pathname = tempfile.mkstemp(dir=manifest_dir,
+            prefix='.arlmanifest-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(tmp_pathname, pathname)
+        except:
+            if os.path.exists(tmp_pathname):
+                os.remove(tmp_pathname)
+            raise
+
+    @classmethod
+    def load(cls, pathname):
+        """Returns the manifest saved in pathname, or None if it doesn't
+        exist or is invalid
+        """
+        try:
+            with open(pathname) as f:
+                data = json.load(f)
+            if data.get('version') != cls.VERSION:
+                logging.debug('Ignoring manifest %s with version %s',
+                    pathname, data.get('version'))
+                return None
+
+            parse = datetime.datetime.fromisoformat
+            parsed = [
+                (e['index_file'], [
+                    dict(file=f, first_hour=parse(first_hour),
+                        last_hour=parse(last_hour))
+                    for f, first_hour, last_hour in e['files']
+                ]) for e in data['index_files']
+            ]
+            return cls(data['search'], data['date_strs'],
+                data['date_str_len'], parsed,
+                start=data['start'] and parse(data['start']),
+                end=data['end'] and parse(data['end']),
+                generated_at=parse(data['generated_at']))
+
+        except FileNotFoundError:
+            logging.debug('Manifest %s does not exist', pathname)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logging.warning('Ignoring invalid manifest %s: %s', pathname, e)
+        return None
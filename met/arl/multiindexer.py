@@ -0,0 +1,200 @@
+"""met.arl.multiindexer
+
+This module indexes multiple domains in one process.
+
+Running arlindexer separately for each domain means paying for startup,
+opening mongodb connections, and walking overlapping directory trees once
+per domain.  MultiDomainIndexer instead indexes all domains with a pool
+of worker threads, sharing
+
+ - one mongodb client (and thus connection pool), which is the process
+   wide client for the shared mongodb url (see ArlIndexDB.shared_client)
+ - one in-memory cache of the directories walked looking for index files,
+   per index filename pattern, so that trees under overlapping root dirs
+   are listed once
+ - one cache of the directories listed to check the existence of arl files
+
+and updates the dates collection once, after all domains are indexed,
+rather than once per domain.
+
+Domains are configured in a json (or, if PyYAML is installed, yaml) file,
+with shared config options at the top level and per domain options,
+which override them, under 'domains'.  Options that name files written
+for a single domain (e.g. 'output_file') may only be set per domain, e.g.
+
+    {
+        "mongodb_url": "mongodb://localhost:27017/arlindex",
+        "workers": 4,
+        "domains": {
+            "DRI2km": {
+                "root_dir": "/DRI_2km",
+                "output_file": "/var/lib/arlindexer/DRI2km.json"
+            },
+            "DRI6km": {"root_dir": "/DRI_6km", "max_days_out": 2},
+            "NAM84": {
+                "root_dir": "/bluesky/data/NAM",
+                "index_filename_pattern": "NAM84_ARL_index.csv"
+            }
+        }
+    }
+"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import json
+import logging
+import re
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from .arlindexer import ArlIndexer, ArlIndexDB, met_dates_collection
+from .sqliteindexdb import is_sqlite_url
+from .discoverycache import IndexFileDiscoveryCache
+from .listingcache import DirectoryListingCache
+
+__all__ = [
+    'MultiDomainIndexer',
+    'load_config'
+]
+
+YAML_NOT_INSTALLED = "PyYAML must be installed to load yaml config files"
+
+def load_config(pathname):
+    """Loads multi-domain config from a json or yaml file"""
+    with open(pathname) as f:
+        if pathname.endswith(('.yaml', '.yml')):
+            if not yaml:
+                raise ValueError(YAML_NOT_INSTALLED)
+            config = yaml.safe_load(f)
+        else:
+            config = json.load(f)
+
+    if not isinstance(config, dict):
+        raise ValueError("Invalid config file {}".format(pathname))
+    return config
+
+
+class MultiDomainIndexer(object):
+
+    DEFAULT_WORKERS = 4
+
+    # Options naming files written for a single domain
+    PER_DOMAIN_OPTIONS = ('output_file', 'state_file', 'manifest_file')
+
+    def __init__(self, domains, overrides=None, **config):
+        """Constructor
+
+        args:
+         - domains -- dict mapping each domain identifier to its config
+            options, which must include 'root_dir' and which override
+            the shared config options
+
+        kwargs:
+         - overrides -- config options that override both the shared and
+            the per domain options (e.g. those given on the command line)
+
+        config options:
+         - workers -- number of domains to index concurrently; default: 4
+        (see ArlIndexer for its config options, which are shared by all
+        domains)
+        """
+        if not domains:
+            raise ValueError(self.NO_DOMAINS)
+        for domain, domain_config in domains.items():
+            if not (domain_config or {}).get('root_dir'):
+                raise ValueError(self.ROOT_DIR_REQUIRED.format(domain))
+        self._overrides = dict(overrides or {})
+        config = dict(config, **self._overrides)
+        self._overrides.pop('workers', None)
+        for k in self.PER_DOMAIN_OPTIONS:
+            if config.get(k):
+                raise ValueError(self.PER_DOMAIN_OPTION.format(k))
+        self._domains = domains
+        self._workers = max(1, int(config.pop('workers', None)
+            or self.DEFAULT_WORKERS))
+        self._config = config
+
+    NO_DOMAINS = "No domains configured"
+    ROOT_DIR_REQUIRED = "Root dir must be configured for domain {}"
+    PER_DOMAIN_OPTION = "{} may only be configured per domain"
+
+    def index(self):
+        """Indexes all domains, and then updates the dates collection
+
+        Domains that fail to be indexed don't prevent the others from being
+        indexed; RuntimeError is raised at the end if any failed.
+        """
+        shared = {
+            'discovery_caches': {},
+            'listing_cache': DirectoryListingCache()
+        }
+        mongo_client = None
+        if (self._config.get('mongodb_url')
+                and not is_sqlite_url(self._config['mongodb_url'])):
+            mongo_client = ArlIndexDB.shared_client(**self._config)
+        failed = []
+        mongodb_updated = False
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            futures = [(domain, executor.submit(self._index_domain,
+                domain, mongo_client, shared)) for domain in self._domains]
+            for domain, future in futures:
+                try:
+                    mongodb_updated = future.result() or mongodb_updated
+                except Exception as e:
+                    logging.debug(traceback.format_exc())
+                    logging.error("Failed to index %s: %s", domain, e)
+                    failed.append(domain)
+
+        # dates don't need to be recomputed if no domain's index data
+        # changed (see ArlIndexer._write_to_mongodb_url)
+        if mongodb_updated:
+            met_dates_collection(mongo_client=mongo_client,
+                **self._config).compute_and_save()
+
+        if failed:
+            raise RuntimeError("Failed to index {}".format(', '.join(failed)))
+
+    def _domain_config(self, domain):
+        return dict(self._config, **dict(self._domains[domain] or {},
+            **self._overrides))
+
+    def _index_domain(self, domain, mongo_client, shared):
+        """Indexes domain, returning True if its index data was written
+        to the shared mongodb url
+        """
+        config = self._domain_config(domain)
+        root_dir = config.pop('root_dir')
+        start = config.pop('start', None)
+        end = config.pop('end', None)
+        if config.get('mongodb_url'):
+            if config['mongodb_url'] == self._config.get('mongodb_url'):
+                if mongo_client is not None:
+                    config['mongo_client'] = mongo_client
+                config['defer_dates_update'] = True
+            # else, domain writes to its own db, and so updates its
+            # dates as usual
+
+        logging.info("Indexing %s", domain)
+        indexer = ArlIndexer(domain, root_dir, **config)
+        if not indexer._discovery_cache:
+            # share listings of directories walked with other domains
+            # using the same index filename pattern
+            pattern = indexer._index_filename_matcher.pattern
+            indexer._discovery_cache = shared['discovery_caches'].setdefault(
+                pattern, IndexFileDiscoveryCache(None,
+                    re.compile(pattern)))
+        indexer._shared_listing_cache = shared['listing_cache']
+        # start and end are strings if specified in the config file
+        if isinstance(start, str):
+            start = indexer._to_datetime(start)
+        if isinstance(end, str):
+            end = indexer._to_datetime(end)
+        indexer.index(start, end)
+        return (not not config.get('defer_dates_update')
+            and indexer._mongodb_updated)
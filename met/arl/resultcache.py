@@ -0,0 +1,176 @@
+"""met.arl.resultcache
+
+This module provides an in-process, LRU cache of arl finder results.
+
+Many callers look up the same time windows over and over (e.g. fires
+sharing a run window), each time paying for a full search.  With caching
+enabled (see ArlFinder's result_cache_size option), a result is reused
+as long as nothing it was computed from has changed.
+
+Each cached result records the paths that its search depended on, along
+with their mtimes and sizes at the time of the search:
+
+ - every directory visited while searching for index files, since a new
+   index file (or a new forecast directory) changes its directory's mtime
+ - every index file parsed
+ - every directory listed when checking the existence of arl files
+ - the manifest file, if one was configured
+
+Revalidating a result costs one stat per recorded path, which is much
+cheaper than searching again.  Paths are recorded before they're read, so
+a change made during the search invalidates the result.
+"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+__all__ = [
+    'ResultCache',
+    'SearchDependencies',
+    'shared_cache',
+    'shared_cache_stats'
+]
+
+class SearchDependencies(object):
+    """Paths that a search result depends on, with their stat keys"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = {}
+        self.expires_at = None
+
+    def add(self, pathname):
+        key = self._stat_key(pathname)
+        with self._lock:
+            # keep the first key recorded, i.e. the one from before the
+            # path was first read
+            self._keys.setdefault(pathname, key)
+
+    def expire_at(self, t):
+        """Marks the result as invalid after unix time t"""
+        with self._lock:
+            self.expires_at = t if self.expires_at is None else min(
+                self.expires_at, t)
+
+    def is_valid(self):
+        with self._lock:
+            keys = list(self._keys.items())
+            expires_at = self.expires_at
+        if expires_at is not None and time.time() >= expires_at:
+            return False
+        return all(self._stat_key(p) == key for p, key in keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _stat_key(self, pathname):
+        try:
+            st = os.stat(pathname)
+            return (st.st_mtime, st.st_size)
+        except OSError:
+            return None
+
+
+class ResultCache(object):
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # number of lookups answered from the cache
+        self.hits = 0
+        # number of lookups not answered from the cache, including those
+        # of invalidated entries
+        self.misses = 0
+        # number of entries dropped to make room for new ones
+        self.evictions = 0
+        # number of entries dropped because their dependencies changed
+        self.invalidations = 0
+
+    def get(self, key):
+        """Returns a copy of the cached result for key, or None if there
+        isn't one or if its dependencies have changed
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+
+        # revalidate outside of the lock, since it stats the filesystem
+        result, dependencies = entry
+        if not dependencies.is_valid():
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+                    self.invalidations += 1
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return copy.deepcopy(result)
+
+    def put(self, key, result, dependencies):
+        entry = (copy.deepcopy(result), dependencies)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def resize(self, max_size):
+        with self._lock:
+            self.max_size = max_size
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def shared_cache(max_size):
+    """Returns the process wide result cache, growing it to max_size if
+    it's smaller, so that finders created with different sizes share it
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ResultCache(max_size)
+        elif _shared_cache.max_size < max_size:
+            _shared_cache.resize(max_size)
+        return _shared_cache
+
+def shared_cache_stats():
+    """Returns the process wide result cache's counters, or None if no
+    finder has enabled it
+    """
+    with _shared_cache_lock:
+        return _shared_cache.stats() if _shared_cache is not None else None
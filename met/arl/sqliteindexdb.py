@@ -0,0 +1,361 @@
+"""met.arl.sqliteindexdb
+
+This module provides an embedded SQLite backend for the arl index, for
+servers without mongodb.  It's selected by specifying a url of the form
+'sqlite:///path/to/arlindex.db' (or 'sqlite:////abs/path/arlindex.db')
+in place of a mongodb url (see met.arl.arlindexer.met_files_collection
+and met_dates_collection).
+
+SqliteMetFilesCollection and SqliteMetDatesCollection have the same
+update/find/compute_and_save/clear methods as their mongodb counterparts,
+and return the same documents.  Each index data document is stored whole,
+as json, along with
+
+ - its server, domain, start, end, and latest forecast in indexed columns
+ - one row per date, flagged as complete or partial, so that dates can
+   be aggregated across servers in SQL
+ - one row per arl file and per availability time window, indexed by
+   domain and hour range
+
+The database is opened in WAL mode, so that readers (e.g. arlquery) don't
+block, and aren't blocked by, the indexer.
+
+SQLite has no TTL indices, so, if the 'ttl' config option is set, index
+data last indexed more than 'ttl' seconds ago is deleted whenever index
+data is written.
+"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import datetime
+import json
+import logging
+import sqlite3
+
+from .coverage import covered_hour_range
+
+__all__ = [
+    'is_sqlite_url',
+    'SqliteIndexDB',
+    'SqliteMetFilesCollection',
+    'SqliteMetDatesCollection'
+]
+
+SQLITE_URL_PREFIX = 'sqlite:///'
+
+def is_sqlite_url(url):
+    return bool(url) and url.startswith(SQLITE_URL_PREFIX)
+
+
+class SqliteIndexDB(object):
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS met_files (
+            server TEXT NOT NULL,
+            domain TEXT NOT NULL,
+            start TEXT,
+            "end" TEXT,
+            latest_forecast TEXT,
+            fingerprint TEXT,
+            last_indexed TEXT,
+            doc TEXT NOT NULL,
+            PRIMARY KEY (server, domain)
+        );
+        CREATE INDEX IF NOT EXISTS met_files_domain ON met_files (domain);
+
+        CREATE TABLE IF NOT EXISTS met_file_dates (
+            server TEXT NOT NULL,
+            domain TEXT NOT NULL,
+            date TEXT NOT NULL,
+            complete INTEGER NOT NULL,
+            PRIMARY KEY (server, domain, date)
+        );
+        CREATE INDEX IF NOT EXISTS met_file_dates_domain
+            ON met_file_dates (domain, date);
+
+        CREATE TABLE IF NOT EXISTS arl_files (
+            server TEXT NOT NULL,
+            domain TEXT NOT NULL,
+            file TEXT NOT NULL,
+            first_hour TEXT NOT NULL,
+            last_hour TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS arl_files_server_domain
+            ON arl_files (server, domain);
+        CREATE INDEX IF NOT EXISTS arl_files_hours
+            ON arl_files (domain, first_hour, last_hour);
+
+        CREATE TABLE IF NOT EXISTS availability (
+            server TEXT NOT NULL,
+            domain TEXT NOT NULL,
+            first_hour TEXT NOT NULL,
+            last_hour TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS availability_server_domain
+            ON availability (server, domain);
+        CREATE INDEX IF NOT EXISTS availability_hours
+            ON availability (domain, first_hour, last_hour);
+        CREATE INDEX IF NOT EXISTS availability_all_domains_hours
+            ON availability (first_hour, last_hour);
+
+        CREATE TABLE IF NOT EXISTS dates (
+            domain TEXT PRIMARY KEY,
+            doc TEXT NOT NULL
+        );
+    """
+
+    # seconds to wait for another connection's write lock
+    TIMEOUT = 30
+
+    def __init__(self, mongodb_url, **config):
+        """Constructor
+
+        args:
+         - mongodb_url -- url of the form 'sqlite:///path/to/arlindex.db';
+            the database is created if it doesn't exist
+        (named for compatibility with ArlIndexDB)
+
+        config options:
+         - ttl -- number of seconds after which index data of servers no
+            longer being indexed is deleted
+        (other config options are ignored)
+        """
+        if not is_sqlite_url(mongodb_url):
+            raise ValueError(self.INVALID_SQLITE_URL_ERR_MSG)
+        self.pathname = mongodb_url[len(SQLITE_URL_PREFIX):]
+        if not self.pathname:
+            raise ValueError(self.INVALID_SQLITE_URL_ERR_MSG)
+        logging.debug('sqlite db: %s', self.pathname)
+
+        self.conn = sqlite3.connect(self.pathname, timeout=self.TIMEOUT,
+            isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(self.SCHEMA)
+        self._ttl = config.get('ttl') and int(config['ttl'])
+
+    INVALID_SQLITE_URL_ERR_MSG = "Invalid sqlite url"
+
+    def close(self):
+        self.conn.close()
+
+    def _write(self, statements):
+        """Executes (sql, params) statements in one transaction"""
+        cursor = self.conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            for sql, params in statements:
+                if isinstance(params, list):
+                    cursor.executemany(sql, params)
+                else:
+                    cursor.execute(sql, params)
+            cursor.execute('COMMIT')
+        except:
+            cursor.execute('ROLLBACK')
+            raise
+
+
+def _utcnow():
+    return datetime.datetime.utcnow().replace(microsecond=0).isoformat()
+
+
+class SqliteMetFilesCollection(SqliteIndexDB):
+
+    def update(self, index_data):
+        """Updates the set of arl files on record **for a particular
+        domain on a specific server**.
+
+        If 'ttl' is set, expired index data of any domain is deleted, and
+        the domains affected are returned, so that their dates can be
+        recomputed.
+        """
+        if not index_data.get('server') or not index_data.get('domain'):
+            raise ValueError("Index data must define 'server' and 'domain'")
+
+        key = (index_data['server'], index_data['domain'])
+        dates = ([key + (d, 1) for d in index_data.get('complete_dates') or []]
+            + [key + (d, 0) for d in index_data.get('partial_dates') or []])
+        files = [key + (f['file'], f['first_hour'], f['last_hour'])
+            for f in index_data.get('files') or []]
+        availability = [key + (a['first_hour'], a['last_hour'])
+            for a in index_data.get('availability') or []]
+
+        statements = [
+            ('INSERT OR REPLACE INTO met_files (server, domain, start, "end",'
+                ' latest_forecast, fingerprint, last_indexed, doc)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                key + (index_data.get('start'), index_data.get('end'),
+                    index_data.get('latest_forecast'),
+                    index_data.get('fingerprint'), _utcnow(),
+                    json.dumps(index_data)))
+        ]
+        for table in ('met_file_dates', 'arl_files', 'availability'):
+            statements.append(('DELETE FROM {} WHERE server = ?'
+                ' AND domain = ?'.format(table), key))
+        statements.extend([
+            ('INSERT OR REPLACE INTO met_file_dates (server, domain, date,'
+                ' complete) VALUES (?, ?, ?, ?)', dates),
+            ('INSERT INTO arl_files (server, domain, file, first_hour,'
+                ' last_hour) VALUES (?, ?, ?, ?, ?)', files),
+            ('INSERT INTO availability (server, domain, first_hour,'
+                ' last_hour) VALUES (?, ?, ?, ?)', availability)
+        ])
+        self._write(statements)
+        if self._ttl:
+            return self.clear(older_than=datetime.datetime.utcnow()
+                - datetime.timedelta(seconds=self._ttl))
+        return []
+
+    def touch(self, server, domain):
+        """Updates the last indexed time of the domain's index data on
+        the server, without rewriting it
+        """
+        self._write([('UPDATE met_files SET last_indexed = ?'
+            ' WHERE server = ? AND domain = ?', (_utcnow(), server, domain))])
+
+    def get_fingerprint(self, server, domain):
+        """Returns the fingerprint of the index data on record for the
+        domain on the server, or None if there isn't any
+        """
+        row = self.conn.execute('SELECT fingerprint FROM met_files'
+            ' WHERE server = ? AND domain = ?', (server, domain)).fetchone()
+        return row and row[0]
+
+    # Query fields that are stored in columns; others are matched against
+    # the stored documents
+    COLUMNS = ('server', 'domain')
+
+    def find(self, **query):
+        """Find available files, by server and domain
+        """
+        column_query = dict((k, v) for k, v in query.items()
+            if k in self.COLUMNS)
+        doc_query = dict((k, v) for k, v in query.items()
+            if k not in self.COLUMNS)
+        sql = 'SELECT doc, last_indexed FROM met_files'
+        if column_query:
+            sql += ' WHERE ' + ' AND '.join('{} = ?'.format(k)
+                for k in column_query)
+        sql += ' ORDER BY server, domain'
+        docs = [dict(json.loads(doc), **({'last_indexed': last_indexed}
+                if last_indexed else {}))
+            for doc, last_indexed in self.conn.execute(
+                sql, tuple(column_query.values()))]
+        return [d for d in docs
+            if all(d.get(k) == v for k, v in doc_query.items())]
+
+    def covers(self, start, end, **query):
+        """Returns the server and domain of each set of met files, matching
+        query, with data for every hour from start through end
+        """
+        first_hour, last_hour = covered_hour_range(start, end)
+        column_query = dict((k, v) for k, v in query.items()
+            if k in self.COLUMNS)
+        if len(column_query) < len(query):
+            # other fields are only in the stored documents
+            matching = set((d['server'], d['domain'])
+                for d in self.find(**query))
+        sql = ('SELECT DISTINCT server, domain FROM availability'
+            ' WHERE first_hour <= ? AND last_hour >= ?')
+        for k in column_query:
+            sql += ' AND {} = ?'.format(k)
+        sql += ' ORDER BY server, domain'
+        rows = self.conn.execute(sql, (first_hour, last_hour)
+            + tuple(column_query.values()))
+        return [{'server': server, 'domain': domain} for server, domain in rows
+            if len(column_query) == len(query) or (server, domain) in matching]
+
+    def clear(self, server=None, domain=None, older_than=None):
+        """Deletes index data, of server, of domain, and/or last indexed
+        before older_than, if specified, or else all index data; returns
+        the domains affected
+        """
+        conditions, params = [], ()
+        for k, v in (('server', server), ('domain', domain)):
+            if v:
+                conditions.append('{} = ?'.format(k))
+                params += (v,)
+        if older_than:
+            # records written before 'last_indexed' was recorded are
+            # judged by 'indexed_at'
+            conditions.append("COALESCE(last_indexed,"
+                " json_extract(doc, '$.indexed_at')) < ?")
+            params += (older_than.replace(microsecond=0).isoformat(),)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+        keys = self.conn.execute('SELECT server, domain FROM met_files'
+            + where, params).fetchall()
+        if not keys:
+            return []
+        if not conditions:
+            self._write([('DELETE FROM {}'.format(t), ()) for t in
+                ('met_files', 'met_file_dates', 'arl_files', 'availability')])
+        else:
+            self._write([('DELETE FROM {} WHERE server = ? AND domain = ?'
+                    .format(t), keys) for t in
+                ('met_files', 'met_file_dates', 'arl_files', 'availability')])
+        return sorted(set(domain for server, domain in keys))
+
+
+class SqliteMetDatesCollection(SqliteIndexDB):
+
+    def compute(self, domain=None):
+        """Returns dates information per domain, across all servers
+        """
+        where, params = ('WHERE domain = ?', (domain,)) if domain else ('', ())
+        to_save = {}
+        for d, start, end, latest_forecast in self.conn.execute(
+                'SELECT domain, MIN(start), MAX("end"), MAX(latest_forecast)'
+                ' FROM met_files {} GROUP BY domain ORDER BY domain'.format(
+                where), params):
+            to_save[d] = {
+                'domain': d,
+                'complete_dates': [],
+                'partial_dates': [],
+                'start': start,
+                'end': end,
+                'latest_forecast': latest_forecast
+            }
+
+        # a date is complete if it's complete on any server
+        for d, date, complete in self.conn.execute(
+                'SELECT domain, date, MAX(complete) FROM met_file_dates'
+                ' {} GROUP BY domain, date ORDER BY domain, date'.format(
+                where), params):
+            if d in to_save:
+                to_save[d]['complete_dates' if complete
+                    else 'partial_dates'].append(date)
+
+        return list(to_save.values())
+
+    def compute_and_save(self, domain=None):
+        """Updates the dates information across all servers, for domain
+        if specified, or else for all domains
+        """
+        to_save = self.compute(domain=domain)
+        statements = []
+        if to_save:
+            statements.append(('INSERT OR REPLACE INTO dates (domain, doc)'
+                ' VALUES (?, ?)', [(d['domain'], json.dumps(d))
+                    for d in to_save]))
+        # remove dates of domains no longer indexed on any server
+        if domain:
+            if not to_save:
+                statements.append(('DELETE FROM dates WHERE domain = ?',
+                    (domain,)))
+        else:
+            statements.append(('DELETE FROM dates WHERE domain NOT IN'
+                ' (SELECT DISTINCT domain FROM met_files)', ()))
+        self._write(statements)
+        return to_save
+
+    def find(self, domain=None):
+        """Find available dates, by domain or across all dates
+        """
+        where, params = ('WHERE domain = ?', (domain,)) if domain else ('', ())
+        return [json.loads(row[0]) for row in self.conn.execute(
+            'SELECT doc FROM dates {} ORDER BY domain'.format(where), params)]
+
+    def clear(self, domain=None):
+        where, params = ('WHERE domain = ?', (domain,)) if domain else ('', ())
+        self._write([('DELETE FROM dates {}'.format(where), params)])
@@ -0,0 +1,264 @@
+"""met.arl.watcher
+
+This module provides a watcher that keeps an arl index up to date by
+polling for new forecasts and incrementally re-indexing as soon as they're
+complete.
+
+Rather than walking the domain's root dir on each poll, the watcher stats
+only a handful of directories: the root dir, each directory between it and
+the latest forecast's directory, and the latest forecast directory itself.
+A new forecast directory changes its parent's mtime, at which point the
+new directory is watched as well; a new (or rewritten) index file changes
+its forecast directory's mtime.
+
+Once a change is seen, the watcher waits for things to settle (the
+'debounce' period, during which no further changes are seen) and then runs
+an incremental index (see ArlIndexer._index_incrementally), which also
+updates the dates collection.  If there are new index files, it waits
+until at least one of them lists only existing arl files; an index file
+whose arl files are still missing after 'max_wait' seconds is indexed
+anyway.  Index files still waiting after a run are checked again on the
+next poll.  Index runs are at least 'min_interval' seconds apart.
+
+Directories of forecasts superseded by a newer forecast are no longer
+watched once the newer one is indexed.
+"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import logging
+import os
+import threading
+import time
+import traceback
+
+__all__ = [
+    'ArlIndexWatcher'
+]
+
+class ArlIndexWatcher(object):
+
+    DEFAULT_POLL_INTERVAL = 10
+    DEFAULT_DEBOUNCE = 30
+    DEFAULT_MIN_INTERVAL = 60
+    DEFAULT_MAX_WAIT = 600
+
+    def __init__(self, indexer, poll_interval=None, debounce=None,
+            min_interval=None, max_wait=None):
+        """Constructor
+
+        args:
+         - indexer -- ArlIndexer, configured with 'incremental' set
+
+        kwargs:
+         - poll_interval -- number of seconds between polls; default 10
+         - debounce -- number of seconds without further changes to wait
+            before indexing; default 30
+         - min_interval -- min number of seconds between index runs, i.e.
+            the max refresh rate; default 60
+         - max_wait -- max number of seconds to wait for a new index file's
+            arl files to all exist before indexing it anyway; default 600
+        """
+        self._indexer = indexer
+        self._poll_interval = (self.DEFAULT_POLL_INTERVAL
+            if poll_interval is None else float(poll_interval))
+        self._debounce = (self.DEFAULT_DEBOUNCE
+            if debounce is None else float(debounce))
+        self._min_interval = (self.DEFAULT_MIN_INTERVAL
+            if min_interval is None else float(min_interval))
+        self._max_wait = (self.DEFAULT_MAX_WAIT
+            if max_wait is None else float(max_wait))
+        self._root_dir = indexer._met_root_dir
+        # watched dir -> mtime when last checked (None if never checked)
+        self._watched = {}
+        # dirs changed since the last index run
+        self._changed = set()
+        # new index file -> when first seen to be missing arl files
+        self._waiting_since = {}
+        self._last_change_at = None
+        self._last_index_at = None
+        self._index_started_at = None
+        self.num_runs = 0
+
+    ##
+    ## Running
+    ##
+
+    def run(self, stop_event=None):
+        """Indexes, and then polls and re-indexes until stop_event is set
+
+        Errors while indexing are logged rather than raised, so that the
+        watcher keeps running.
+        """
+        stop_event = stop_event or threading.Event()
+        try:
+            self._index(time.time())
+        except Exception as e:
+            logging.debug(traceback.format_exc())
+            logging.error("Failed to index: %s", e)
+        while not stop_event.wait(self._poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logging.debug(traceback.format_exc())
+                logging.error("Failed to poll and index: %s", e)
+
+    def poll(self, now=None):
+        """Checks watched dirs for changes, and indexes if a change has
+        settled and is ready to be indexed; returns True if it indexed
+        """
+        now = time.time() if now is None else now
+        if self._check_watched():
+            self._last_change_at = now
+
+        if not self._changed and not self._waiting_since:
+            return False
+        if now - self._last_change_at < self._debounce:
+            logging.debug("Waiting for changes to settle")
+            return False
+        if (self._last_index_at is not None
+                and now - self._last_index_at < self._min_interval):
+            logging.debug("Waiting to re-index, to limit refresh rate")
+            return False
+
+        index_files = self._new_index_files()
+        ready = [f for f in index_files if self._index_file_ready(f, now)]
+        if index_files and not ready:
+            logging.debug("Waiting for new index files' arl files")
+            return False
+
+        self._index(now, ready)
+        return True
+
+    def _index(self, now, index_files=()):
+        # Stat the watched dirs before indexing, so that changes made
+        # while indexing are seen on the next poll
+        self._check_watched()
+        logging.info("Indexing %s", self._root_dir)
+        self._last_index_at = now
+        self._index_started_at = time.time()
+        # changes are left pending if indexing fails, to be retried
+        # after min_interval
+        try:
+            self._indexer.index()
+        except Exception:
+            # ensure a retry, even if nothing was pending (e.g. if the
+            # initial run failed)
+            self._changed.add(self._root_dir)
+            self._last_change_at = self._last_change_at or now
+            raise
+        self._changed = set()
+        for f in index_files:
+            self._waiting_since.pop(f, None)
+        self.num_runs += 1
+        self._watch_latest_forecast()
+
+    def _index_file_ready(self, index_file, now):
+        """Returns True if index_file's arl files all exist, or if they
+        haven't after waiting max_wait seconds
+        """
+        if self._indexer.index_file_ready(index_file):
+            return True
+        waiting_since = self._waiting_since.setdefault(index_file, now)
+        if now - waiting_since < self._max_wait:
+            return False
+        logging.warning("Indexing %s, though its arl files haven't all "
+            "appeared after %s seconds", index_file, self._max_wait)
+        return True
+
+    ##
+    ## Watching dirs
+    ##
+
+    # Allowance for coarse mtime granularity (e.g. on NFS)
+    MTIME_SLACK = 2
+
+    def _watch_latest_forecast(self):
+        """Watches the root dir and every dir down to that of the latest
+        index file, and stops watching dirs superseded by it
+        """
+        dirs = [self._root_dir]
+        latest_index_file = self._indexer.latest_index_file
+        if latest_index_file:
+            rel_dir = os.path.relpath(os.path.dirname(latest_index_file),
+                self._root_dir)
+            if rel_dir != os.curdir and not rel_dir.startswith(os.pardir):
+                for name in rel_dir.split(os.sep):
+                    dirs.append(os.path.join(dirs[-1], name))
+
+        latest = self._rel_path_names(dirs[-1])
+        waiting_dirs = set(os.path.dirname(f) for f in self._waiting_since)
+        for d in list(self._watched):
+            names = self._rel_path_names(d)
+            # dated dir names sort chronologically
+            if (names != latest[:len(names)] and names < latest
+                    and d not in waiting_dirs):
+                logging.debug("No longer watching superseded dir %s", d)
+                del self._watched[d]
+
+        for d in dirs:
+            if d not in self._watched:
+                # Dirs changed since indexing started may have changed
+                # after the indexer looked at them, so leave them to be
+                # seen as changed
+                mtime = self._mtime(d)
+                self._watched[d] = (mtime if mtime is not None and
+                    mtime < self._index_started_at - self.MTIME_SLACK else None)
+
+    def _rel_path_names(self, dirname):
+        rel_dir = os.path.relpath(dirname, self._root_dir)
+        return () if rel_dir == os.curdir else tuple(rel_dir.split(os.sep))
+
+    def _check_watched(self):
+        """Stats watched dirs, recording those that changed, and starts
+        watching new dated subdirectories of changed dirs; returns True
+        if any changed
+        """
+        changed = False
+        for d, mtime in list(self._watched.items()):
+            current_mtime = self._mtime(d)
+            if current_mtime is None or current_mtime == mtime:
+                continue
+            self._watched[d] = current_mtime
+            self._changed.add(d)
+            changed = True
+            for subdir in self._list_dated_subdirs(d):
+                if subdir not in self._watched:
+                    logging.debug("Watching new dir %s", subdir)
+                    self._watched[subdir] = self._mtime(subdir)
+                    self._changed.add(subdir)
+        return changed
+
+    def _list_dated_subdirs(self, dirname):
+        try:
+            with os.scandir(dirname) as it:
+                return [e.path for e in it if e.is_dir()
+                    and self._indexer.DATE_DIR_NAME_MATCHER.match(e.name)]
+        except OSError:
+            return []
+
+    def _new_index_files(self):
+        """Returns the new or modified index files in changed dirs, along
+        with those still waiting for their arl files
+        """
+        index_files = set(f for f in self._waiting_since if os.path.isfile(f))
+        for d in self._changed:
+            try:
+                with os.scandir(d) as it:
+                    index_files.update(e.path for e in it if e.is_file()
+                        and self._indexer._index_filename_matcher.match(e.name)
+                        and e.stat().st_mtime >= self._index_started_at
+                            - self.MTIME_SLACK)
+            except OSError:
+                pass
+        # forget removed index files
+        for f in set(self._waiting_since) - index_files:
+            del self._waiting_since[f]
+        return sorted(index_files)
+
+    def _mtime(self, pathname):
+        try:
+            return os.stat(pathname).st_mtime
+        except OSError:
+            return None
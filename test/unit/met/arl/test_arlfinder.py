@@ -8,12 +8,14 @@ import datetime
 import tempfile
 import io # for monkeypatching
 import os
+import random
+import re
+import threading
+import time
 
 from pytest import raises
 
-from pyairfire import io as p_io # for monkeypatching
-
-from met.arl import arlfinder
+from met.arl import arlfinder, findstats, listingcache, resultcache
 
 ##
 ## Tests for ArlFinder
@@ -172,6 +174,149 @@ class TestARLFinderCreateDateMatcher(object):
         m = self.arl_finder._create_date_matcher(None, None)
         assert m.pattern == '.*(\d{10})'
 
+
+class TestDateMatcher(object):
+
+    PATHNAMES = [
+        '/DRI_2km/2015010200/arl12hrindex.csv',
+        '/DRI_2km/2015010212',
+        '/DRI_2km/20150102',
+        '/DRI_2km/2015010',
+        '/DRI_2km/12015010200',
+        '/bluesky/data/NAM/2014123100/NAM84_ARL_2015010200_index.csv',
+        '/storage/NWRMC/1.33km/2015010300',
+        '/storage/NWRMC/1.33km/2015010300/foo',
+        '/storage/NWRMC/1.33km',
+        ''
+    ]
+
+    def _assert_equivalent_to_regex(self, date_strs):
+        m = arlfinder.DateMatcher(date_strs)
+        regex = re.compile(m.pattern)
+        for p in self.PATHNAMES:
+            assert bool(m.match(p)) == bool(regex.match(p)), p
+
+    def test_dates(self):
+        m = arlfinder.DateMatcher(['20141231', '20150101', '20150102'])
+        assert m.pattern == '.*(20141231|20150101|20150102)'
+        assert not m.matches_all
+        assert m.match('/DRI_2km/2015010212/arl12hrindex.csv') == '20150102'
+        assert m.match('/DRI_2km/2015010312/arl12hrindex.csv') is None
+        self._assert_equivalent_to_regex(['20141231', '20150101', '20150102'])
+
+    def test_forecasts(self):
+        m = arlfinder.DateMatcher(['2015010200', '2015010212'])
+        assert m.match('/DRI_2km/2015010212/arl12hrindex.csv') == '2015010212'
+        assert m.match('/DRI_2km/2015010200') == '2015010200'
+        assert m.match('/DRI_2km/20150102') is None
+        self._assert_equivalent_to_regex(['2015010200', '2015010212'])
+        self._assert_equivalent_to_regex(['2015010300', '2014123100'])
+
+    def test_all_dates(self):
+        m = arlfinder.DateMatcher()
+        assert m.pattern == '.*(\\d{10})'
+        assert m.matches_all
+        assert m.match('/DRI_2km/2015010212/arl12hrindex.csv') == '2015010212'
+        assert m.match('/DRI_2km/20150102') is None
+        self._assert_equivalent_to_regex(None)
+
+    def test_mixed_lengths(self):
+        with raises(ValueError):
+            arlfinder.DateMatcher(['20150102', '2015010212'])
+
+    def test_covers(self):
+        all_10 = arlfinder.DateMatcher()
+        all_8 = arlfinder.DateMatcher(date_str_len=8)
+        days = arlfinder.DateMatcher(['20150102', '20150103'])
+        day = arlfinder.DateMatcher(['20150103'])
+        hour = arlfinder.DateMatcher(['2015010300'])
+        assert all_8.covers(all_10) and all_8.covers(days) and all_8.covers(hour)
+        assert all_10.covers(hour) and not all_10.covers(days)
+        assert not all_10.covers(all_8)
+        assert days.covers(day) and days.covers(days)
+        assert not day.covers(days) and not days.covers(hour)
+        assert not days.covers(all_8)
+
+class TestARLFinderFindIndexFiles(object):
+
+    def setup_method(self):
+        self.root_dir = tempfile.mkdtemp()
+        for d in ('2015102000', '2015102000/2015110200', '2015110100',
+                '2015110200', '2015110200/sub', 'MOVED/2015110200',
+                'foo/2015110300', '99999999'):
+            os.makedirs(os.path.join(self.root_dir, d), exist_ok=True)
+            with open(os.path.join(self.root_dir, d, 'arl12hrindex.csv'), 'w') as f:
+                f.write('')
+        self.s = datetime.datetime(2015, 11, 3, 0)
+        self.e = datetime.datetime(2015, 11, 4, 0)
+
+    def _find(self, **config):
+        arl_finder = arlfinder.ArlFinder(self.root_dir, **config)
+        visited = []
+        list_dir = arl_finder._list_dir
+        def _list_dir(dirname, *args):
+            visited.append(os.path.relpath(dirname, self.root_dir))
+            return list_dir(dirname, *args)
+        arl_finder._list_dir = _list_dir
+        date_matcher = arl_finder._create_date_matcher(self.s, self.e)
+        index_files = arl_finder._find_index_files(date_matcher)
+        return ([os.path.relpath(f, self.root_dir) for f in index_files],
+            sorted(visited))
+
+    def test_prunes_dated_dirs_outside_of_window(self):
+        index_files, visited = self._find()
+        assert index_files == [
+            '2015110100/arl12hrindex.csv',
+            '2015110200/arl12hrindex.csv',
+            '2015110200/sub/arl12hrindex.csv',
+            'MOVED/2015110200/arl12hrindex.csv',
+            'foo/2015110300/arl12hrindex.csv'
+        ]
+        # '2015102000' is pruned without being listed, and so
+        # '2015102000/2015110200' is skipped
+        assert visited == ['.', '2015110100', '2015110200', '2015110200/sub',
+            '99999999', 'MOVED', 'MOVED/2015110200', 'foo', 'foo/2015110300']
+
+    def test_accepted_forecasts_in_daily_dirs(self):
+        for d in ('20151102/2015110200', '20151102/2015110212',
+                '20151101/2015110100'):
+            os.makedirs(os.path.join(self.root_dir, d))
+            with open(os.path.join(self.root_dir, d, 'arl12hrindex.csv'), 'w') as f:
+                f.write('')
+        self.s = self.e = None
+        index_files, visited = self._find(accepted_forecasts=['2015110200'])
+        assert index_files == [
+            '20151102/2015110200/arl12hrindex.csv',
+            '2015110200/arl12hrindex.csv',
+            '2015110200/sub/arl12hrindex.csv',
+            'MOVED/2015110200/arl12hrindex.csv'
+        ]
+        assert '20151101' not in visited
+        assert '20151102/2015110212' not in visited
+
+    def test_prunes_ignored_dirs(self):
+        index_files, visited = self._find(ignore_pattern='/MOVED/')
+        assert 'MOVED/2015110200/arl12hrindex.csv' not in index_files
+        assert 'MOVED' in visited
+        assert 'MOVED/2015110200' not in visited
+
+    def test_max_search_depth(self):
+        index_files, visited = self._find(max_search_depth=1)
+        assert index_files == [
+            '2015110100/arl12hrindex.csv',
+            '2015110200/arl12hrindex.csv'
+        ]
+        assert visited == ['.', '2015110100', '2015110200', '99999999',
+            'MOVED', 'foo']
+
+        # dirs at the max depth are counted as visited
+        stats = findstats.FindStats()
+        arl_finder = arlfinder.ArlFinder(self.root_dir, max_search_depth=1)
+        arl_finder._find_index_files(arl_finder._create_date_matcher(
+            self.s, self.e), stats)
+        assert stats.counts['dirs_visited'] == 6
+
+
 class TestARLFinderParseIndexFiles(object):
     """Unit test for _parse_index_files and _parse_index_file"""
 
@@ -185,15 +330,26 @@ class TestARLFinderParseIndexFiles(object):
         # _parse_index_files simply concatenates the lists returned by
         # _parse_index_file
         monkeypatch.setattr(self.arl_finder, '_parse_index_file',
-            lambda i: [i+'a', i+'b'])
+            lambda i, **kwargs: [i+'a', i+'b'])
         expected = ['aa', 'ab', 'ba', 'bb']
         assert expected == self.arl_finder._parse_index_files(['a','b'])
 
+    def test_parse_index_files_with_workers(self, monkeypatch):
+        # results are returned in order of index files, regardless of
+        # the order in which parsing completes
+        arl_finder = arlfinder.ArlFinder(tempfile.mkdtemp(), parse_workers=4)
+        def _parse_index_file(i, **kwargs):
+            time.sleep(0.01 * (5 - int(i)))
+            return [i+'a', i+'b']
+        monkeypatch.setattr(arl_finder, '_parse_index_file', _parse_index_file)
+        expected = [i + s for i in '01234' for s in 'ab']
+        assert expected == arl_finder._parse_index_files(list('01234'))
+
     def test_parse_index_file(self, monkeypatch):
-        monkeypatch.setattr(p_io.Stream, "_open_file",
-            lambda s: io.StringIO(INDEX_CONTENTS['2015110200']))
+        monkeypatch.setattr(self.arl_finder, "_open_index_file",
+            lambda i: io.StringIO(INDEX_CONTENTS['2015110200']))
         monkeypatch.setattr(self.arl_finder, "_get_file_pathname",
-            lambda i, n: n)
+            lambda i, n, **kwargs: n)
         expected = [
             {
                 'file': '/storage/NWRMC/4km/2015110200/wrfout_d3.2015110100.f24-35_12hr02.arl',
@@ -234,8 +390,84 @@ class TestARLFinderParseIndexFiles(object):
         assert expected == self.arl_finder._parse_index_file('foo')
 
 
-# TODO: test _get_file_pathnam, monkeypatching os.path.abspath,
-#    os.path.isfile, etc. appropriately
+class TestReadIndexFile(object):
+
+    def test_fixed_format(self):
+        f = io.StringIO(INDEX_CONTENTS['2015110300'])
+        rows = list(arlfinder.read_index_file(f))
+        assert len(rows) == 7
+        assert rows[0] == (
+            '/storage/NWRMC/4km/2015110300/wrfout_d3.2015110200.f24-35_12hr02.arl',
+            datetime.datetime(2015,11,3,0,0,0),
+            datetime.datetime(2015,11,3,11,0,0))
+
+    def test_other_column_order_quoting_and_formats(self):
+        f = io.StringIO('start,end,filename\r\n'
+            '2015-11-03T00:00:00,2015-11-03 11:00:00,a.arl\r\n'
+            '\r\n'
+            '2015-11-03 12:00:00,2015-11-03 23:00:00,"b,c.arl"\r\n')
+        assert list(arlfinder.read_index_file(f)) == [
+            ('a.arl', datetime.datetime(2015,11,3,0,0,0),
+                datetime.datetime(2015,11,3,11,0,0)),
+            ('b,c.arl', datetime.datetime(2015,11,3,12,0,0),
+                datetime.datetime(2015,11,3,23,0,0))
+        ]
+
+    def test_empty_and_invalid(self):
+        assert list(arlfinder.read_index_file(io.StringIO(''))) == []
+        with raises(ValueError) as e_info:
+            list(arlfinder.read_index_file(io.StringIO('foo,bar\n')))
+        with raises(ValueError) as e_info:
+            list(arlfinder.read_index_file(io.StringIO(
+                'filename,start,end,interval\na.arl,2015-11-03 00:0x:00,'
+                '2015-11-03 11:00:00,12\n')))
+
+
+class TestARLFinderGetFilePathname(object):
+
+    def setup_method(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.index_dir = os.path.join(self.root_dir, '2015110300')
+        os.makedirs(os.path.join(self.index_dir, 'sub'))
+        self.index_file = os.path.join(self.index_dir, 'arl12hrindex.csv')
+        for f in ('a.arl', 'b.arl', 'sub/c.arl'):
+            with open(os.path.join(self.index_dir, f), 'w') as f:
+                f.write('')
+        self.arl_finder = arlfinder.ArlFinder(self.root_dir)
+
+    def _check(self, **kwargs):
+        call = lambda index_file, name: self.arl_finder._get_file_pathname(
+            index_file, name, **kwargs)
+        # name only
+        assert call(self.index_file, 'a.arl') == os.path.join(self.index_dir, 'a.arl')
+        # absolute path
+        assert (call(self.index_file, os.path.join(self.index_dir, 'b.arl'))
+            == os.path.join(self.index_dir, 'b.arl'))
+        # relative path
+        assert (call(self.index_file, 'sub/c.arl')
+            == os.path.join(self.index_dir, 'sub/c.arl'))
+        # absolute path on another server, but file is in index file dir
+        assert (call(self.index_file, '/storage/NWRMC/4km/2015110300/a.arl')
+            == os.path.join(self.index_dir, 'a.arl'))
+        # leading '/'
+        assert call(self.index_file, '/b.arl') == os.path.join(self.index_dir, 'b.arl')
+        # doesn't exist
+        assert call(self.index_file, 'd.arl') is None
+        assert call(self.index_file, '/storage/NWRMC/4km/2015110300/d.arl') is None
+        assert call(self.index_file, 'sub/d.arl') is None
+
+    def test_without_listing_cache(self):
+        self._check()
+
+    def test_with_listing_cache(self, monkeypatch):
+        def _isfile(name):
+            raise AssertionError("Shouldn't be called")
+        monkeypatch.setattr(os.path, "isfile", _isfile)
+        listing_cache = listingcache.DirectoryListingCache()
+        self._check(listing_cache=listing_cache)
+        # the index dir, its 'sub' dir, '/storage/NWRMC/4km/2015110300',
+        # '/', and 'sub' relative to the cwd are each listed once
+        assert listing_cache.listings == 5
 
 
 class TestARLFinderPruneAndSort(object):
@@ -808,6 +1040,76 @@ class TestARLFinderWindowDetermination(object):
 
 
 
+class TestARLFinderDetermineTimeWindows(object):
+    """Compares _determine_time_windows against the original hour by hour
+    assignment algorithm, on randomly generated sets of arl files
+    """
+
+    ONE_HOUR = datetime.timedelta(hours=1)
+
+    def _hour_by_hour(self, arl_finder, arl_files, start, end):
+        sorted_arl_files = arl_finder._prune_and_sort(arl_files, start, end)
+        fewer_arl_files = arl_finder._fewer_arl_files
+
+        files_per_hour = {}
+        num_arl_files = len(sorted_arl_files)
+        for i in range(num_arl_files):
+            f_dict = sorted_arl_files[i]
+            dt = max(f_dict['first_hour'], start) if start else f_dict['first_hour']
+            if fewer_arl_files:
+                if i < (num_arl_files - 1):
+                    latest_dt = max(list(files_per_hour.keys()) + [dt]) if files_per_hour else dt
+                    if (latest_dt + self.ONE_HOUR > sorted_arl_files[i+1]['first_hour']
+                            or (latest_dt + self.ONE_HOUR == sorted_arl_files[i+1]['first_hour']
+                                and files_per_hour.get(latest_dt))):
+                        continue
+
+            end_dt = min(f_dict['last_hour'], end) if end else f_dict['last_hour']
+            while dt <= end_dt:
+                if not files_per_hour.get(dt) or not fewer_arl_files:
+                    files_per_hour[dt] = f_dict
+                dt += self.ONE_HOUR
+        files_per_hour = {dt: f['file'] for dt, f in files_per_hour.items()}
+        return arl_finder._determine_file_time_windows(files_per_hour)
+
+    def _random_arl_files(self, r):
+        base = datetime.datetime(2015, 1, 1)
+        arl_files = []
+        for forecast in range(r.randint(0, 12)):
+            init = base + datetime.timedelta(hours=r.choice([6, 12, 24]) * forecast)
+            num_files = r.randint(1, 4)
+            hours_per_file = r.choice([6, 12, 36, 84])
+            for j in range(num_files):
+                first_hour = init + datetime.timedelta(hours=hours_per_file * j
+                    + r.choice([0, 0, 0, 1]))
+                arl_files.append({
+                    'file': '{}/{}'.format(init.strftime('%Y%m%d%H'), j),
+                    'first_hour': first_hour,
+                    'last_hour': first_hour + datetime.timedelta(
+                        hours=r.randint(0, hours_per_file - 1))
+                })
+        return arl_files
+
+    def _random_window(self, r):
+        if r.random() < 0.2:
+            return None, None
+        start = datetime.datetime(2015, 1, 1) + datetime.timedelta(
+            hours=r.randint(-24, 200))
+        return start, start + datetime.timedelta(hours=r.randint(0, 200))
+
+    def test_matches_hour_by_hour_assignment(self):
+        r = random.Random(1234)
+        for fewer_arl_files in (False, True):
+            arl_finder = arlfinder.ArlFinder(tempfile.mkdtemp(),
+                fewer_arl_files=fewer_arl_files)
+            for i in range(300):
+                arl_files = self._random_arl_files(r)
+                start, end = self._random_window(r)
+                expected = self._hour_by_hour(arl_finder, arl_files, start, end)
+                actual = arl_finder._determine_time_windows(arl_files, start, end)
+                assert expected == actual, (fewer_arl_files, start, end, arl_files)
+
+
 class TestARLFinderFind(object):
 
     def _create_index_csv(self, date_str):
@@ -837,8 +1139,8 @@ class TestARLFinderFind(object):
         assert e_info.value.args[0] == arl_finder.START_AND_END_REQUIRED
 
     def test_no_config_no_matches(self, monkeypatch):
-        monkeypatch.setattr(os.path, "isfile",
-            lambda name: True)
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
         s = datetime.datetime(2015, 1, 1, 14)
         e = datetime.datetime(2015, 1, 4, 2)
         r = arlfinder.ArlFinder(self.root_dir).find(s, e)
@@ -846,8 +1148,8 @@ class TestARLFinderFind(object):
         assert r == expected
 
     def test_no_config_w_matches(self, monkeypatch):
-        monkeypatch.setattr(os.path, "isfile",
-            lambda name: True)
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
         s = datetime.datetime(2015, 11, 1, 14)
         e = datetime.datetime(2015, 11, 4, 2)
         actual = arlfinder.ArlFinder(self.root_dir).find(s, e)
@@ -883,9 +1185,125 @@ class TestARLFinderFind(object):
         assert actual == expected
 
 
+    def test_find_many(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        forecast_dir = os.path.join(self.root_dir, '2015102000')
+        os.makedirs(forecast_dir)
+        with open(os.path.join(forecast_dir, 'arl12hrindex.csv'), 'w') as f:
+            f.write("filename,start,end,interval\n"
+                "/storage/2015102000/a.arl,2015-10-20 00:00:00,2015-10-23 11:00:00,84\n")
+        windows = [
+            (datetime.datetime(2015, 11, 1, 14), datetime.datetime(2015, 11, 4, 2)),
+            (datetime.datetime(2015, 11, 2, 20), datetime.datetime(2015, 11, 3, 2)),
+            (datetime.datetime(2015, 11, 3, 0), datetime.datetime(2015, 11, 5, 11)),
+            # only 2015102000 is within max days out
+            (datetime.datetime(2015, 10, 21, 0), datetime.datetime(2015, 10, 22, 0)),
+            (datetime.datetime(2015, 1, 1, 14), datetime.datetime(2015, 1, 4, 2))
+        ]
+        for config in ({}, {'fewer_arl_files': True}, {'max_days_out': 0}):
+            arl_finder = arlfinder.ArlFinder(self.root_dir, **config)
+            expected = [arl_finder.find(s, e) for s, e in windows]
+            assert expected[0]['files']
+            assert bool(expected[3]['files']) == (config.get('max_days_out') != 0)
+            assert arl_finder.find_many(windows) == expected
+
+        assert arlfinder.ArlFinder(self.root_dir).find_many([]) == []
+        with raises(ValueError) as e_info:
+            arlfinder.ArlFinder(self.root_dir).find_many(
+                [windows[0], (None, windows[1][1])])
+        assert e_info.value.args[0] == arlfinder.ArlFinder.START_AND_END_REQUIRED
+
+    def test_with_discovery_cache(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        s = datetime.datetime(2015, 11, 1, 14)
+        e = datetime.datetime(2015, 11, 4, 2)
+        cache_file = os.path.join(tempfile.mkdtemp(), 'cache.json')
+        expected = arlfinder.ArlFinder(self.root_dir).find(s, e)
+
+        arl_finder = arlfinder.ArlFinder(self.root_dir,
+            discovery_cache_file=cache_file)
+        assert arl_finder.find(s, e) == expected
+        assert os.path.isfile(cache_file)
+        # a second finder shares the cache written by the first
+        assert arlfinder.ArlFinder(self.root_dir,
+            discovery_cache_file=cache_file).find(s, e) == expected
+
+    def test_with_result_cache(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        monkeypatch.setattr(resultcache, '_shared_cache', None)
+        s = datetime.datetime(2015, 11, 1, 14)
+        e = datetime.datetime(2015, 11, 4, 2)
+        expected = arlfinder.ArlFinder(self.root_dir).find(s, e)
+
+        arl_finder = arlfinder.ArlFinder(self.root_dir, result_cache_size=10)
+        assert arl_finder.find(s, e) == expected
+        r = arl_finder.find(s, e, include_stats=True)
+        assert r['stats']['counts']['result_cache_hits'] == 1
+        assert 'dirs_visited' not in r['stats']['counts']
+        r.pop('stats')
+        assert r == expected
+
+        # other finders with the same config share the cache...
+        r = arlfinder.ArlFinder(self.root_dir, result_cache_size=10).find(
+            s, e, include_stats=True)
+        assert r['stats']['counts']['result_cache_hits'] == 1
+        # ...but not those with different config
+        r = arlfinder.ArlFinder(self.root_dir, result_cache_size=10,
+            max_days_out=1).find(s, e, include_stats=True)
+        assert r['stats']['counts']['result_cache_misses'] == 1
+
+        # an index file written to an existing dir invalidates the result
+        forecast_dir = os.path.join(self.root_dir, '2015110400')
+        os.makedirs(forecast_dir)
+        r = arl_finder.find(s, e, include_stats=True)
+        assert r['stats']['counts']['result_cache_misses'] == 1
+        with open(os.path.join(forecast_dir, 'arl12hrindex.csv'), 'w') as f:
+            f.write("filename,start,end,interval\n"
+                "/storage/NWRMC/4km/2015110400/wrfout_d3.2015110400.f00-11_12hr01.arl,"
+                "2015-11-04 00:00:00,2015-11-04 11:00:00,12\n")
+        r = arl_finder.find(s, e, include_stats=True)
+        assert r['stats']['counts']['result_cache_misses'] == 1
+        r.pop('stats')
+        assert r != expected
+        assert r == arlfinder.ArlFinder(self.root_dir).find(s, e)
+        r = arl_finder.find(s, e, include_stats=True)
+        assert r['stats']['counts']['result_cache_hits'] == 1
+
+    def test_include_stats(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        os.makedirs(os.path.join(self.root_dir, '2015010100'))
+        s = datetime.datetime(2015, 11, 1, 14)
+        e = datetime.datetime(2015, 11, 4, 2)
+        arl_finder = arlfinder.ArlFinder(self.root_dir)
+        expected = arl_finder.find(s, e)
+        actual = arl_finder.find(s, e, include_stats=True)
+        stats = actual.pop('stats')
+        assert actual == expected
+
+        num_rows = sum(len(INDEX_CONTENTS[d].strip().split('\n')) - 1
+            for d in ('2015110200', '2015110300'))
+        assert stats['counts'] == {
+            'dirs_visited': 3,
+            'dirs_pruned': 1,
+            'index_files_found': 2,
+            'rows_read': num_rows,
+            'index_files_parsed': 2,
+            'arl_files_found': num_rows,
+            'arl_dir_listings': 0,
+            'arl_listing_cache_hits': 0,
+            'arl_negative_lookups': 0,
+            'windows': 1
+        }
+        assert set(stats['timings']) == set(['total', 'find_index_files',
+            'parse_index_files', 'determine_time_windows', 'format'])
+
     def test_with_accepted_forecasts_w_match_20151102(self, monkeypatch):
-        monkeypatch.setattr(os.path, "isfile",
-            lambda name: True)
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
         s = datetime.datetime(2015, 11, 1, 14)
         e = datetime.datetime(2015, 11, 4, 2)
         arl_finder = arlfinder.ArlFinder(self.root_dir,
@@ -923,8 +1341,8 @@ class TestARLFinderFind(object):
         assert actual == expected
 
     def test_with_accepted_forecasts_w_match_20151103(self, monkeypatch):
-        monkeypatch.setattr(os.path, "isfile",
-            lambda name: True)
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
         s = datetime.datetime(2015, 11, 1, 14)
         e = datetime.datetime(2015, 11, 4, 2)
         arl_finder = arlfinder.ArlFinder(self.root_dir,
@@ -952,8 +1370,8 @@ class TestARLFinderFind(object):
         assert actual == expected
 
     def test_with_accepted_forecasts_no_match(self, monkeypatch):
-        monkeypatch.setattr(os.path, "isfile",
-            lambda name: True)
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
         s = datetime.datetime(2015, 11, 1, 14)
         e = datetime.datetime(2015, 11, 4, 2)
         arl_finder = arlfinder.ArlFinder(self.root_dir,
@@ -961,3 +1379,158 @@ class TestARLFinderFind(object):
         actual = arl_finder.find(s, e)
         expected = {'files': []}
         assert actual == expected
+
+
+class TestARLFinderMultipleRootDirs(object):
+
+    def _create_index_csv(self, root_dir, date_str, rows):
+        forecast_dir = os.path.join(root_dir, date_str)
+        os.makedirs(forecast_dir)
+        with open(os.path.join(forecast_dir, 'arl12hrindex.csv'), 'w') as f:
+            f.write('filename,start,end,interval\n')
+            for row in rows:
+                f.write(','.join(row) + ',12\n')
+
+    def setup_method(self):
+        self.ssd_dir = tempfile.mkdtemp()
+        self.nfs_dir = tempfile.mkdtemp()
+        rows = [
+            ('a.arl', '2015-11-03 00:00:00', '2015-11-03 11:00:00'),
+            ('b.arl', '2015-11-03 12:00:00', '2015-11-03 23:00:00')
+        ]
+        self._create_index_csv(self.ssd_dir, '2015110300', rows)
+        self._create_index_csv(self.nfs_dir, '2015110300', rows)
+        self._create_index_csv(self.nfs_dir, '2015110200', [
+            ('a.arl', '2015-11-02 00:00:00', '2015-11-02 23:00:00')
+        ])
+        self.start = datetime.datetime(2015, 11, 2, 0)
+        self.end = datetime.datetime(2015, 11, 3, 23)
+
+    def _expected(self, *dirs):
+        return {
+            'files': [
+                {
+                    'file': os.path.join(dirs[0], 'a.arl'),
+                    'first_hour': '2015-11-02T00:00:00',
+                    'last_hour': '2015-11-02T23:00:00'
+                },
+                {
+                    'file': os.path.join(dirs[1], 'a.arl'),
+                    'first_hour': '2015-11-03T00:00:00',
+                    'last_hour': '2015-11-03T11:00:00'
+                },
+                {
+                    'file': os.path.join(dirs[1], 'b.arl'),
+                    'first_hour': '2015-11-03T12:00:00',
+                    'last_hour': '2015-11-03T23:00:00'
+                }
+            ]
+        }
+
+    def test_prefers_preceding_root_dirs(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        nfs_20151102 = os.path.join(self.nfs_dir, '2015110200')
+        ssd_20151103 = os.path.join(self.ssd_dir, '2015110300')
+        nfs_20151103 = os.path.join(self.nfs_dir, '2015110300')
+
+        arl_finder = arlfinder.ArlFinder([self.ssd_dir, self.nfs_dir])
+        r = arl_finder.find(self.start, self.end, include_stats=True)
+        assert r['stats']['counts']['duplicate_arl_files_dropped'] == 2
+        r.pop('stats')
+        assert r == self._expected(nfs_20151102, ssd_20151103)
+
+        arl_finder = arlfinder.ArlFinder([self.nfs_dir, self.ssd_dir])
+        assert arl_finder.find(self.start, self.end) == self._expected(
+            nfs_20151102, nfs_20151103)
+
+    def test_prefers_recent_forecasts_across_root_dirs(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        # the ssd has only the latest forecast, and the nfs dir has both it
+        # and an older one, which also covers 2015-11-03
+        ssd_dir = tempfile.mkdtemp(prefix='b')
+        nfs_dir = tempfile.mkdtemp(prefix='z')
+        self._create_index_csv(ssd_dir, '2015110300', [
+            ('c.arl', '2015-11-03 00:00:00', '2015-11-03 11:00:00')])
+        self._create_index_csv(nfs_dir, '2015110300', [
+            ('c.arl', '2015-11-03 00:00:00', '2015-11-03 11:00:00')])
+        self._create_index_csv(nfs_dir, '2015110200', [
+            ('d.arl', '2015-11-03 00:00:00', '2015-11-03 11:00:00')])
+        start = datetime.datetime(2015, 11, 3, 0)
+        end = datetime.datetime(2015, 11, 3, 11)
+
+        expected = {'files': [{
+            'file': os.path.join(ssd_dir, '2015110300', 'c.arl'),
+            'first_hour': '2015-11-03T00:00:00',
+            'last_hour': '2015-11-03T11:00:00'
+        }]}
+        assert arlfinder.ArlFinder([ssd_dir, nfs_dir]).find(
+            start, end) == expected
+        assert arlfinder.ArlFinder(nfs_dir).find(start, end)['files'][0][
+            'file'] == os.path.join(nfs_dir, '2015110300', 'c.arl')
+
+    def test_root_timeout(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        arl_finder = arlfinder.ArlFinder([self.ssd_dir, self.nfs_dir],
+            root_timeout=0.1)
+        nfs_finder = arl_finder._root_finders[1]
+        load_index_files = nfs_finder._load_index_files
+        def _load_index_files(date_matcher, stats, *args):
+            time.sleep(1)
+            return load_index_files(date_matcher, stats, *args)
+        monkeypatch.setattr(nfs_finder, '_load_index_files', _load_index_files)
+
+        t = time.time()
+        r = arl_finder.find(self.start, self.end, include_stats=True)
+        assert time.time() - t < 0.9
+        assert r['stats']['counts']['roots_timed_out'] == 1
+        assert [f['file'] for f in r['files']] == [
+            os.path.join(self.ssd_dir, '2015110300', 'a.arl'),
+            os.path.join(self.ssd_dir, '2015110300', 'b.arl')
+        ]
+
+    def test_timed_out_root_still_running(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        arl_finder = arlfinder.ArlFinder([self.ssd_dir, self.nfs_dir],
+            root_timeout=0.1)
+        nfs_finder = arl_finder._root_finders[1]
+        load_index_files = nfs_finder._load_index_files
+        hung = threading.Event()
+        searches = []
+        def _load_index_files(date_matcher, stats, *args):
+            searches.append(stats)
+            hung.wait(5)
+            return load_index_files(date_matcher, stats, *args)
+        monkeypatch.setattr(nfs_finder, '_load_index_files', _load_index_files)
+
+        stats = findstats.FindStats()
+        arl_finder.find_many([(self.start, self.end)], stats=stats)
+        assert stats.counts['roots_timed_out'] == 1
+        counts = dict(stats.counts)
+
+        # the nfs root isn't searched again while its search is running
+        r = arl_finder.find(self.start, self.end, include_stats=True)
+        assert r['stats']['counts']['roots_skipped'] == 1
+        assert 'roots_timed_out' not in r['stats']['counts']
+        assert len(r['files']) == 2
+        assert len(searches) == 1
+
+        # the hung search records its stats separately
+        hung.set()
+        arl_finder._root_searches[1].join(5)
+        assert searches[0] is not stats
+        assert searches[0].counts['index_files_found'] == 2
+        assert dict(stats.counts) == counts
+
+        r = arl_finder.find(self.start, self.end, include_stats=True)
+        assert len(searches) == 2
+        assert 'roots_skipped' not in r['stats']['counts']
+
+    def test_invalid_root_dir(self):
+        with raises(ValueError):
+            arlfinder.ArlFinder([self.ssd_dir, os.path.join(self.nfs_dir, 'foo')])
+        with raises(ValueError):
+            arlfinder.ArlFinder([])
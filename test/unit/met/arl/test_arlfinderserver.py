@@ -0,0 +1,196 @@
+"""Unit tests for met.arl.arlfinderserver"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import datetime
+import os
+import tempfile
+import threading
+import time
+
+from pytest import raises
+
+from met.arl import arlfinder, arlfinderserver, listingcache
+
+INDEX_CONTENTS = {
+    '2015110200': """filename,start,end,interval
+/storage/2015110200/a.arl,2015-11-02 00:00:00,2015-11-02 11:00:00,12
+/storage/2015110200/b.arl,2015-11-02 12:00:00,2015-11-02 23:00:00,12
+/storage/2015110200/c.arl,2015-11-03 00:00:00,2015-11-03 11:00:00,12
+""",
+    '2015110300': """filename,start,end,interval
+/storage/2015110300/a.arl,2015-11-03 00:00:00,2015-11-03 11:00:00,12
+/storage/2015110300/b.arl,2015-11-03 12:00:00,2015-11-03 23:00:00,12
+""",
+    '20151104': """filename,start,end,interval
+/storage/20151104/a.arl,2015-11-04 00:00:00,2015-11-04 11:00:00,12
+"""
+}
+
+WINDOWS = [
+    (datetime.datetime(2015, 11, 1, 14), datetime.datetime(2015, 11, 4, 2)),
+    (datetime.datetime(2015, 11, 2, 20), datetime.datetime(2015, 11, 3, 2)),
+    (datetime.datetime(2015, 1, 1, 14), datetime.datetime(2015, 1, 4, 2))
+]
+
+def _create_index_csv(root_dir, date_str):
+    forecast_dir = os.path.join(root_dir, date_str)
+    os.makedirs(forecast_dir)
+    with open(os.path.join(forecast_dir, 'arl12hrindex.csv'), 'w') as f:
+        f.write(INDEX_CONTENTS[date_str])
+
+
+class BaseServerTest(object):
+
+    def setup_method(self):
+        self.root_dir = tempfile.mkdtemp()
+        _create_index_csv(self.root_dir, '2015110200')
+        _create_index_csv(self.root_dir, '20151104')
+
+
+class TestInMemoryArlFinder(BaseServerTest):
+
+    def test_find(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        finder = arlfinder.ArlFinder(self.root_dir)
+        in_memory_finder = arlfinderserver.InMemoryArlFinder(self.root_dir)
+        assert in_memory_finder.num_index_files == 2
+
+        expected = [finder.find(s, e) for s, e in WINDOWS]
+        assert expected[0]['files']
+        assert in_memory_finder.find_many(WINDOWS) == expected
+
+        # new index files aren't seen until refresh
+        _create_index_csv(self.root_dir, '2015110300')
+        assert in_memory_finder.find_many(WINDOWS) == expected
+        in_memory_finder.refresh()
+        assert in_memory_finder.num_index_files == 3
+        expected = [finder.find(s, e) for s, e in WINDOWS]
+        assert in_memory_finder.find_many(WINDOWS) == expected
+
+    def test_refresh_only_reparses_changed_index_files(self, monkeypatch):
+        in_memory_finder = arlfinderserver.InMemoryArlFinder(self.root_dir)
+        parsed = []
+        parse_index_file = in_memory_finder._parse_index_file
+        def _parse_index_file(index_file, **kwargs):
+            parsed.append(os.path.relpath(index_file, self.root_dir))
+            return parse_index_file(index_file, **kwargs)
+        monkeypatch.setattr(in_memory_finder, '_parse_index_file',
+            _parse_index_file)
+
+        in_memory_finder.refresh()
+        assert parsed == []
+
+        _create_index_csv(self.root_dir, '2015110300')
+        in_memory_finder.refresh()
+        assert parsed == ['2015110300/arl12hrindex.csv']
+
+
+class TestArlFinderServer(BaseServerTest):
+
+    def test_find(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        other_root_dir = tempfile.mkdtemp()
+        _create_index_csv(other_root_dir, '2015110300')
+
+        server = arlfinderserver.ArlFinderServer([self.root_dir],
+            allow_other_roots=True)
+        assert (server.find(None, *WINDOWS[0])
+            == arlfinder.ArlFinder(self.root_dir).find(*WINDOWS[0]))
+        assert (server.find(other_root_dir, *WINDOWS[0])
+            == arlfinder.ArlFinder(other_root_dir).find(*WINDOWS[0]))
+        assert set(server.status()['roots']) == set([
+            os.path.normpath(self.root_dir), os.path.normpath(other_root_dir)])
+
+        with raises(ValueError) as e_info:
+            arlfinderserver.ArlFinderServer([]).find(None, *WINDOWS[0])
+        assert e_info.value.args[0] == arlfinderserver.ArlFinderServer.ROOT_DIR_REQUIRED
+
+    def test_other_roots_rejected(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        other_root_dir = tempfile.mkdtemp()
+        _create_index_csv(other_root_dir, '2015110300')
+
+        server = arlfinderserver.ArlFinderServer([self.root_dir])
+        assert server.find(self.root_dir + '/', *WINDOWS[0])['files']
+        with raises(ValueError) as e_info:
+            server.find(other_root_dir, *WINDOWS[0])
+        assert e_info.value.args[0] == (arlfinderserver.ArlFinderServer
+            .ROOT_DIR_NOT_SERVED.format(os.path.normpath(other_root_dir)))
+        with raises(ValueError):
+            server.find_many('/', WINDOWS)
+        assert list(server.status()['roots']) == [
+            os.path.normpath(self.root_dir)]
+
+    def test_loads_root_without_blocking_others(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        other_root_dir = os.path.normpath(tempfile.mkdtemp())
+        _create_index_csv(other_root_dir, '2015110300')
+        server = arlfinderserver.ArlFinderServer([self.root_dir],
+            allow_other_roots=True)
+
+        loading = threading.Event()
+        loaded = threading.Event()
+        refresh = arlfinderserver.InMemoryArlFinder.refresh
+        def _refresh(finder):
+            if finder._met_root_dir == other_root_dir:
+                loading.set()
+                loaded.wait(5)
+            refresh(finder)
+        monkeypatch.setattr(arlfinderserver.InMemoryArlFinder, 'refresh',
+            _refresh)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            server.find(other_root_dir, *WINDOWS[0]))) for i in range(2)]
+        for t in threads:
+            t.start()
+        assert loading.wait(5)
+        # requests for the loaded root dir don't wait
+        assert server.find(None, *WINDOWS[0])['files']
+        assert list(server.status()['roots']) == [
+            os.path.normpath(self.root_dir)]
+        server.refresh()
+        assert results == []
+
+        loaded.set()
+        for t in threads:
+            t.join(5)
+        expected = arlfinder.ArlFinder(other_root_dir).find(*WINDOWS[0])
+        assert results == [expected, expected]
+        assert len(server.status()['roots']) == 2
+
+    def test_serve_on_unix_socket(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        socket_pathname = os.path.join(tempfile.mkdtemp(), 'arlfinder.sock')
+        server = arlfinderserver.ArlFinderServer([self.root_dir])
+        threading.Thread(target=server.serve,
+            kwargs={'socket_pathname': socket_pathname}, daemon=True).start()
+        for i in range(100):
+            if os.path.exists(socket_pathname):
+                break
+            time.sleep(0.01)
+
+        client = arlfinderserver.ArlFinderClient('unix://' + socket_pathname)
+        finder = arlfinder.ArlFinder(self.root_dir)
+        assert client.find(*WINDOWS[0]) == finder.find(*WINDOWS[0])
+        assert client.find_many(WINDOWS) == finder.find_many(WINDOWS)
+        assert client.status()['roots'][os.path.normpath(self.root_dir)][
+            'index_files'] == 2
+
+        with raises(ValueError) as e_info:
+            client._request('POST', '/find', {'start': '2015-11-01T00:00:00'})
+        assert e_info.value.args[0] == arlfinder.ArlFinder.START_AND_END_REQUIRED
+
+
+class TestArlFinderClient(object):
+
+    def test_invalid_url(self):
+        with raises(ValueError):
+            arlfinderserver.ArlFinderClient('ftp://localhost:2000')
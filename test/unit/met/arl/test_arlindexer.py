@@ -3,14 +3,21 @@
 __author__ = "Joel Dubowy"
 __copyright__ = "Copyright 2016, AirFire, PNW, USFS"
 
+import copy
 import datetime
+import hashlib
+import json
+import os
+import shutil
 import time
 import tempfile
 
+import pymongo
+import pytest
 import timecop
 from pytest import raises
 
-from met.arl import arlindexer
+from met.arl import arlindexer, coverage, listingcache
 
 class TestARLIndexer(object):
 
@@ -52,21 +59,19 @@ class TestARLIndexer(object):
                 'last_hour': datetime.datetime(2015,1,2,6,0,0)
             }
         ]
+        hour_coverage = coverage.HourCoverage.from_hours(files_per_hour)
         n = datetime.datetime.utcnow()
-        assert files_per_hour, files == self.arl_indexer._filter(
-            files_per_hour, files, None, None)
-        assert files_per_hour, files == self.arl_indexer._filter(
-            files_per_hour, files, n, None)
-        assert files_per_hour, files == self.arl_indexer._filter(
-            files_per_hour, files, None, n)
+        for s, e in ((None, None), (n, None), (None, n)):
+            c, f = self.arl_indexer._filter(hour_coverage, files, s, e)
+            assert (c, f) == (hour_coverage, files)
 
         s = datetime.datetime(2015,1,2,1,0,0)
         e = datetime.datetime(2015,1,2,3,0,0)
-        expected_fph = {
-            datetime.datetime(2015,1,2,1,0,0): 'b',
-            datetime.datetime(2015,1,2,2,0,0): 'b',
-            datetime.datetime(2015,1,2,3,0,0): 'c'
-        }
+        expected_hours = [
+            datetime.datetime(2015,1,2,1,0,0),
+            datetime.datetime(2015,1,2,2,0,0),
+            datetime.datetime(2015,1,2,3,0,0)
+        ]
         expected_f = [
             {
                 'file': 'b',
@@ -79,8 +84,10 @@ class TestARLIndexer(object):
                 'last_hour': datetime.datetime(2015,1,2,3,0,0)
             }
         ]
-        assert expected_fph, expected_f == self.arl_indexer._filter_files(
-            files, files_per_hour, s, e)
+        c, f = self.arl_indexer._filter(hour_coverage, files, s, e)
+        assert f == expected_f
+        assert (c.start, c.end, c.num_hours) == (s, e, 3)
+        assert c.time_windows() == [{'first_hour': s, 'last_hour': e}]
 
     def test_filter_files(self):
         files = [
@@ -253,13 +260,174 @@ class TestARLIndexer(object):
         }
 
         assert expected == self.arl_indexer._analyse(index_files,
-            files_per_hour, files)
+            coverage.HourCoverage.from_hours(files_per_hour), files)
 
     # TODO: test _write
     # TODO: test _write_to_mongodb_url
     # TODO: test _write_to_output_file
 
 
+def _create_forecast(root_dir, forecast, mtime=None):
+    """Creates forecast dir with an index of four 12 hour arl files"""
+    date_str = forecast.strftime('%Y%m%d%H')
+    forecast_dir = os.path.join(root_dir, date_str)
+    os.makedirs(forecast_dir)
+    with open(os.path.join(forecast_dir, 'arl12hrindex.csv'), 'w') as f:
+        f.write("filename,start,end,interval\n")
+        for i in range(4):
+            first_hour = forecast + datetime.timedelta(hours=12*i)
+            f.write("{}/{}.{}.arl,{},{},12\n".format(forecast_dir, date_str, i,
+                first_hour.strftime('%Y-%m-%d %H:%M:%S'),
+                (first_hour + datetime.timedelta(hours=11)).strftime(
+                    '%Y-%m-%d %H:%M:%S')))
+    if mtime:
+        os.utime(forecast_dir, (mtime, mtime))
+
+class TestIncrementalIndexing(object):
+
+    def setup_method(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.state_file = os.path.join(tempfile.mkdtemp(), 'state.json')
+        self.output_file = os.path.join(tempfile.mkdtemp(), 'index.json')
+        long_ago = time.time() - 86400
+        for h in (0, 12, 24):
+            _create_forecast(self.root_dir,
+                datetime.datetime(2015,11,1) + datetime.timedelta(hours=h),
+                mtime=long_ago)
+
+    def _index(self, **config):
+        config = dict(dict(server_name="Foo Test Server",
+            output_file=self.output_file), **config)
+        arlindexer.ArlIndexer('DRI2km', self.root_dir, **config).index()
+        with open(self.output_file) as f:
+            data = json.load(f)
+        assert data.pop('indexed_at')
+        return data
+
+    def _record_parsed(self, monkeypatch):
+        parsed = []
+        parse_index_file = arlindexer.ArlIndexer._parse_index_file
+        def _parse_index_file(indexer, index_file, **kwargs):
+            parsed.append(os.path.basename(os.path.dirname(index_file)))
+            return parse_index_file(indexer, index_file, **kwargs)
+        monkeypatch.setattr(arlindexer.ArlIndexer, '_parse_index_file',
+            _parse_index_file)
+        return parsed
+
+    def test_matches_full_index(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        self._index(state_file=self.state_file)
+        # make sure the next run is recognized as being after this one
+        with open(self.state_file) as f:
+            state = json.load(f)
+        state['indexed_at'] = datetime.datetime.utcfromtimestamp(
+            time.time() - 3600).replace(microsecond=0).isoformat()
+        with open(self.state_file, 'w') as f:
+            json.dump(state, f)
+
+        _create_forecast(self.root_dir, datetime.datetime(2015,11,2,12))
+        parsed = self._record_parsed(monkeypatch)
+        incremental = self._index(state_file=self.state_file, incremental=True)
+        # the previous latest and new forecasts are parsed to find changes,
+        # and then the forecasts from max_days_out days before the changed
+        # hours on are parsed to reassign them
+        assert parsed == ['2015110200', '2015110212',
+            '2015110100', '2015110112', '2015110200', '2015110212']
+
+        full = self._index()
+        assert incremental == full
+        assert full['latest_forecast'] == '2015-11-02T12:00:00'
+        assert full['files'][-1] == {
+            'file': os.path.join(self.root_dir, '2015110212',
+                '2015110212.3.arl'),
+            'first_hour': '2015-11-04T00:00:00',
+            'last_hour': '2015-11-04T11:00:00'
+        }
+
+    def test_removed_forecast(self):
+        for d, dirs, files in os.walk(self.root_dir):
+            for f in files:
+                with open(os.path.join(d, f)) as index_file:
+                    arl_files = [l.split(',')[0] for l in index_file][1:]
+                for arl_file in arl_files:
+                    open(arl_file, 'w').close()
+        self._index(state_file=self.state_file)
+
+        shutil.rmtree(os.path.join(self.root_dir, '2015110100'))
+        incremental = self._index(state_file=self.state_file, incremental=True)
+        assert not any('2015110100' in f['file'] for f in incremental['files'])
+        assert incremental == self._index()
+
+    def test_falls_back_to_full_index(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        parsed = self._record_parsed(monkeypatch)
+        # no previous index data
+        self._index(state_file=self.state_file, incremental=True)
+        assert len(parsed) == 3
+
+        del parsed[:]
+        self._index(state_file=self.state_file, incremental=True,
+            fewer_arl_files=True)
+        assert len(parsed) == 3
+
+
+class TestPartitionedIndexing(object):
+
+    def setup_method(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.output_file = os.path.join(tempfile.mkdtemp(), 'index.json')
+        for h in range(0, 24 * 6, 12):
+            _create_forecast(self.root_dir,
+                datetime.datetime(2015,11,1) + datetime.timedelta(hours=h))
+        for d, dirs, files in os.walk(self.root_dir):
+            for f in files:
+                with open(os.path.join(d, f)) as index_file:
+                    arl_files = [l.split(',')[0] for l in index_file][1:]
+                for arl_file in arl_files:
+                    open(arl_file, 'w').close()
+
+    def _index(self, start=None, end=None, **config):
+        config = dict(dict(server_name="Foo Test Server",
+            output_file=self.output_file), **config)
+        arlindexer.ArlIndexer('DRI2km', self.root_dir, **config).index(
+            start, end)
+        with open(self.output_file) as f:
+            data = json.load(f)
+        assert data.pop('indexed_at')
+        return data
+
+    def test_partition(self):
+        indexer = arlindexer.ArlIndexer('DRI2km', self.root_dir, jobs=2)
+        partitions = indexer._partition(arlindexer.DateMatcher())
+        assert len(partitions) == 6
+        assert [p[0] for p in partitions] == ['20151101', '20151102',
+            '20151103', '20151104', '20151105', '20151106']
+
+        partitions = indexer._partition(arlindexer.DateMatcher(
+            ['201511{:02d}'.format(d) for d in range(1, 21)]))
+        assert len(partitions) == 8
+        assert [len(p) for p in partitions] == [3, 3, 3, 3, 2, 2, 2, 2]
+
+        # undated dirs may contain forecasts of any date
+        os.makedirs(os.path.join(self.root_dir, 'archive'))
+        assert indexer._partition(arlindexer.DateMatcher()) is None
+        indexer = arlindexer.ArlIndexer('DRI2km', self.root_dir, jobs=2,
+            ignore_pattern='/archive')
+        assert len(indexer._partition(arlindexer.DateMatcher())) == 6
+
+    def test_matches_serial_index(self):
+        serial = self._index()
+        assert serial['files']
+        assert self._index(jobs=2) == serial
+
+        start = datetime.datetime(2015,11,3,6)
+        end = datetime.datetime(2015,11,4,18)
+        serial = self._index(start, end)
+        assert self._index(start, end, jobs=3) == serial
+
+
 class TestArlIndexDB(object):
 
     def test_parse_mongodb_url(self):
@@ -335,3 +503,489 @@ class TestArlIndexDB(object):
         assert e == call("mongodb://u:p@hostname:34343/sdf?foo=bar")
         e = ("mongodb://u:p@hostname:34343/sdf/?foo=bar", "sdf")
         assert e == call("mongodb://u:p@hostname:34343/sdf/?foo=bar")
+
+    def test_shared_client(self, monkeypatch):
+        monkeypatch.setattr(arlindexer.ArlIndexDB, '_clients', {})
+        created = []
+        monkeypatch.setattr(arlindexer.ArlIndexDB, 'create_client',
+            classmethod(lambda cls, mongodb_url=None, **config:
+                created.append(mongodb_url) or object()))
+
+        call = arlindexer.ArlIndexDB.shared_client
+        client = call("mongodb://hostname/sdf")
+        assert client is call("mongodb://hostname/sdf")
+        assert client is not call("mongodb://hostname/foo")
+        assert client is not call("mongodb://hostname/sdf",
+            mongo_ssl_ca_certs="/etc/ca.pem")
+        assert created == ["mongodb://hostname/sdf", "mongodb://hostname/foo",
+            "mongodb://hostname/sdf"]
+
+
+class FakeCollection(object):
+
+    def __init__(self, full_name):
+        self.full_name = full_name
+        self.indices = []
+        self.requests = []
+        self.docs = []
+        self.queries = []
+        self.pipelines = []
+        self.aggregation_results = None
+
+    def create_index(self, field, **kwargs):
+        self.indices.append(field)
+        if kwargs:
+            self.index_options = kwargs
+
+    def bulk_write(self, requests, ordered=True):
+        self.requests.extend(requests)
+
+    @classmethod
+    def _matches(cls, d, query):
+        for k, v in query.items():
+            if k == '$or':
+                if not any(cls._matches(d, q) for q in v):
+                    return False
+            elif isinstance(v, dict) and '$nin' in v:
+                if d.get(k) in v['$nin']:
+                    return False
+            elif isinstance(v, dict) and '$lt' in v:
+                if k not in d or not d[k] < v['$lt']:
+                    return False
+            elif isinstance(v, dict) and '$exists' in v:
+                if (k in d) != v['$exists']:
+                    return False
+            elif d.get(k) != v:
+                return False
+        return True
+
+    def update_one(self, query, update, upsert=False):
+        self.requests.append(update)
+        for d in self.docs:
+            if self._matches(d, query):
+                d.update(update['$set'])
+                return
+        if upsert:
+            self.docs.append(dict(query, **update['$set']))
+
+    def distinct(self, field, query):
+        return list(set(d[field] for d in self.docs
+            if self._matches(d, query)))
+
+    def delete_many(self, query):
+        self.deleted = [d for d in self.docs if self._matches(d, query)]
+        self.docs = [d for d in self.docs if not self._matches(d, query)]
+
+    def find_one(self, query, projection=None):
+        r = self.find(query, projection)
+        return r[0] if r else None
+
+    def find(self, filter, projection=None):
+        query = filter
+        self.queries.append((query, projection))
+        return [dict((k, v) for k, v in d.items()
+                if not projection or k in projection)
+            for d in self.docs if self._matches(d, query)]
+
+    def aggregate(self, pipeline):
+        if self.aggregation_results is None:
+            raise NotImplementedError("aggregation isn't supported")
+        self.pipelines.append(pipeline)
+        return iter(self.aggregation_results)
+
+
+class FakeClient(dict):
+
+    def __missing__(self, db_name):
+        db = {'met_files': FakeCollection(db_name + '.met_files'),
+            'dates': FakeCollection(db_name + '.dates')}
+        self[db_name] = db
+        return db
+
+
+class TestMetDatesCollection(object):
+
+    def setup_method(self):
+        self.client = FakeClient()
+        self.config = {'mongodb_url': "mongodb://hostname/arlindex",
+            'mongo_client': self.client}
+
+    def test_indices_created_once(self, monkeypatch):
+        monkeypatch.setattr(arlindexer.ArlIndexDB, '_indices_created', set())
+        arlindexer.MetDatesCollection(**self.config)
+        arlindexer.MetDatesCollection(**self.config)
+        arlindexer.MetFilesCollection(**self.config)
+        availability_index = [('availability.first_hour', 1),
+            ('availability.last_hour', 1)]
+        assert self.client['arlindex']['dates'].indices == ['domain', 'server',
+            availability_index]
+        assert self.client['arlindex']['met_files'].indices == ['domain',
+            'server', availability_index]
+
+    def test_compute_and_save(self, monkeypatch):
+        to_save = [{'domain': 'DRI2km', 'complete_dates': []},
+            {'domain': 'DRI6km', 'complete_dates': []}]
+        monkeypatch.setattr(arlindexer.MetDatesCollection, 'compute',
+            lambda self, domain=None: to_save)
+        dates_collection = arlindexer.MetDatesCollection(**self.config)
+        assert dates_collection.compute_and_save() == to_save
+        requests = self.client['arlindex']['dates'].requests
+        assert [r._filter for r in requests] == [{'domain': 'DRI2km'},
+            {'domain': 'DRI6km'}]
+        assert all(r._upsert for r in requests)
+
+    def test_compute_and_save_removes_stale_dates(self, monkeypatch):
+        monkeypatch.setattr(arlindexer.MetDatesCollection, 'compute',
+            lambda self, domain=None: [])
+        dates = self.client['arlindex']['dates']
+        dates.docs = [{'domain': 'DRI2km'}, {'domain': 'DRI6km'}]
+        dates_collection = arlindexer.MetDatesCollection(**self.config)
+        dates_collection.compute_and_save(domain='DRI6km')
+        assert dates.docs == [{'domain': 'DRI2km'}]
+        dates_collection.compute_and_save()
+        assert dates.docs == []
+
+    MET_FILES = [
+        {'server': 'a', 'domain': 'DRI2km', 'files': [{}],
+            'complete_dates': ['2015-11-02'],
+            'partial_dates': ['2015-11-01', '2015-11-03'],
+            'start': '2015-11-01T12:00:00', 'end': '2015-11-03T11:00:00',
+            'latest_forecast': '2015-11-02T00:00:00'},
+        {'server': 'b', 'domain': 'DRI2km', 'files': [{}],
+            'complete_dates': ['2015-11-01', '2015-11-02'],
+            'partial_dates': ['2015-11-04'],
+            'start': '2015-11-01T00:00:00', 'end': '2015-11-04T05:00:00',
+            'latest_forecast': '2015-11-03T00:00:00'},
+        {'server': 'a', 'domain': 'DRI6km', 'files': [],
+            'complete_dates': [], 'partial_dates': [],
+            'start': None, 'end': None, 'latest_forecast': None}
+    ]
+
+    EXPECTED_DRI2KM = {
+        'domain': 'DRI2km',
+        'complete_dates': ['2015-11-01', '2015-11-02'],
+        'partial_dates': ['2015-11-03', '2015-11-04'],
+        'start': '2015-11-01T00:00:00',
+        'end': '2015-11-04T05:00:00',
+        'latest_forecast': '2015-11-03T00:00:00'
+    }
+
+    EXPECTED_DRI6KM = {
+        'domain': 'DRI6km',
+        'complete_dates': [],
+        'partial_dates': [],
+        'start': None,
+        'end': None,
+        'latest_forecast': None
+    }
+
+    def test_compute_without_aggregation(self):
+        met_files = self.client['arlindex']['met_files']
+        met_files.docs = self.MET_FILES
+        dates_collection = arlindexer.MetDatesCollection(**self.config)
+        assert dates_collection.compute() == [self.EXPECTED_DRI2KM,
+            self.EXPECTED_DRI6KM]
+        assert dates_collection.compute('DRI6km') == [self.EXPECTED_DRI6KM]
+
+    def test_compute_with_aggregation(self):
+        met_files = self.client['arlindex']['met_files']
+        # results of $group, with arrays unioned
+        met_files.aggregation_results = [
+            {'_id': 'DRI6km', 'complete_dates': [], 'partial_dates': [],
+                'start': None, 'end': None, 'latest_forecast': None},
+            {'_id': 'DRI2km',
+                'complete_dates': ['2015-11-02', '2015-11-01'],
+                'partial_dates': ['2015-11-04', '2015-11-01', '2015-11-03'],
+                'start': '2015-11-01T00:00:00', 'end': '2015-11-04T05:00:00',
+                'latest_forecast': '2015-11-03T00:00:00'}
+        ]
+        dates_collection = arlindexer.MetDatesCollection(**self.config)
+        assert dates_collection.compute() == [self.EXPECTED_DRI2KM,
+            self.EXPECTED_DRI6KM]
+        assert '$match' not in met_files.pipelines[0][0]
+        # 'files' isn't projected
+        assert 'files' not in met_files.pipelines[0][0]['$project']
+
+        dates_collection.compute('DRI2km')
+        assert met_files.pipelines[1][0] == {'$match': {'domain': 'DRI2km'}}
+
+    def test_compute_and_save_for_domain(self):
+        met_files = self.client['arlindex']['met_files']
+        met_files.docs = self.MET_FILES
+        dates_collection = arlindexer.MetDatesCollection(**self.config)
+        assert dates_collection.compute_and_save('DRI2km') == [
+            self.EXPECTED_DRI2KM]
+        requests = self.client['arlindex']['dates'].requests
+        assert [r._filter for r in requests] == [{'domain': 'DRI2km'}]
+
+
+def _evaluate(expr, doc, variables):
+    """Evaluates the aggregation expressions used by
+    MetDatesCollection._aggregation_pipeline, as mongodb would
+    """
+    if isinstance(expr, str) and expr.startswith('$$'):
+        return variables[expr[2:]]
+    if isinstance(expr, str) and expr.startswith('$'):
+        return doc.get(expr[1:])
+    if not isinstance(expr, dict):
+        return expr
+
+    op, args = next(iter(expr.items()))
+    if op == '$reduce':
+        values = _evaluate(args['input'], doc, variables)
+        if values is None:
+            return None
+        value = _evaluate(args['initialValue'], doc, variables)
+        for this in values:
+            value = _evaluate(args['in'], doc,
+                dict(variables, value=value, this=this))
+        return value
+    if op == '$setUnion':
+        arrays = [_evaluate(a, doc, variables) for a in args]
+        if any(a is None for a in arrays):
+            return None
+        union = []
+        for v in (v for a in arrays for v in a):
+            if v not in union:
+                union.append(v)
+        return union
+    if op == '$ifNull':
+        value = _evaluate(args[0], doc, variables)
+        return _evaluate(args[1], doc, variables) if value is None else value
+    raise NotImplementedError(op)
+
+def _run_pipeline(docs, pipeline):
+    """Runs the $match, $project, and $group stages used by
+    MetDatesCollection._aggregation_pipeline, as mongodb would
+    """
+    for stage in pipeline:
+        op, spec = next(iter(stage.items()))
+        if op == '$match':
+            docs = [d for d in docs
+                if all(d.get(k) == v for k, v in spec.items())]
+        elif op == '$project':
+            projected = []
+            for d in docs:
+                p = {'_id': d['_id']} if '_id' in d else {}
+                for k, v in spec.items():
+                    if v == 1:
+                        if k in d:
+                            p[k] = d[k]
+                    else:
+                        p[k] = _evaluate(v, d, {})
+                projected.append(p)
+            docs = projected
+        elif op == '$group':
+            groups = {}
+            for d in docs:
+                key = _evaluate(spec['_id'], d, {})
+                g = groups.setdefault(key, {'_id': key})
+                for k, acc in spec.items():
+                    if k == '_id':
+                        continue
+                    acc_op, field = next(iter(acc.items()))
+                    present = field[1:] in d
+                    value = _evaluate(field, d, {})
+                    if acc_op == '$addToSet':
+                        g.setdefault(k, [])
+                        if present and value not in g[k]:
+                            g[k].append(value)
+                    else:
+                        # $min and $max ignore null and missing values
+                        g.setdefault(k, None)
+                        if value is not None:
+                            f = min if acc_op == '$min' else max
+                            g[k] = value if g[k] is None else f(g[k], value)
+            docs = list(groups.values())
+        else:
+            raise NotImplementedError(op)
+    return docs
+
+
+class TestMetDatesAggregationPipeline(object):
+    """Checks that the aggregation pipeline computes the same dates as
+    the python fallback, MetDatesCollection._aggregate
+    """
+
+    MET_FILES = TestMetDatesCollection.MET_FILES + [
+        # missing and null fields
+        {'server': 'b', 'domain': 'DRI6km', 'files': [],
+            'complete_dates': None, 'start': '2015-11-02T00:00:00',
+            'end': None, 'latest_forecast': '2015-11-02T00:00:00'},
+        {'server': 'c', 'domain': 'DRI6km',
+            'partial_dates': ['2015-11-02', '2015-11-05'],
+            'start': '2015-11-01T00:00:00', 'end': '2015-11-05T23:00:00'},
+        {'server': 'c', 'domain': 'NAM84', 'files': []}
+    ]
+
+    def _compute(self, dates_collection, domains):
+        return dict((d, dates_collection.compute(d)) for d in domains)
+
+    def _check(self, dates_collection, met_files_collection, monkeypatch):
+        domains = (None, 'DRI2km', 'DRI6km', 'NAM84', 'foo')
+        aggregated = self._compute(dates_collection, domains)
+        monkeypatch.setattr(arlindexer.MetDatesCollection,
+            '_aggregation_pipeline', lambda self, domain: self.met_files.bogus())
+        expected = self._compute(dates_collection, domains)
+        assert aggregated == expected
+        assert [d['domain'] for d in expected[None]] == [
+            'DRI2km', 'DRI6km', 'NAM84']
+
+    def test_pipeline(self, monkeypatch):
+        client = FakeClient()
+        met_files = client['arlindex']['met_files']
+        met_files.docs = copy.deepcopy(self.MET_FILES)
+        aggregated = []
+        def aggregate(pipeline):
+            aggregated.append(pipeline)
+            return iter(_run_pipeline(met_files.docs, pipeline))
+        met_files.aggregate = aggregate
+        dates_collection = arlindexer.MetDatesCollection(
+            mongodb_url="mongodb://hostname/arlindex", mongo_client=client)
+        self._check(dates_collection, met_files, monkeypatch)
+        assert len(aggregated) == 5
+
+    def test_mongodb(self, monkeypatch):
+        """Runs against ARLINDEX_TEST_MONGODB_URL, if set, or else a local
+        mongod, if running, and is skipped otherwise
+        """
+        url = os.environ.get('ARLINDEX_TEST_MONGODB_URL',
+            'mongodb://localhost:27017/arlindex_test')
+        client = pymongo.MongoClient(url, serverSelectionTimeoutMS=500)
+        try:
+            client.admin.command('ping')
+        except pymongo.errors.PyMongoError:
+            pytest.skip("mongodb isn't available at {}".format(url))
+        config = {'mongodb_url': url, 'mongo_client': client}
+        met_files = arlindexer.MetFilesCollection(**config)
+        met_files.clear()
+        try:
+            met_files.met_files.insert_many(copy.deepcopy(self.MET_FILES))
+            self._check(arlindexer.MetDatesCollection(**config), met_files,
+                monkeypatch)
+        finally:
+            met_files.clear()
+
+
+class TestSkippingUnchangedWrites(object):
+
+    def setup_method(self):
+        self.client = FakeClient()
+        self.met_files = self.client['arlindex']['met_files']
+        self.dates = self.client['arlindex']['dates']
+        self.config = {'mongodb_url': "mongodb://hostname/arlindex",
+            'mongo_client': self.client, 'server_name': "Foo Test Server"}
+        self.root_dir = tempfile.mkdtemp()
+
+    def test_fingerprint(self):
+        indexer = arlindexer.ArlIndexer('DRI2km', self.root_dir, **self.config)
+        data = {'domain': 'DRI2km', 'files': [], 'indexed_at': 'a'}
+        fingerprint = indexer._fingerprint(data)
+        assert fingerprint == indexer._fingerprint(dict(data,
+            indexed_at='b', fingerprint='c'))
+        assert fingerprint != indexer._fingerprint(dict(data, files=[{}]))
+        assert fingerprint == hashlib.sha256(json.dumps(
+            {'domain': 'DRI2km', 'files': []}, sort_keys=True,
+            separators=(',', ':')).encode()).hexdigest()
+
+    def test_fingerprint_only_written_to_mongodb(self):
+        output_file = os.path.join(tempfile.mkdtemp(), 'index.json')
+        arlindexer.ArlIndexer('DRI2km', self.root_dir,
+            output_file=output_file, **self.config).index()
+        assert len(self.met_files.docs[0]['fingerprint']) == 64
+        with open(output_file) as f:
+            assert 'fingerprint' not in json.load(f)
+
+    def test_index(self):
+        indexer = arlindexer.ArlIndexer('DRI2km', self.root_dir, **self.config)
+        indexer.index()
+        assert indexer._mongodb_updated
+        assert len(self.met_files.requests) == 1
+        assert len(self.dates.requests) == 1
+        assert len(self.met_files.docs[0]['fingerprint']) == 64
+
+        # unchanged; only the last indexed time is updated
+        indexer.index()
+        assert not indexer._mongodb_updated
+        assert len(self.met_files.requests) == 2
+        assert list(self.met_files.requests[1]['$set']) == ['last_indexed']
+        assert len(self.dates.requests) == 1
+
+        # forced
+        arlindexer.ArlIndexer('DRI2km', self.root_dir, force=True,
+            **self.config).index()
+        assert len(self.met_files.requests) == 3
+        assert len(self.dates.requests) == 2
+
+        # changed
+        arlindexer.ArlIndexer('DRI2km', self.root_dir,
+            **dict(self.config, server_name="Bar Test Server")).index()
+        assert len(self.met_files.requests) == 4
+        assert len(self.dates.requests) == 3
+
+
+class TestMetFilesCollection(object):
+
+    def setup_method(self):
+        self.client = FakeClient()
+        self.config = {'mongodb_url': "mongodb://hostname/arlindex",
+            'mongo_client': self.client}
+        self.collection = self.client['arlindex']['met_files']
+
+    def test_last_indexed(self):
+        met_files = arlindexer.MetFilesCollection(**self.config)
+        met_files.update({'server': 'a', 'domain': 'DRI2km'})
+        last_indexed = self.collection.docs[0]['last_indexed']
+        assert isinstance(last_indexed, datetime.datetime)
+        met_files.touch('a', 'DRI2km')
+        assert self.collection.docs[0]['last_indexed'] >= last_indexed
+        # unknown records aren't created
+        met_files.touch('b', 'DRI2km')
+        assert len(self.collection.docs) == 1
+        assert met_files.find()[0]['last_indexed'] == (self.collection.docs[0]
+            ['last_indexed'].replace(microsecond=0).isoformat())
+
+    def test_ttl_index(self, monkeypatch):
+        monkeypatch.setattr(arlindexer.ArlIndexDB, '_indices_created', set())
+        arlindexer.MetFilesCollection(ttl=86400, **self.config)
+        arlindexer.MetFilesCollection(ttl=86400, **self.config)
+        assert self.collection.indices.count('last_indexed') == 1
+        assert self.collection.index_options == {'expireAfterSeconds': 86400,
+            'name': arlindexer.MetFilesCollection.TTL_INDEX_NAME}
+
+    def test_clear(self):
+        met_files = arlindexer.MetFilesCollection(**self.config)
+        long_ago = datetime.datetime(2015,11,1)
+        self.collection.docs = [
+            {'server': 'a', 'domain': 'DRI2km', 'last_indexed': long_ago},
+            {'server': 'a', 'domain': 'DRI6km',
+                'last_indexed': datetime.datetime.utcnow()},
+            {'server': 'b', 'domain': 'DRI2km',
+                'indexed_at': '2015-11-01T00:00:00'},
+            {'server': 'b', 'domain': 'NAM84',
+                'indexed_at': '2099-01-01T00:00:00'}
+        ]
+        older_than = datetime.datetime(2016,1,1)
+        assert met_files.clear(older_than=older_than) == ['DRI2km']
+        assert [(d['server'], d['domain']) for d in self.collection.docs] == [
+            ('a', 'DRI6km'), ('b', 'NAM84')]
+        assert met_files.clear(server='b', domain='DRI6km') == []
+        assert met_files.clear(server='b') == ['NAM84']
+        assert met_files.clear() == ['DRI6km']
+        assert self.collection.docs == []
+
+    def test_covers(self):
+        client = self.client
+        met_files = arlindexer.MetFilesCollection(**self.config)
+        assert met_files.covers(datetime.datetime(2015,11,1,0),
+            datetime.datetime(2015,11,3,12,30), domain='DRI2km') == []
+        assert client['arlindex']['met_files'].queries == [(
+            {
+                'domain': 'DRI2km',
+                'availability': {'$elemMatch': {
+                    'first_hour': {'$lte': '2015-11-01T00:00:00'},
+                    'last_hour': {'$gte': '2015-11-03T12:00:00'}
+                }}
+            },
+            {'_id': 0, 'server': 1, 'domain': 1}
+        )]
@@ -0,0 +1,135 @@
+"""Unit tests for met.arl.coverage"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import datetime
+import random
+from collections import defaultdict
+
+from pytest import raises
+
+from met.arl import coverage
+
+ONE_HOUR = datetime.timedelta(hours=1)
+
+def _hours(time_windows):
+    hours = set()
+    for w in time_windows:
+        dt = w['first_hour']
+        while dt <= w['last_hour']:
+            hours.add(dt)
+            dt += ONE_HOUR
+    return hours
+
+
+class TestHourCoverage(object):
+
+    def test_empty(self):
+        c = coverage.HourCoverage.from_time_windows([])
+        assert (c.start, c.end, c.num_hours) == (None, None, 0)
+        assert c.dates() == ([], [])
+        assert c.time_windows() == []
+        assert c.clip(datetime.datetime(2015,1,1),
+            datetime.datetime(2015,1,2)).time_windows() == []
+
+    def test_from_time_windows(self):
+        c = coverage.HourCoverage.from_time_windows([
+            {
+                'first_hour': datetime.datetime(2015,1,1,23),
+                'last_hour': datetime.datetime(2015,1,2,2)
+            },
+            {
+                'first_hour': datetime.datetime(2015,1,2,3),
+                'last_hour': datetime.datetime(2015,1,2,23)
+            },
+            {
+                'first_hour': datetime.datetime(2015,1,4,6),
+                'last_hour': datetime.datetime(2015,1,4,6)
+            }
+        ])
+        assert c.start == datetime.datetime(2015,1,1,23)
+        assert c.end == datetime.datetime(2015,1,4,6)
+        assert c.num_hours == 26
+        assert c.dates() == ([datetime.date(2015,1,2)],
+            [datetime.date(2015,1,1), datetime.date(2015,1,4)])
+        assert c.time_windows() == [
+            {
+                'first_hour': datetime.datetime(2015,1,1,23),
+                'last_hour': datetime.datetime(2015,1,2,23)
+            },
+            {
+                'first_hour': datetime.datetime(2015,1,4,6),
+                'last_hour': datetime.datetime(2015,1,4,6)
+            }
+        ]
+
+    def test_clip(self):
+        c = coverage.HourCoverage.from_time_windows([{
+            'first_hour': datetime.datetime(2015,1,1,20),
+            'last_hour': datetime.datetime(2015,1,2,4)
+        }])
+        clipped = c.clip(datetime.datetime(2015,1,1,22,30),
+            datetime.datetime(2015,1,2,2))
+        assert clipped.time_windows() == [{
+            'first_hour': datetime.datetime(2015,1,1,23),
+            'last_hour': datetime.datetime(2015,1,2,2)
+        }]
+        assert c.num_hours == 9
+        assert c.clip(datetime.datetime(2014,1,1),
+            datetime.datetime(2016,1,1)).num_hours == 9
+        assert c.clip(datetime.datetime(2016,1,1),
+            datetime.datetime(2016,1,2)).num_hours == 0
+
+    def test_matches_per_hour_computation(self):
+        random.seed(1)
+        base = datetime.datetime(2015,1,1)
+        for i in range(50):
+            time_windows = []
+            for j in range(random.randint(1, 20)):
+                first_hour = base + random.randint(0, 24*20) * ONE_HOUR
+                time_windows.append({
+                    'first_hour': first_hour,
+                    'last_hour': first_hour + random.randint(0, 48) * ONE_HOUR
+                })
+            c = coverage.HourCoverage.from_time_windows(time_windows)
+
+            hours = sorted(_hours(time_windows))
+            dates = defaultdict(lambda: 0)
+            for h in hours:
+                dates[h.date()] += 1
+            assert c.dates() == (
+                sorted(d for d in dates if dates[d] == 24),
+                sorted(d for d in dates if dates[d] < 24))
+            assert (c.start, c.end, c.num_hours) == (hours[0], hours[-1],
+                len(hours))
+            assert _hours(c.time_windows()) == set(hours)
+            windows = c.time_windows()
+            assert all(b['first_hour'] - a['last_hour'] > ONE_HOUR
+                for a, b in zip(windows, windows[1:]))
+
+
+class TestCoveredHourRange(object):
+
+    def test_covered_hour_range(self):
+        assert coverage.covered_hour_range(datetime.datetime(2015,11,1,0,30),
+            datetime.datetime(2015,11,3,12,30)) == (
+            '2015-11-01T00:30:00', '2015-11-03T12:00:00')
+        # converted to naive UTC, without sub-second precision
+        pst = datetime.timezone(datetime.timedelta(hours=-8))
+        assert coverage.covered_hour_range(
+            datetime.datetime(2015,10,31,16,30,0,500000, tzinfo=pst),
+            datetime.datetime(2015,11,3,4,30, tzinfo=pst)) == (
+            '2015-11-01T00:30:00', '2015-11-03T12:00:00')
+        assert coverage.covered_hour_range(datetime.datetime(2015,11,1,0,0,0,1),
+            datetime.datetime(2015,11,3,12,0,0,1)) == (
+            '2015-11-01T00:00:00', '2015-11-03T12:00:00')
+
+        with raises(ValueError) as e_info:
+            coverage.covered_hour_range(None, datetime.datetime(2015,11,3))
+        assert e_info.value.args[0] == coverage.START_AND_END_REQUIRED
+
+        with raises(ValueError) as e_info:
+            coverage.covered_hour_range(datetime.datetime(2015,11,3),
+                datetime.datetime(2015,11,1))
+        assert e_info.value.args[0] == coverage.START_AFTER_END
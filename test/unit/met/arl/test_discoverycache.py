@@ -0,0 +1,121 @@
+"""Unit tests for met.arl.discoverycache"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import json
+import os
+import re
+import tempfile
+
+from met.arl import discoverycache
+
+INDEX_FILENAME_MATCHER = re.compile('arl12hrindex.csv')
+
+def _touch(pathname):
+    with open(pathname, 'w') as f:
+        f.write('')
+
+def _fail(*args):
+    raise AssertionError("Shouldn't be called")
+
+def _backdate(pathname, seconds=60):
+    st = os.stat(pathname)
+    os.utime(pathname, (st.st_atime - seconds, st.st_mtime - seconds))
+
+
+class TestListDir(object):
+
+    def test_list_dir(self):
+        root_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(root_dir, '2015110300'))
+        os.makedirs(os.path.join(root_dir, '2015110200'))
+        os.symlink(os.path.join(root_dir, '2015110200'),
+            os.path.join(root_dir, 'latest'))
+        _touch(os.path.join(root_dir, 'arl12hrindex.csv'))
+        _touch(os.path.join(root_dir, 'foo.arl'))
+
+        assert discoverycache.list_dir(root_dir, INDEX_FILENAME_MATCHER) == (
+            ['2015110200', '2015110300'], ['arl12hrindex.csv'])
+
+    def test_list_nonexistent_dir(self):
+        root_dir = os.path.join(tempfile.mkdtemp(), 'foo')
+        assert discoverycache.list_dir(root_dir, INDEX_FILENAME_MATCHER) == (
+            [], [])
+
+
+class TestIndexFileDiscoveryCache(object):
+
+    def setup_method(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.forecast_dir = os.path.join(self.root_dir, '2015110300')
+        os.makedirs(self.forecast_dir)
+        _touch(os.path.join(self.forecast_dir, 'arl12hrindex.csv'))
+        _backdate(self.forecast_dir)
+        _backdate(self.root_dir)
+        self.cache_file = os.path.join(tempfile.mkdtemp(), 'cache.json')
+
+    def _cache(self):
+        return discoverycache.IndexFileDiscoveryCache(self.cache_file,
+            INDEX_FILENAME_MATCHER)
+
+    def test_lists_and_saves(self):
+        cache = self._cache()
+        assert cache.list_dir(self.root_dir) == (['2015110300'], [])
+        assert cache.list_dir(self.forecast_dir) == ([], ['arl12hrindex.csv'])
+        assert (cache.hits, cache.misses) == (0, 2)
+        cache.save()
+
+        with open(self.cache_file) as f:
+            data = json.load(f)
+        assert data['version'] == cache.VERSION
+        assert set(data['patterns']['arl12hrindex.csv']) == set(
+            [self.root_dir, self.forecast_dir])
+
+    def test_reuses_unchanged_listings(self, monkeypatch):
+        cache = self._cache()
+        cache.list_dir(self.root_dir)
+        cache.list_dir(self.forecast_dir)
+        cache.save()
+
+        # a new cache object should use the saved listings without
+        # listing either directory
+        monkeypatch.setattr(discoverycache, 'list_dir', _fail)
+        cache = self._cache()
+        assert cache.list_dir(self.root_dir) == (['2015110300'], [])
+        assert cache.list_dir(self.forecast_dir) == ([], ['arl12hrindex.csv'])
+        assert (cache.hits, cache.misses) == (2, 0)
+
+    def test_relists_modified_dirs(self):
+        cache = self._cache()
+        cache.list_dir(self.root_dir)
+        cache.save()
+
+        new_forecast_dir = os.path.join(self.root_dir, '2015110400')
+        os.makedirs(new_forecast_dir)
+        _backdate(self.root_dir, 30)
+
+        cache = self._cache()
+        assert cache.list_dir(self.root_dir) == (
+            ['2015110300', '2015110400'], [])
+        assert (cache.hits, cache.misses) == (0, 1)
+
+    def test_doesnt_trust_recent_listings(self):
+        cache = self._cache()
+        new_forecast_dir = os.path.join(self.root_dir, '2015110400')
+        os.makedirs(new_forecast_dir)
+        cache.list_dir(self.root_dir)
+        cache.list_dir(self.root_dir)
+        assert (cache.hits, cache.misses) == (0, 2)
+
+    def test_ignores_other_patterns_and_invalid_files(self):
+        with open(self.cache_file, 'w') as f:
+            f.write('{sdf')
+        cache = self._cache()
+        assert cache.list_dir(self.forecast_dir) == ([], ['arl12hrindex.csv'])
+        cache.save()
+
+        cache = discoverycache.IndexFileDiscoveryCache(self.cache_file,
+            re.compile('.*_index.csv'))
+        assert cache.list_dir(self.forecast_dir) == ([], [])
+        assert (cache.hits, cache.misses) == (0, 1)
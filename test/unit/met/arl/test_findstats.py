@@ -0,0 +1,53 @@
+"""Unit tests for met.arl.findstats"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import threading
+
+from pytest import raises
+
+from met.arl import findstats
+
+
+class TestFindStats(object):
+
+    def test_counts(self):
+        stats = findstats.FindStats()
+        def incr():
+            for i in range(1000):
+                stats.incr('a')
+        threads = [threading.Thread(target=incr) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats.update({'a': 2, 'b': 3})
+        assert stats.to_dict()['counts'] == {'a': 4002, 'b': 3}
+
+    def test_timings(self):
+        stats = findstats.FindStats()
+        with stats.time('a'):
+            pass
+        with raises(RuntimeError):
+            with stats.time('a'):
+                raise RuntimeError("foo")
+        with stats.time('b'):
+            pass
+        timings = stats.to_dict()['timings']
+        assert list(timings) == ['a', 'b']
+        assert all(v >= 0 for v in timings.values())
+
+    def test_merge(self):
+        stats = findstats.FindStats()
+        stats.incr('a')
+        stats.timings['t'] = 1.0
+        other = findstats.FindStats()
+        other.update({'a': 2, 'b': 3})
+        other.timings['t'] = 0.5
+        other.timings['u'] = 0.25
+        stats.merge(other)
+        assert stats.to_dict() == {
+            'timings': {'t': 1.5, 'u': 0.25},
+            'counts': {'a': 3, 'b': 3}
+        }
@@ -0,0 +1,131 @@
+"""Unit tests for met.arl.indexio"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import io
+import json
+import os
+import tempfile
+
+from pytest import raises
+
+from met.arl import arlindexer, indexio
+
+INDEX_DATA = {
+    'server': 'Foo Test Server',
+    'domain': 'DRI2km',
+    'latest_forecast': '2015-11-02T00:00:00',
+    'start': '2015-11-01T00:00:00',
+    'end': '2015-11-03T23:00:00',
+    'complete_dates': ['2015-11-01', '2015-11-02', '2015-11-03'],
+    'partial_dates': [],
+    'root_dir': '/DRI_2km',
+    'files': [
+        {
+            'file': '/DRI_2km/2015110100/wrfout_d2.2015110100.f00-11_12hr01.arl',
+            'first_hour': '2015-11-01T00:00:00',
+            'last_hour': '2015-11-01T23:00:00'
+        },
+        {
+            'file': '/DRI_2km/2015110200/wrfout_d2.2015110200.f00-11_12hr01.arl',
+            'first_hour': '2015-11-02T00:00:00',
+            'last_hour': '2015-11-03T23:00:00'
+        }
+    ],
+    'availability': [
+        {
+            'first_hour': '2015-11-01T00:00:00',
+            'last_hour': '2015-11-03T23:00:00'
+        }
+    ],
+    'indexed_at': '2015-11-02T04:12:09'
+}
+
+class TestIndexIO(object):
+
+    def _write(self, output_format, index_data=INDEX_DATA):
+        f = io.BytesIO() if indexio.is_binary(output_format) else io.StringIO()
+        indexio.write_index_data(index_data, f, output_format)
+        f.seek(0)
+        return f
+
+    def test_invalid_format(self):
+        with raises(ValueError) as e_info:
+            indexio.write_index_data(INDEX_DATA, io.StringIO(), 'xml')
+        assert e_info.value.args[0] == indexio.INVALID_OUTPUT_FORMAT.format(
+            'xml', 'json, ndjson, binary')
+
+    def test_json(self):
+        f = self._write(None)
+        assert json.loads(f.getvalue()) == INDEX_DATA
+        assert indexio.read_index_data(f) == INDEX_DATA
+
+    def test_ndjson(self):
+        f = self._write('ndjson')
+        lines = f.getvalue().splitlines()
+        assert len(lines) == 4
+        assert json.loads(lines[1]) == dict(INDEX_DATA['files'][0],
+            type='file')
+        assert indexio.read_index_data(f, 'ndjson') == INDEX_DATA
+
+    def test_binary(self):
+        f = self._write('binary')
+        assert f.getvalue().startswith(b'ARLIDX')
+        assert ([t for t, r in indexio.iter_records(f, 'binary')]
+            == ['summary', 'file', 'file', 'availability'])
+        f.seek(0)
+        assert indexio.read_index_data(f, 'binary') == INDEX_DATA
+
+        # truncated
+        f = io.BytesIO(self._write('binary').getvalue()[:-3])
+        with raises(ValueError):
+            indexio.read_index_data(f, 'binary')
+
+    def test_binary_requires_whole_hours(self):
+        index_data = dict(INDEX_DATA, availability=[{
+            'first_hour': '2015-11-01T00:30:00',
+            'last_hour': '2015-11-03T23:00:00'}])
+        with raises(ValueError):
+            self._write('binary', index_data)
+
+    def test_empty(self):
+        index_data = dict(INDEX_DATA, files=[], availability=[])
+        for output_format in ('ndjson', 'binary'):
+            f = self._write(output_format, index_data)
+            assert indexio.read_index_data(f, output_format) == index_data
+
+
+class TestArlIndexerOutputFormats(object):
+
+    def test_output_file(self):
+        root_dir = tempfile.mkdtemp()
+        forecast_dir = os.path.join(root_dir, '2015110200')
+        os.makedirs(forecast_dir)
+        with open(os.path.join(forecast_dir, 'arl12hrindex.csv'), 'w') as f:
+            f.write("filename,start,end,interval\n"
+                "a.arl,2015-11-02 00:00:00,2015-11-02 11:00:00,12\n")
+        open(os.path.join(forecast_dir, 'a.arl'), 'w').close()
+
+        output_dir = tempfile.mkdtemp()
+        outputs = {}
+        for output_format in indexio.OUTPUT_FORMATS:
+            output_file = os.path.join(output_dir, output_format)
+            indexer = arlindexer.ArlIndexer('DRI2km', root_dir,
+                server_name="Foo Test Server", output_file=output_file,
+                output_format=output_format)
+            indexer.index()
+            with open(output_file, 'rb' if output_format == 'binary'
+                    else 'r') as f:
+                outputs[output_format] = indexio.read_index_data(f,
+                    output_format)
+            # output file is read back by incremental runs
+            indexer._last_index_data = None
+            assert indexer._read_previous_index_data() == outputs[output_format]
+            assert outputs[output_format].pop('indexed_at')
+        assert outputs['json']['files'][0]['file'] == os.path.join(
+            forecast_dir, 'a.arl')
+        assert outputs['json'] == outputs['ndjson'] == outputs['binary']
+
+        with raises(ValueError):
+            arlindexer.ArlIndexer('DRI2km', root_dir, output_format='xml')
@@ -0,0 +1,50 @@
+"""Unit tests for met.arl.listingcache"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import os
+import tempfile
+
+from met.arl import listingcache
+
+
+class TestDirectoryListingCache(object):
+
+    def setup_method(self):
+        self.dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.dir, 'sub'))
+        for f in ('a.arl', 'b.arl'):
+            with open(os.path.join(self.dir, f), 'w') as f:
+                f.write('')
+        os.symlink(os.path.join(self.dir, 'a.arl'),
+            os.path.join(self.dir, 'link.arl'))
+        os.symlink(os.path.join(self.dir, 'missing.arl'),
+            os.path.join(self.dir, 'broken.arl'))
+        self.cache = listingcache.DirectoryListingCache()
+
+    def test_isfile(self):
+        for f in ('a.arl', 'b.arl', 'link.arl', 'sub', 'broken.arl',
+                'c.arl', 'sub/a.arl', 'foo/a.arl'):
+            pathname = os.path.join(self.dir, f)
+            assert self.cache.isfile(pathname) == os.path.isfile(pathname), f
+
+    def test_lists_each_dir_once(self):
+        assert self.cache.isfile(os.path.join(self.dir, 'a.arl'))
+        assert self.cache.isfile(os.path.join(self.dir, 'b.arl'))
+        assert not self.cache.isfile(os.path.join(self.dir, 'c.arl'))
+        assert not self.cache.isfile(os.path.join(self.dir, 'foo', 'a.arl'))
+        assert not self.cache.isfile(os.path.join(self.dir, 'foo', 'b.arl'))
+        assert self.cache.stats() == {
+            'listings': 2,
+            'hits': 3,
+            'negative_lookups': 3
+        }
+
+    def test_listing_is_not_refreshed(self):
+        pathname = os.path.join(self.dir, 'c.arl')
+        assert not self.cache.isfile(pathname)
+        with open(pathname, 'w') as f:
+            f.write('')
+        assert not self.cache.isfile(pathname)
+        assert listingcache.DirectoryListingCache().isfile(pathname)
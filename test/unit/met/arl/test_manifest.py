@@ -0,0 +1,136 @@
+"""Unit tests for met.arl.manifest"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import datetime
+import json
+import os
+import tempfile
+
+from met.arl import arlfinder, arlindexer, listingcache, manifest
+
+INDEX_CONTENTS = {
+    '2015110200': """filename,start,end,interval
+a.arl,2015-11-02 00:00:00,2015-11-02 11:00:00,12
+b.arl,2015-11-02 12:00:00,2015-11-03 11:00:00,12
+""",
+    '2015110300': """filename,start,end,interval
+a.arl,2015-11-03 00:00:00,2015-11-03 11:00:00,12
+b.arl,2015-11-03 12:00:00,2015-11-04 11:00:00,12
+"""
+}
+
+def _fail(*args):
+    raise AssertionError("Shouldn't be called")
+
+
+class TestArlManifest(object):
+
+    def test_save_and_load(self):
+        pathname = os.path.join(tempfile.mkdtemp(), 'arlmanifest.json')
+        parsed = [
+            ('/DRI_2km/2015110300/arl12hrindex.csv', [
+                {
+                    'file': '/DRI_2km/2015110300/a.arl',
+                    'first_hour': datetime.datetime(2015, 11, 3, 0),
+                    'last_hour': datetime.datetime(2015, 11, 3, 11)
+                }
+            ])
+        ]
+        search = {'root_dir': '/DRI_2km', 'max_search_depth': None}
+        m = manifest.ArlManifest(search, ['20151103'], 8, parsed,
+            start=datetime.datetime(2015, 11, 3))
+        m.save(pathname)
+
+        loaded = manifest.ArlManifest.load(pathname)
+        assert loaded.search == search
+        assert loaded.date_strs == ['20151103']
+        assert loaded.date_str_len == 8
+        assert loaded.parsed == parsed
+        assert loaded.start == datetime.datetime(2015, 11, 3)
+        assert loaded.end is None
+        assert loaded.generated_at == m.generated_at
+        assert 0 <= loaded.age < 60
+
+    def test_load_missing_or_invalid(self):
+        pathname = os.path.join(tempfile.mkdtemp(), 'arlmanifest.json')
+        assert manifest.ArlManifest.load(pathname) is None
+        with open(pathname, 'w') as f:
+            f.write('{"version": 1}')
+        assert manifest.ArlManifest.load(pathname) is None
+        with open(pathname, 'w') as f:
+            f.write('{"version": 0}')
+        assert manifest.ArlManifest.load(pathname) is None
+
+
+class TestArlFinderWithManifest(object):
+
+    def setup_method(self):
+        self.root_dir = tempfile.mkdtemp()
+        for date_str, contents in INDEX_CONTENTS.items():
+            forecast_dir = os.path.join(self.root_dir, date_str)
+            os.makedirs(forecast_dir)
+            with open(os.path.join(forecast_dir, 'arl12hrindex.csv'), 'w') as f:
+                f.write(contents)
+        self.manifest_file = os.path.join(tempfile.mkdtemp(),
+            'arlmanifest.json')
+        self.start = datetime.datetime(2015, 11, 2, 6)
+        self.end = datetime.datetime(2015, 11, 4, 2)
+
+    def _index(self, start=None, end=None):
+        arlindexer.ArlIndexer('DRI2km', self.root_dir,
+            output_file=os.path.join(tempfile.mkdtemp(), 'index.json'),
+            manifest_file=self.manifest_file).index(start, end)
+
+    def test_uses_manifest(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        expected = arlfinder.ArlFinder(self.root_dir).find(self.start, self.end)
+        assert len(expected['files']) == 4
+        self._index()
+        assert os.path.isfile(self.manifest_file)
+
+        arl_finder = arlfinder.ArlFinder(self.root_dir,
+            manifest_file=self.manifest_file)
+        monkeypatch.setattr(arl_finder, '_find_index_files', _fail)
+        monkeypatch.setattr(arl_finder, '_parse_each_index_file', _fail)
+        r = arl_finder.find(self.start, self.end, include_stats=True)
+        assert r['stats']['counts']['manifest_used'] == 1
+        r.pop('stats')
+        assert r == expected
+
+    def test_falls_back_to_searching(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        expected = arlfinder.ArlFinder(self.root_dir).find(self.start, self.end)
+
+        # missing
+        arl_finder = arlfinder.ArlFinder(self.root_dir,
+            manifest_file=self.manifest_file)
+        r = arl_finder.find(self.start, self.end, include_stats=True)
+        assert r['stats']['counts']['manifest_fallbacks'] == 1
+        r.pop('stats')
+        assert r == expected
+
+        # doesn't cover the time window
+        self._index(datetime.datetime(2015, 11, 4), datetime.datetime(2015, 11, 5))
+        assert arl_finder.find(self.start, self.end, include_stats=True)[
+            'stats']['counts']['manifest_fallbacks'] == 1
+
+        # different search parameters
+        self._index()
+        assert arlfinder.ArlFinder(self.root_dir, max_search_depth=1,
+            manifest_file=self.manifest_file).find(self.start, self.end,
+            include_stats=True)['stats']['counts']['manifest_fallbacks'] == 1
+
+        # stale
+        with open(self.manifest_file) as f:
+            data = json.load(f)
+        data['generated_at'] = '2015-11-04T00:00:00'
+        with open(self.manifest_file, 'w') as f:
+            json.dump(data, f)
+        r = arl_finder.find(self.start, self.end, include_stats=True)
+        assert r['stats']['counts']['manifest_fallbacks'] == 1
+        r.pop('stats')
+        assert r == expected
@@ -0,0 +1,184 @@
+"""Unit tests for met.arl.multiindexer"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import json
+import os
+import tempfile
+import time
+
+from pytest import raises
+
+from met.arl import arlindexer, discoverycache, listingcache, multiindexer
+
+INDEX_CONTENTS = """filename,start,end,interval
+{dir}/a.arl,2015-11-02 00:00:00,2015-11-02 11:00:00,12
+{dir}/b.arl,2015-11-02 12:00:00,2015-11-02 23:00:00,12
+"""
+
+def _create_index_csv(forecast_dir):
+    os.makedirs(forecast_dir)
+    with open(os.path.join(forecast_dir, 'arl12hrindex.csv'), 'w') as f:
+        f.write(INDEX_CONTENTS.format(dir=forecast_dir))
+
+def _backdate(root_dir):
+    # so that the discovery cache trusts listings of the dirs
+    long_ago = time.time() - 3600
+    for d, dirs, files in os.walk(root_dir):
+        os.utime(d, (long_ago, long_ago))
+
+
+class TestLoadConfig(object):
+
+    def test_json(self):
+        pathname = os.path.join(tempfile.mkdtemp(), 'domains.json')
+        with open(pathname, 'w') as f:
+            json.dump({"domains": {"DRI2km": {"root_dir": "/DRI_2km"}}}, f)
+        assert multiindexer.load_config(pathname) == {
+            "domains": {"DRI2km": {"root_dir": "/DRI_2km"}}}
+
+    def test_invalid(self):
+        pathname = os.path.join(tempfile.mkdtemp(), 'domains.json')
+        with open(pathname, 'w') as f:
+            json.dump(["DRI2km"], f)
+        with raises(ValueError):
+            multiindexer.load_config(pathname)
+
+    def test_yaml_not_installed(self, monkeypatch):
+        monkeypatch.setattr(multiindexer, 'yaml', None)
+        pathname = os.path.join(tempfile.mkdtemp(), 'domains.yaml')
+        with open(pathname, 'w') as f:
+            f.write("domains: {}\n")
+        with raises(ValueError) as e_info:
+            multiindexer.load_config(pathname)
+        assert e_info.value.args[0] == multiindexer.YAML_NOT_INSTALLED
+
+
+class TestMultiDomainIndexer(object):
+
+    def setup_method(self):
+        # DRI2km's root dir is nested under DRI6km's, so that their
+        # trees overlap
+        self.root_dir = tempfile.mkdtemp()
+        self.nested_root_dir = os.path.join(self.root_dir, '2km')
+        _create_index_csv(os.path.join(self.root_dir, '2015110200'))
+        _create_index_csv(os.path.join(self.nested_root_dir, '2015110200'))
+        _backdate(self.root_dir)
+        self.output_dir = tempfile.mkdtemp()
+        self.domains = {
+            'DRI6km': {
+                'root_dir': self.root_dir,
+                'output_file': os.path.join(self.output_dir, 'DRI6km.json')
+            },
+            'DRI2km': {
+                'root_dir': self.nested_root_dir,
+                'output_file': os.path.join(self.output_dir, 'DRI2km.json')
+            }
+        }
+
+    def _load_output(self, domain):
+        with open(os.path.join(self.output_dir, domain + '.json')) as f:
+            data = json.load(f)
+        assert data.pop('indexed_at')
+        return data
+
+    def test_invalid_config(self):
+        with raises(ValueError) as e_info:
+            multiindexer.MultiDomainIndexer({})
+        assert e_info.value.args[0] == multiindexer.MultiDomainIndexer.NO_DOMAINS
+
+        with raises(ValueError) as e_info:
+            multiindexer.MultiDomainIndexer({'DRI2km': {}})
+        assert e_info.value.args[0] == (multiindexer.MultiDomainIndexer
+            .ROOT_DIR_REQUIRED.format('DRI2km'))
+
+    def test_config_precedence(self):
+        indexer = multiindexer.MultiDomainIndexer(self.domains,
+            overrides={'max_days_out': 1, 'workers': 2}, max_days_out=3,
+            ignore_pattern='/MOVED/')
+        self.domains['DRI2km']['max_days_out'] = 2
+        self.domains['DRI2km']['ignore_pattern'] = '/OLD/'
+        config = indexer._domain_config('DRI2km')
+        assert config['max_days_out'] == 1
+        assert config['ignore_pattern'] == '/OLD/'
+        assert config['output_file'] == os.path.join(self.output_dir,
+            'DRI2km.json')
+        assert indexer._workers == 2
+
+    def test_per_domain_options(self):
+        for k in multiindexer.MultiDomainIndexer.PER_DOMAIN_OPTIONS:
+            for config in ({'overrides': {k: 'foo.json'}}, {k: 'foo.json'}):
+                with raises(ValueError) as e_info:
+                    multiindexer.MultiDomainIndexer(self.domains, **config)
+                assert e_info.value.args[0] == (multiindexer.MultiDomainIndexer
+                    .PER_DOMAIN_OPTION.format(k))
+
+    def test_index(self, monkeypatch):
+        monkeypatch.setattr(listingcache.DirectoryListingCache, "isfile",
+            lambda self, name: True)
+        listed = []
+        list_dir = discoverycache.list_dir
+        def _list_dir(dirname, index_filename_matcher):
+            listed.append(dirname)
+            return list_dir(dirname, index_filename_matcher)
+        monkeypatch.setattr(discoverycache, 'list_dir', _list_dir)
+
+        multiindexer.MultiDomainIndexer(self.domains, workers=1,
+            server_name='Foo Test Server').index()
+        # the nested tree is listed once
+        assert sorted(listed) == sorted(set(listed))
+        assert len(listed) == 4
+
+        for domain, domain_config in self.domains.items():
+            config = dict(domain_config, server_name='Foo Test Server')
+            multi_domain_output = self._load_output(domain)
+            arlindexer.ArlIndexer(domain, config.pop('root_dir'),
+                **config).index()
+            assert multi_domain_output == self._load_output(domain)
+            assert multi_domain_output['files']
+
+    def test_shared_mongo_client(self, monkeypatch):
+        client = object()
+        monkeypatch.setattr(arlindexer.ArlIndexDB, 'shared_client',
+            classmethod(lambda cls, **config: client))
+
+        written = []
+        def _write_to_mongodb_url(indexer, index_data):
+            written.append((indexer._domain, indexer._config['mongo_client'],
+                indexer._config['defer_dates_update']))
+            # DRI6km's index data is unchanged
+            indexer._mongodb_updated = indexer._domain != 'DRI6km'
+        monkeypatch.setattr(arlindexer.ArlIndexer, '_write_to_mongodb_url',
+            _write_to_mongodb_url)
+
+        dates_updates = []
+        class FakeMetDatesCollection(object):
+            def __init__(self, **config):
+                self.config = config
+            def compute_and_save(self, domain=None):
+                dates_updates.append((self.config['mongo_client'], domain))
+        monkeypatch.setattr(multiindexer, 'met_dates_collection',
+            FakeMetDatesCollection)
+
+        multiindexer.MultiDomainIndexer(self.domains,
+            mongodb_url='mongodb://localhost/arlindex').index()
+        assert sorted(written) == [('DRI2km', client, True),
+            ('DRI6km', client, True)]
+        assert dates_updates == [(client, None)]
+
+        # dates aren't recomputed if no domain's index data changed
+        del self.domains['DRI2km']
+        multiindexer.MultiDomainIndexer(self.domains,
+            mongodb_url='mongodb://localhost/arlindex').index()
+        assert dates_updates == [(client, None)]
+
+    def test_failed_domain(self):
+        self.domains['DRI4km'] = {
+            'root_dir': os.path.join(self.root_dir, 'nonexistent')}
+        with raises(RuntimeError) as e_info:
+            multiindexer.MultiDomainIndexer(self.domains).index()
+        assert e_info.value.args[0] == "Failed to index DRI4km"
+        # the other domains are indexed nonetheless
+        assert self._load_output('DRI2km')['root_dir'] == self.nested_root_dir
+        assert self._load_output('DRI6km')['root_dir'] == self.root_dir
@@ -0,0 +1,98 @@
+"""Unit tests for met.arl.resultcache"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import os
+import tempfile
+import time
+
+from met.arl import resultcache
+
+
+class TestSearchDependencies(object):
+
+    def setup_method(self):
+        self.dir = tempfile.mkdtemp()
+        self.pathname = os.path.join(self.dir, 'arl12hrindex.csv')
+        with open(self.pathname, 'w') as f:
+            f.write('filename,start,end,interval\n')
+
+    def test_unchanged(self):
+        deps = resultcache.SearchDependencies()
+        deps.add(self.dir)
+        deps.add(self.pathname)
+        deps.add(os.path.join(self.dir, 'foo'))
+        assert len(deps) == 3
+        assert deps.is_valid()
+
+    def test_modified_file(self):
+        deps = resultcache.SearchDependencies()
+        deps.add(self.pathname)
+        with open(self.pathname, 'a') as f:
+            f.write('a.arl,2015-11-03 00:00:00,2015-11-03 11:00:00,12\n')
+        assert not deps.is_valid()
+
+    def test_new_file(self):
+        deps = resultcache.SearchDependencies()
+        deps.add(self.dir)
+        deps.add(os.path.join(self.dir, 'foo'))
+        os.makedirs(os.path.join(self.dir, 'foo'))
+        assert not deps.is_valid()
+
+    def test_expired(self):
+        deps = resultcache.SearchDependencies()
+        deps.expire_at(time.time() + 60)
+        assert deps.is_valid()
+        deps.expire_at(time.time() - 1)
+        assert not deps.is_valid()
+
+
+class TestResultCache(object):
+
+    def test_lru_eviction(self):
+        cache = resultcache.ResultCache(2)
+        deps = resultcache.SearchDependencies()
+        cache.put('a', {'files': ['a']}, deps)
+        cache.put('b', {'files': ['b']}, deps)
+        assert cache.get('a') == {'files': ['a']}
+        cache.put('c', {'files': ['c']}, deps)
+        assert cache.get('b') is None
+        assert cache.get('a') == {'files': ['a']}
+        assert cache.get('c') == {'files': ['c']}
+        assert cache.stats() == {
+            'size': 2,
+            'max_size': 2,
+            'hits': 3,
+            'misses': 1,
+            'evictions': 1,
+            'invalidations': 0
+        }
+
+    def test_returns_copies(self):
+        cache = resultcache.ResultCache(2)
+        r = {'files': ['a']}
+        cache.put('a', r, resultcache.SearchDependencies())
+        r['files'].append('b')
+        cache.get('a')['files'].append('c')
+        assert cache.get('a') == {'files': ['a']}
+
+    def test_invalidation(self):
+        cache = resultcache.ResultCache(2)
+        deps = resultcache.SearchDependencies()
+        deps.expire_at(time.time() - 1)
+        cache.put('a', {'files': ['a']}, deps)
+        assert cache.get('a') is None
+        assert len(cache) == 0
+        assert cache.stats()['invalidations'] == 1
+        assert cache.stats()['misses'] == 1
+
+    def test_shared_cache(self, monkeypatch):
+        monkeypatch.setattr(resultcache, '_shared_cache', None)
+        assert resultcache.shared_cache_stats() is None
+        cache = resultcache.shared_cache(10)
+        assert resultcache.shared_cache_stats()['max_size'] == 10
+        assert resultcache.shared_cache(5) is cache
+        assert cache.max_size == 10
+        assert resultcache.shared_cache(20) is cache
+        assert cache.max_size == 20
@@ -0,0 +1,218 @@
+"""Unit tests for met.arl.sqliteindexdb"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import datetime
+import os
+import tempfile
+
+from pytest import raises
+
+from met.arl import arlindexer, sqliteindexdb
+
+def _index_data(server, domain, complete_dates, partial_dates, start, end,
+        latest_forecast):
+    return {
+        'server': server,
+        'domain': domain,
+        'latest_forecast': latest_forecast,
+        'start': start,
+        'end': end,
+        'complete_dates': complete_dates,
+        'partial_dates': partial_dates,
+        'root_dir': '/' + domain,
+        'files': [{'file': '/{}/a.arl'.format(domain), 'first_hour': start,
+            'last_hour': end}] if start else [],
+        'availability': [{'first_hour': start, 'last_hour': end}] if start else [],
+        'fingerprint': server + domain
+    }
+
+INDEX_DATA = [
+    _index_data('a', 'DRI2km', ['2015-11-02'], ['2015-11-01', '2015-11-03'],
+        '2015-11-01T12:00:00', '2015-11-03T11:00:00', '2015-11-02T00:00:00'),
+    _index_data('b', 'DRI2km', ['2015-11-01', '2015-11-02'], ['2015-11-04'],
+        '2015-11-01T00:00:00', '2015-11-04T05:00:00', '2015-11-03T00:00:00'),
+    _index_data('a', 'DRI6km', [], [], None, None, None)
+]
+
+EXPECTED_DATES = [
+    {
+        'domain': 'DRI2km',
+        'complete_dates': ['2015-11-01', '2015-11-02'],
+        'partial_dates': ['2015-11-03', '2015-11-04'],
+        'start': '2015-11-01T00:00:00',
+        'end': '2015-11-04T05:00:00',
+        'latest_forecast': '2015-11-03T00:00:00'
+    },
+    {
+        'domain': 'DRI6km',
+        'complete_dates': [],
+        'partial_dates': [],
+        'start': None,
+        'end': None,
+        'latest_forecast': None
+    }
+]
+
+class TestSqliteIndexDB(object):
+
+    def setup_method(self):
+        self.url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'arlindex.db')
+        self.met_files = arlindexer.met_files_collection(mongodb_url=self.url)
+        self.dates = arlindexer.met_dates_collection(mongodb_url=self.url)
+        for d in INDEX_DATA:
+            self.met_files.update(d)
+
+    def test_backend_selection(self):
+        assert isinstance(self.met_files, sqliteindexdb.SqliteMetFilesCollection)
+        assert isinstance(self.dates, sqliteindexdb.SqliteMetDatesCollection)
+        assert self.met_files.conn.execute(
+            'PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+        with raises(ValueError) as e_info:
+            sqliteindexdb.SqliteMetFilesCollection('sqlite:///')
+        assert e_info.value.args[0] == sqliteindexdb.SqliteIndexDB.INVALID_SQLITE_URL_ERR_MSG
+
+    def _find(self, **query):
+        docs = self.met_files.find(**query)
+        assert all(d.pop('last_indexed') for d in docs)
+        return docs
+
+    def test_met_files(self):
+        assert self._find() == sorted(INDEX_DATA,
+            key=lambda d: (d['server'], d['domain']))
+        assert self._find(domain='DRI2km') == INDEX_DATA[:2]
+        assert self._find(server='b', domain='DRI2km') == INDEX_DATA[1:2]
+        assert self._find(root_dir='/DRI6km') == INDEX_DATA[2:]
+        assert self.met_files.get_fingerprint('a', 'DRI6km') == 'aDRI6km'
+        assert self.met_files.get_fingerprint('c', 'DRI6km') is None
+
+        # updates replace the previous data
+        updated = dict(INDEX_DATA[0], files=[], complete_dates=[],
+            availability=[])
+        self.met_files.update(updated)
+        assert self._find(server='a', domain='DRI2km') == [updated]
+        assert self.met_files.conn.execute('SELECT COUNT(*) FROM arl_files'
+            ' WHERE server = ? AND domain = ?', ('a', 'DRI2km')).fetchone()[0] == 0
+
+        with raises(ValueError):
+            self.met_files.update({'domain': 'DRI2km'})
+
+        self.met_files.clear()
+        assert self._find() == []
+
+    def test_dates(self):
+        assert self.dates.compute() == EXPECTED_DATES
+        assert self.dates.compute('DRI6km') == EXPECTED_DATES[1:]
+        assert self.dates.find() == []
+
+        assert self.dates.compute_and_save('DRI2km') == EXPECTED_DATES[:1]
+        assert self.dates.find() == EXPECTED_DATES[:1]
+        self.dates.compute_and_save()
+        assert self.dates.find() == EXPECTED_DATES
+        assert self.dates.find('DRI6km') == EXPECTED_DATES[1:]
+
+        self.dates.clear()
+        assert self.dates.find() == []
+
+    def test_scoped_clear(self):
+        self.dates.compute_and_save()
+        assert self.met_files.clear(server='b') == ['DRI2km']
+        assert [(d['server'], d['domain']) for d in self._find()] == [
+            ('a', 'DRI2km'), ('a', 'DRI6km')]
+        assert self.met_files.conn.execute('SELECT COUNT(*) FROM availability'
+            ' WHERE server = ?', ('b',)).fetchone()[0] == 0
+
+        assert self.met_files.clear(server='c') == []
+        assert self.met_files.clear(domain='DRI6km') == ['DRI6km']
+        self.dates.compute_and_save(domain='DRI6km')
+        assert [d['domain'] for d in self.dates.find()] == ['DRI2km']
+
+    def test_older_than(self):
+        self.met_files.conn.execute("UPDATE met_files SET last_indexed ="
+            " '2015-11-01T00:00:00' WHERE server = 'a'")
+        # touched records aren't old
+        self.met_files.touch('a', 'DRI6km')
+        older_than = datetime.datetime(2016,1,1)
+        assert self.met_files.clear(older_than=older_than) == ['DRI2km']
+        assert [(d['server'], d['domain']) for d in self._find()] == [
+            ('a', 'DRI6km'), ('b', 'DRI2km')]
+
+        # records written before last_indexed was recorded
+        self.met_files.conn.execute("UPDATE met_files SET last_indexed = NULL,"
+            " doc = json_set(doc, '$.indexed_at', '2015-11-02T00:00:00')"
+            " WHERE server = 'b'")
+        assert self.met_files.clear(older_than=older_than) == ['DRI2km']
+        assert [d['server'] for d in self._find()] == ['a']
+
+    def test_ttl(self):
+        met_files = sqliteindexdb.SqliteMetFilesCollection(self.url, ttl=3600)
+        met_files.conn.execute("UPDATE met_files SET last_indexed ="
+            " '2015-11-01T00:00:00' WHERE server = 'b'")
+        assert met_files.update(INDEX_DATA[0]) == ['DRI2km']
+        assert [(d['server'], d['domain']) for d in self._find()] == [
+            ('a', 'DRI2km'), ('a', 'DRI6km')]
+        assert met_files.update(INDEX_DATA[0]) == []
+        assert self.met_files.update(INDEX_DATA[0]) == []
+
+    def test_covers(self):
+        covers = self.met_files.covers
+        start = datetime.datetime(2015,11,1,12)
+        end = datetime.datetime(2015,11,3,11,30)
+        assert covers(start, end) == [{'server': 'a', 'domain': 'DRI2km'},
+            {'server': 'b', 'domain': 'DRI2km'}]
+        assert covers(start, end, server='b') == [
+            {'server': 'b', 'domain': 'DRI2km'}]
+        assert covers(start, end, root_dir='/DRI2km', server='a') == [
+            {'server': 'a', 'domain': 'DRI2km'}]
+        assert covers(start, end, root_dir='/DRI6km') == []
+        assert covers(start, datetime.datetime(2015,11,3,12)) == [
+            {'server': 'b', 'domain': 'DRI2km'}]
+        assert covers(datetime.datetime(2015,10,31), end) == []
+
+        # windows ending exactly at the end hour
+        pst = datetime.timezone(datetime.timedelta(hours=-8))
+        for end in (datetime.datetime(2015,11,3,11),
+                datetime.datetime(2015,11,3,11,0,0,500000),
+                datetime.datetime(2015,11,3,11, tzinfo=datetime.timezone.utc),
+                datetime.datetime(2015,11,3,3,59, tzinfo=pst)):
+            assert covers(start, end, server='a') == [
+                {'server': 'a', 'domain': 'DRI2km'}]
+
+        with raises(ValueError):
+            covers(end, start)
+
+    def test_hour_range_index(self):
+        plan = ' '.join(str(r) for r in self.met_files.conn.execute(
+            'EXPLAIN QUERY PLAN SELECT file FROM arl_files WHERE domain = ?'
+            ' AND first_hour <= ? AND last_hour >= ?',
+            ('DRI2km', '2015-11-02T00:00:00', '2015-11-02T00:00:00')))
+        assert 'arl_files_hours' in plan
+
+    def test_indexer(self):
+        root_dir = tempfile.mkdtemp()
+        arlindexer.ArlIndexer('DRI4km', root_dir, mongodb_url=self.url,
+            server_name='c').index()
+        docs = self.met_files.find(domain='DRI4km')
+        assert len(docs) == 1
+        assert docs[0]['root_dir'] == root_dir
+        assert self.dates.find('DRI4km')[0]['domain'] == 'DRI4km'
+
+    def test_indexer_recomputes_dates_of_expired_domains(self):
+        self.dates.compute_and_save()
+        assert self.dates.find('DRI2km')[0]['end'] == '2015-11-04T05:00:00'
+        self.met_files.conn.execute("UPDATE met_files SET last_indexed ="
+            " '2015-11-01T00:00:00' WHERE server = 'b'")
+
+        # indexing DRI4km expires server b's DRI2km index data
+        arlindexer.ArlIndexer('DRI4km', tempfile.mkdtemp(),
+            mongodb_url=self.url, server_name='c', ttl=3600).index()
+        assert self.dates.find('DRI2km') == [{
+            'domain': 'DRI2km',
+            'complete_dates': ['2015-11-02'],
+            'partial_dates': ['2015-11-01', '2015-11-03'],
+            'start': '2015-11-01T12:00:00',
+            'end': '2015-11-03T11:00:00',
+            'latest_forecast': '2015-11-02T00:00:00'
+        }]
@@ -0,0 +1,206 @@
+"""Unit tests for met.arl.watcher"""
+
+__author__ = "Joel Dubowy"
+__copyright__ = "Copyright 2016, AirFire, PNW, USFS"
+
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from pytest import raises
+
+from met.arl import arlindexer, watcher
+
+def _create_forecast(root_dir, forecast, with_arl_files=True):
+    """Creates forecast dir with an index of two 12 hour arl files"""
+    date_str = forecast.strftime('%Y%m%d%H')
+    forecast_dir = os.path.join(root_dir, date_str)
+    os.makedirs(forecast_dir)
+    with open(os.path.join(forecast_dir, 'arl12hrindex.csv'), 'w') as f:
+        f.write("filename,start,end,interval\n")
+        for i in range(2):
+            first_hour = forecast + datetime.timedelta(hours=12*i)
+            f.write("{}.{}.arl,{},{},12\n".format(date_str, i,
+                first_hour.strftime('%Y-%m-%d %H:%M:%S'),
+                (first_hour + datetime.timedelta(hours=11)).strftime(
+                    '%Y-%m-%d %H:%M:%S')))
+    if with_arl_files:
+        _create_arl_files(forecast_dir)
+    return forecast_dir
+
+def _create_arl_files(forecast_dir):
+    date_str = os.path.basename(forecast_dir)
+    for i in range(2):
+        with open(os.path.join(forecast_dir, '{}.{}.arl'.format(
+                date_str, i)), 'w') as f:
+            f.write('arl')
+
+def _backdate(*pathnames):
+    long_ago = time.time() - 3600
+    for p in pathnames:
+        os.utime(p, (long_ago, long_ago))
+
+
+class TestArlIndexWatcher(object):
+
+    def setup_method(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.output_file = os.path.join(tempfile.mkdtemp(), 'index.json')
+        forecast_dir = _create_forecast(self.root_dir,
+            datetime.datetime(2015,11,1,0))
+        _backdate(forecast_dir, self.root_dir)
+        self.indexer = arlindexer.ArlIndexer('DRI2km', self.root_dir,
+            server_name="Foo Test Server", output_file=self.output_file,
+            incremental=True)
+        self.watcher = watcher.ArlIndexWatcher(self.indexer, debounce=30,
+            min_interval=60, max_wait=300)
+        stop_event = threading.Event()
+        stop_event.set()
+        self.watcher.run(stop_event=stop_event)
+        self.now = time.time()
+
+    def _poll(self, seconds_later):
+        return self.watcher.poll(now=self.now + seconds_later)
+
+    def _latest_forecast(self):
+        with open(self.output_file) as f:
+            return json.load(f)['latest_forecast']
+
+    def test_index_file_ready(self):
+        forecast_dir = _create_forecast(self.root_dir,
+            datetime.datetime(2015,11,1,12), with_arl_files=False)
+        index_file = os.path.join(forecast_dir, 'arl12hrindex.csv')
+        assert not self.indexer.index_file_ready(index_file)
+        _create_arl_files(forecast_dir)
+        assert self.indexer.index_file_ready(index_file)
+        assert not self.indexer.index_file_ready(
+            os.path.join(forecast_dir, 'nonexistent.csv'))
+
+    def test_watches_latest_forecast(self):
+        assert self.watcher.num_runs == 1
+        assert self.indexer.latest_index_file == os.path.join(self.root_dir,
+            '2015110100', 'arl12hrindex.csv')
+        assert sorted(self.watcher._watched) == [self.root_dir,
+            os.path.join(self.root_dir, '2015110100')]
+
+    def test_new_forecast(self):
+        assert self._latest_forecast() == '2015-11-01T00:00:00'
+        assert not self._poll(10)
+
+        # the index file is written before its arl files
+        forecast_dir = _create_forecast(self.root_dir,
+            datetime.datetime(2015,11,1,12), with_arl_files=False)
+        assert not self._poll(100)
+        assert forecast_dir in self.watcher._watched
+        # waits for changes to settle, and then for the arl files
+        assert not self._poll(120)
+        assert not self._poll(140)
+        assert self.watcher.num_runs == 1
+
+        _create_arl_files(forecast_dir)
+        assert not self._poll(150)
+        assert not self._poll(170)
+        assert self._poll(190)
+        assert self.watcher.num_runs == 2
+        assert self._latest_forecast() == '2015-11-01T12:00:00'
+
+    def test_min_interval(self):
+        _create_forecast(self.root_dir, datetime.datetime(2015,11,1,12))
+        assert not self._poll(1)
+        # debounced, but within 60 seconds of the last run
+        assert not self._poll(40)
+        assert self._poll(70)
+        assert self.watcher.num_runs == 2
+        assert self._latest_forecast() == '2015-11-01T12:00:00'
+
+    def test_max_wait(self):
+        forecast_dir = _create_forecast(self.root_dir,
+            datetime.datetime(2015,11,1,12), with_arl_files=False)
+        assert not self._poll(100)
+        # the index file's arl files start being waited for
+        assert not self._poll(140)
+        assert not self._poll(420)
+        assert self.watcher.num_runs == 1
+        assert self._poll(450)
+        assert self.watcher.num_runs == 2
+        assert not self.watcher._waiting_since
+
+    def test_index_files_ready_independently(self):
+        ready_dir = _create_forecast(self.root_dir,
+            datetime.datetime(2015,11,1,12))
+        waiting_dir = _create_forecast(self.root_dir,
+            datetime.datetime(2015,11,1,6), with_arl_files=False)
+        assert not self._poll(100)
+        assert self._poll(140)
+        assert self._latest_forecast() == '2015-11-01T12:00:00'
+        assert list(self.watcher._waiting_since) == [
+            os.path.join(waiting_dir, 'arl12hrindex.csv')]
+        assert waiting_dir in self.watcher._watched
+
+        assert not self._poll(210)
+        _create_arl_files(waiting_dir)
+        assert not self._poll(220)
+        assert self._poll(260)
+        assert self.watcher.num_runs == 3
+        assert not self.watcher._waiting_since
+        assert sorted(self.watcher._watched) == [self.root_dir, ready_dir]
+
+    def test_stops_watching_superseded_dirs(self):
+        forecast_dir = _create_forecast(self.root_dir,
+            datetime.datetime(2015,11,1,12))
+        assert not self._poll(100)
+        assert self._poll(140)
+        assert sorted(self.watcher._watched) == [self.root_dir, forecast_dir]
+
+    def test_removed_forecast(self):
+        _create_forecast(self.root_dir, datetime.datetime(2015,11,1,12))
+        assert not self._poll(100)
+        assert self._poll(140)
+
+        # there are no new index files to wait for
+        shutil.rmtree(os.path.join(self.root_dir, '2015110100'))
+        assert not self._poll(200)
+        assert self._poll(240)
+        assert self.watcher.num_runs == 3
+        with open(self.output_file) as f:
+            assert not [f for f in json.load(f)['files']
+                if '2015110100' in f['file']]
+
+
+class TestArlIndexWatcherFailures(object):
+
+    def setup_method(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.indexer = arlindexer.ArlIndexer('DRI2km', self.root_dir,
+            server_name="Foo Test Server", output_file=os.path.join(
+            tempfile.mkdtemp(), 'index.json'), incremental=True)
+        self.index = self.indexer.index
+        self.indexer.index = self._index
+        self.fail = True
+        self.watcher = watcher.ArlIndexWatcher(self.indexer, debounce=30,
+            min_interval=60)
+
+    def _index(self):
+        if self.fail:
+            raise RuntimeError("Failed to record")
+        self.index()
+
+    def test_initial_index_fails(self):
+        stop_event = threading.Event()
+        stop_event.set()
+        self.watcher.run(stop_event=stop_event)
+        assert self.watcher.num_runs == 0
+
+        # retried after min_interval
+        now = time.time()
+        assert not self.watcher.poll(now=now + 10)
+        with raises(RuntimeError):
+            self.watcher.poll(now=now + 70)
+        self.fail = False
+        assert self.watcher.poll(now=now + 140)
+        assert self.watcher.num_runs == 1
+        assert self.watcher._watched == {self.root_dir: None}